@@ -0,0 +1,338 @@
+"""Run the benchmarks and write the results as JSON.
+
+    python -m benchmarks.run -o results.json
+    python -m benchmarks.run --compare results.json
+
+Every benchmark runs --repeat times on the same synthetic input and the
+best time is kept. With --compare, rates more than --threshold below the
+baseline are reported as regressions and the exit status is 1.
+"""
+import argparse
+import itertools
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+from src import bgpmsg
+from src.mrtparser import ALL_ATTRS, MRTParser, RIBParser
+from src.prefixset import decode
+from src.update import Update, split_prefixes
+
+from . import synthmrt
+
+BENCHMARKS = []
+
+
+def benchmark(func):
+    """Register func(inputs) -> number of operations."""
+    BENCHMARKS.append(func)
+    return func
+
+
+class Inputs(object):
+    """Synthetic files and decoded updates shared by the benchmarks, built on first use."""
+
+    def __init__(self, workdir, size, seed):
+        self.workdir = workdir
+        self.size = size
+        self.seed = seed
+        self._updates = {}
+
+    def mrt(self, suffix=''):
+        filename = os.path.join(self.workdir, 'updates-%d-%d.mrt%s' % (self.size, self.seed, suffix))
+        if not os.path.exists(filename):
+            synthmrt.write_updates(filename, self.size, seed=self.seed)
+        return filename
+
+    def two_octet_mrt(self):
+        """The updates of mrt() as BGP4MP_MESSAGE records with 2-octet AS paths."""
+        filename = os.path.join(self.workdir, 'updates-as2-%d-%d.mrt' % (self.size, self.seed))
+        if not os.path.exists(filename):
+            synthmrt.write_updates(filename, self.size, seed=self.seed, four_octet=False)
+        return filename
+
+    def shared_mrt(self):
+        """Updates whose attributes come from 2000 sets per peer."""
+        filename = os.path.join(self.workdir, 'updates-shared-%d-%d.mrt' % (self.size, self.seed))
+        if not os.path.exists(filename):
+            synthmrt.write_updates(filename, self.size, seed=self.seed, attr_sets=2000)
+        return filename
+
+    def rib(self):
+        filename = os.path.join(self.workdir, 'rib-%d-%d.mrt.gz' % (self.size, self.seed))
+        if not os.path.exists(filename):
+            synthmrt.write_rib(filename, self.size, seed=self.seed)
+        return filename
+
+    def updates(self, shared=False):
+        """The updates of the MRT file (or of shared_mrt) as dicts with prefix strings."""
+        if shared not in self._updates:
+            filename = self.shared_mrt() if shared else self.mrt()
+            self._updates[shared] = [{'attr': attr, 'nlri': list(map(decode, nlri)),
+                                      'withdraw': list(map(decode, withdraw))}
+                                     for _, attr, nlri, withdraw in MRTParser(filename)]
+        return self._updates[shared]
+
+    def packed_updates(self):
+        """The updates of the MRT file as Updates with packed prefixes, as the parser makes them."""
+        if 'packed' not in self._updates:
+            self._updates['packed'] = [Update(attr, nlri, withdraw)
+                                       for _, attr, nlri, withdraw in MRTParser(self.mrt())]
+        return self._updates['packed']
+
+    def prepare(self):
+        """Write the files and decode the updates, so that no benchmark times building its input."""
+        for suffix in ('', '.gz', '.bz2'):
+            self.mrt(suffix)
+        self.two_octet_mrt()
+        self.rib()
+        self.updates()
+        self.updates(shared=True)
+        self.packed_updates()
+
+
+def _parse(filename):
+    count = 0
+    for _ in MRTParser(filename, ALL_ATTRS):
+        count += 1
+    return count
+
+
+@benchmark
+def parse_mrt(inputs):
+    return _parse(inputs.mrt())
+
+
+@benchmark
+def parse_mrt_gz(inputs):
+    return _parse(inputs.mrt('.gz'))
+
+
+@benchmark
+def parse_mrt_bz2(inputs):
+    return _parse(inputs.mrt('.bz2'))
+
+
+@benchmark
+def parse_bgpdump(inputs):
+    """The dpkt based parser, if dpkt is installed.
+
+    dpkt does not read the 4-octet AS paths of BGP4MP_MESSAGE_AS4 records and
+    BGPDump skips what it cannot read, so it parses a BGP4MP_MESSAGE file.
+    """
+    try:
+        from src.pybgpdump import BGPDump
+    except ImportError:
+        return None
+    count = 0
+    # the file holds inputs.size updates; stop there should the end of file be missed
+    for _ in itertools.islice(BGPDump(inputs.two_octet_mrt()), inputs.size):
+        count += 1
+    if count != inputs.size:
+        raise RuntimeError('BGPDump read %d of the %d updates' % (count, inputs.size))
+    return count
+
+
+@benchmark
+def parse_rib(inputs):
+    count = 0
+    for _ in RIBParser(inputs.rib()):
+        count += 1
+    return count
+
+
+@benchmark
+def encode_update(inputs):
+    updates = inputs.updates()
+    buf = bytearray()
+    for update in updates:
+        attrs = bgpmsg.encode_attributes(update['attr'])
+        bgpmsg.encode_update(buf, attrs, [bgpmsg.encode_prefix(p) for p in update['nlri']],
+                             [bgpmsg.encode_prefix(p) for p in update['withdraw']])
+        del buf[:]
+    return len(updates)
+
+
+@benchmark
+def encode_update_packed(inputs):
+    updates = inputs.packed_updates()
+    buf = bytearray()
+    for update in updates:
+        attrs = bgpmsg.encode_attributes(update.attr)
+        nlri, _, withdraw, _ = split_prefixes(update)
+        bgpmsg.encode_update(buf, attrs, nlri, withdraw)
+        del buf[:]
+    return len(updates)
+
+
+@benchmark
+def decode_update(inputs):
+    buf = bytearray()
+    for update in inputs.updates():
+        attrs = bgpmsg.encode_attributes(update['attr'])
+        bgpmsg.encode_update(buf, attrs, [bgpmsg.encode_prefix(p) for p in update['nlri']],
+                             [bgpmsg.encode_prefix(p) for p in update['withdraw']])
+    messages, _ = bgpmsg.split_messages(buf)
+    start = time.perf_counter()
+    for _, body in messages:
+        bgpmsg.decode_update(body)
+    return len(messages), time.perf_counter() - start
+
+
+@benchmark
+def exabgp_format(inputs):
+    from src.bgpreplay import ExaBGPAgent
+    agent = ExaBGPAgent()
+    updates = inputs.updates()
+    for update in updates:
+        agent._to_exabgp_format(update)
+    return len(updates)
+
+
+@benchmark
+def exabgp_format_shared(inputs):
+    from src.bgpreplay import ExaBGPAgent
+    agent = ExaBGPAgent()
+    updates = inputs.updates(shared=True)
+    for update in updates:
+        agent._to_exabgp_format(update)
+    return len(updates)
+
+
+def _replay(**options):
+    from src.bgpreplay import (DEFAULTS, BgpUpdateGenerator, check_nexthop_format,
+                               check_peer_format)
+    config = dict(DEFAULTS, agent='null', rate=1e9, **options)
+    config['peers'] = check_peer_format(config['peers'])
+    config['nexthop'] = check_nexthop_format(config['nexthop'])
+    bgpgen = BgpUpdateGenerator(config)
+    bgpgen.agent.start(config['peers'], config['local_ip'], config['local_as'])
+    start = time.perf_counter()
+    if config['mrt']:
+        bgpgen._send_update_from_source(source_type='mrt_file', filenames=config['mrt'])
+    else:
+        bgpgen._send_random_update()
+    if bgpgen.packer:
+        bgpgen.packer.close()
+    return bgpgen.agent.updates, time.perf_counter() - start
+
+
+@benchmark
+def replay_mrt(inputs):
+    return _replay(mrt=[inputs.mrt()])
+
+
+@benchmark
+def replay_mrt_packed(inputs):
+    return _replay(mrt=[inputs.mrt()], pack=True)
+
+
+@benchmark
+def replay_mrt_pipeline(inputs):
+    return _replay(mrt=[inputs.mrt()], pipeline='thread')
+
+
+@benchmark
+def replay_mrt_filtered(inputs):
+    """Keep the prefixes of 100.0.0.0/6, about 1.5% of them; the ops are the updates read."""
+    _, elapsed = _replay(mrt=[inputs.mrt()], filter_prefix=['100.0.0.0/6'])
+    return inputs.size, elapsed
+
+
+@benchmark
+def replay_random(inputs):
+    return _replay(count=inputs.size, update_type='mixed', seed=inputs.seed)
+
+
+def run(inputs, names=None, repeat=3):
+    results = {}
+    for func in BENCHMARKS:
+        if names and func.__name__ not in names:
+            continue
+        best = None
+        ops = None
+        for _ in range(repeat):
+            start = time.perf_counter()
+            result = func(inputs)
+            elapsed = time.perf_counter() - start
+            if result is None:
+                break
+            if isinstance(result, tuple):  # the benchmark timed itself
+                result, elapsed = result
+            ops = result
+            best = elapsed if best is None else min(best, elapsed)
+        if ops is None:
+            print('%-22s skipped' % func.__name__)
+            continue
+        results[func.__name__] = {'ops': ops, 'seconds': best, 'rate': ops / best if best else 0.0}
+        print('%-22s %10d ops in %8.3fs  %12.1f/s' % (func.__name__, ops, best, results[func.__name__]['rate']))
+    return results
+
+
+def _commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'],
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline, threshold):
+    """Print the rate of each benchmark relative to baseline; return the regressed names."""
+    regressions = []
+    for name, result in sorted(results.items()):
+        old = baseline['results'].get(name)
+        if not old or not old['rate']:
+            continue
+        ratio = result['rate'] / old['rate']
+        regressed = ratio < 1 - threshold
+        if regressed:
+            regressions.append(name)
+        print('%-22s %6.2fx%s' % (name, ratio, '  REGRESSION' if regressed else ''))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('benchmarks', nargs='*', help='benchmarks to run, default all')
+    parser.add_argument('-o', '--output', help='write the results to this JSON file')
+    parser.add_argument('--size', type=int, default=50000, help='number of updates and RIB prefixes')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--workdir', default=os.path.join(tempfile.gettempdir(), 'bgpreplay-bench'),
+                        help='where the synthetic MRT files are kept between runs')
+    parser.add_argument('--compare', help='baseline JSON results to compare with')
+    parser.add_argument('--threshold', type=float, default=0.1,
+                        help='slowdown reported as a regression, default 0.1 (10%%)')
+    args = parser.parse_args()
+    if not os.path.isdir(args.workdir):
+        os.makedirs(args.workdir)
+    inputs = Inputs(args.workdir, args.size, args.seed)
+    inputs.prepare()
+    results = {
+        'meta': {
+            'commit': _commit(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'size': args.size,
+            'seed': args.seed,
+            'time': time.time(),
+        },
+        'results': run(inputs, args.benchmarks, args.repeat),
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if compare(results['results'], baseline, args.threshold):
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
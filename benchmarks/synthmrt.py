@@ -0,0 +1,154 @@
+"""Write synthetic MRT files for the benchmarks.
+
+The files are deterministic for a given seed and size, so runs on
+different machines or commits read exactly the same input.
+
+    python -m benchmarks.synthmrt updates --count 100000 -o updates.mrt.gz
+    python -m benchmarks.synthmrt rib --count 100000 -o bview.mrt.bz2
+"""
+import argparse
+import bz2
+import gzip
+import random
+import socket
+import struct
+
+from src import bgpmsg
+from src.mrtparser import (BGP4MP, BGP4MP_MESSAGE, BGP4MP_MESSAGE_AS4, MRT_HEADER, PEER_INDEX_TABLE,
+                           PEER_TYPE_AS4, RIB_IPV4_UNICAST, TABLE_DUMP_V2)
+
+START_TIME = 1500000000
+COLLECTOR_IP = '10.255.0.1'
+LOCAL_AS = 65000
+
+
+def open_output(filename):
+    """Open filename for writing, compressed according to its extension."""
+    if filename.endswith('.gz'):
+        return gzip.open(filename, 'wb')
+    if filename.endswith('.bz2'):
+        return bz2.open(filename, 'wb')
+    return open(filename, 'wb')
+
+
+def _record(f, timestamp, mrt_type, subtype, body):
+    f.write(MRT_HEADER.pack(timestamp, mrt_type, subtype, len(body)))
+    f.write(body)
+
+
+def _peers(num):
+    return [('10.0.%d.%d' % (i // 250, i % 250 + 1), 64512 + i) for i in range(num)]
+
+
+def _prefix(rng):
+    length = rng.choice((16, 20, 22, 23, 24, 24, 24, 24))
+    addr = rng.randint(1 << 24, (224 << 24) - 1) >> (32 - length) << (32 - length)
+    return '%s/%d' % (socket.inet_ntoa(struct.pack('!I', addr)), length)
+
+
+def _attributes(rng, peer_as, nexthop):
+    return {
+        'origin': rng.randrange(3),
+        'as_path': [peer_as] + [rng.randint(1, 400000) for _ in range(rng.randint(1, 6))],
+        'nexthop': nexthop,
+        'med': rng.choice((0, 0, 10, 100)),
+        'community': ['%d:%d' % (peer_as, rng.randint(1, 999)) for _ in range(rng.randint(0, 3))],
+    }
+
+
+def write_updates(filename, count, peers=4, prefixes=3, withdraw_ratio=0.2, rate=100, seed=1,
+                  attr_sets=0, four_octet=True):
+    """Write count BGP4MP_MESSAGE_AS4 updates of about rate updates per second.
+
+    Each update announces 1 to prefixes prefixes and, with withdraw_ratio
+    probability, withdraws some of the prefixes announced before. With
+    attr_sets the attributes of each peer are drawn from that many sets,
+    the popular ones more often, as paths recur in real update files;
+    otherwise every update has attributes of its own. Without four_octet
+    the records are BGP4MP_MESSAGE with 2-octet AS paths (AS_TRANS and
+    AS4_PATH for the larger ASNs), for parsers that only read those.
+    """
+    rng = random.Random(seed)
+    peer_list = _peers(peers)
+    if attr_sets:
+        shared = [[bgpmsg.encode_attributes(_attributes(rng, peer_as, peer_ip), four_octet)
+                   for _ in range(attr_sets)]
+                  for peer_ip, peer_as in peer_list]
+        weights = [1.0 / (rank + 1) for rank in range(attr_sets)]
+    collector = socket.inet_aton(COLLECTOR_IP)
+    announced = []
+    buf = bytearray()
+    with open_output(filename) as f:
+        for i in range(count):
+            peer_ip, peer_as = peer_list[i % peers]
+            nlri = [_prefix(rng) for _ in range(rng.randint(1, prefixes))]
+            withdraw = []
+            if announced and rng.random() < withdraw_ratio:
+                withdraw = [announced.pop(rng.randrange(len(announced)))
+                            for _ in range(min(len(announced), rng.randint(1, prefixes)))]
+            announced.extend(nlri)
+            if len(announced) > 100000:
+                del announced[:50000]
+            del buf[:]
+            if attr_sets:
+                attrs = rng.choices(shared[i % peers], weights)[0]
+            else:
+                attrs = bgpmsg.encode_attributes(_attributes(rng, peer_as, peer_ip), four_octet)
+            bgpmsg.encode_update(buf, attrs, [bgpmsg.encode_prefix(p) for p in nlri],
+                                 [bgpmsg.encode_prefix(p) for p in withdraw])
+            body = struct.pack('!IIHH' if four_octet else '!HHHH', peer_as, LOCAL_AS, 0, bgpmsg.AFI_IPV4)
+            body += socket.inet_aton(peer_ip) + collector + bytes(buf)
+            _record(f, START_TIME + i // rate, BGP4MP, BGP4MP_MESSAGE_AS4 if four_octet else BGP4MP_MESSAGE,
+                    body)
+    return count
+
+
+def write_rib(filename, count, peers=4, seed=1):
+    """Write a TABLE_DUMP_V2 dump of count IPv4 prefixes, each with a route from every peer."""
+    rng = random.Random(seed)
+    peer_list = _peers(peers)
+    with open_output(filename) as f:
+        body = socket.inet_aton(COLLECTOR_IP) + struct.pack('!HH', 0, peers)
+        for peer_ip, peer_as in peer_list:
+            body += struct.pack('!B', PEER_TYPE_AS4) + socket.inet_aton(peer_ip) * 2
+            body += struct.pack('!I', peer_as)
+        _record(f, START_TIME, TABLE_DUMP_V2, PEER_INDEX_TABLE, body)
+        # routes share a limited number of attribute sets, as in real tables
+        blobs = [[bgpmsg.encode_attributes(_attributes(rng, peer_as, peer_ip)) for _ in range(256)]
+                 for peer_ip, peer_as in peer_list]
+        seen = set()
+        for seq in range(count):
+            prefix = _prefix(rng)
+            while prefix in seen:
+                prefix = _prefix(rng)
+            seen.add(prefix)
+            body = struct.pack('!I', seq) + bgpmsg.encode_prefix(prefix) + struct.pack('!H', peers)
+            for index in range(peers):
+                blob = rng.choice(blobs[index])
+                body += struct.pack('!HIH', index, START_TIME, len(blob)) + blob
+            _record(f, START_TIME, TABLE_DUMP_V2, RIB_IPV4_UNICAST, body)
+    return count
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('kind', choices=['updates', 'rib'])
+    parser.add_argument('-o', '--output', required=True, help='file to write, .gz or .bz2 to compress')
+    parser.add_argument('--count', type=int, default=100000, help='number of updates or RIB prefixes')
+    parser.add_argument('--peers', type=int, default=4)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--attr_sets', type=int, default=0,
+                        help='draw the update attributes of each peer from this many sets')
+    parser.add_argument('--two_octet', action='store_true',
+                        help='write BGP4MP_MESSAGE updates with 2-octet AS paths')
+    args = parser.parse_args()
+    if args.kind == 'updates':
+        write_updates(args.output, args.count, args.peers, seed=args.seed, attr_sets=args.attr_sets,
+                      four_octet=not args.two_octet)
+    else:
+        write_rib(args.output, args.count, args.peers, seed=args.seed)
+    print('wrote %d %s to %s' % (args.count, args.kind, args.output))
+
+
+if __name__ == '__main__':
+    main()
@@ -19,14 +19,18 @@ setup(
         "Programming Language :: Python",
         "License :: BSD License",
         ],
-    packages=find_packages(exclude=['tests']),
+    packages=find_packages(exclude=['tests', 'benchmarks']),
     entry_points = {
         'console_scripts': [
             'bgpreplay=src.bgpreplay:main',
+            'bgpreplay-sink=src.sink:main',
             ]
         },
     install_requires=[
         'dpkt>=1.6',
         'oslo.config',
-        ]
+        ],
+    extras_require={
+        'numpy': ['numpy'],
+        },
     )
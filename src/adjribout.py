@@ -0,0 +1,111 @@
+"""Remember what was announced to each peer, to send only actual changes.
+"""
+from .packer import freeze
+from .radix import RadixTree
+
+
+class AdjRibOut(object):
+    """The routes announced to the peers, one radix trie per peer.
+
+    Updates without a peers list go to all peers alike and share one trie.
+    The attributes of a route are stored as an interned, hashable key, so
+    identical attribute sets are kept once and compared by identity.
+    Announcements of a route already announced with the same attributes
+    and withdrawals of routes never announced are dropped.
+    """
+
+    def __init__(self):
+        self.ribs = {}   # peer key, None for all peers -> RadixTree
+        self.attrs = {}  # attribute key -> [interned key, number of routes]
+        self.announced = 0
+        self.withdrawn = 0
+        self.dup_announces = 0
+        self.dup_withdraws = 0
+
+    def _intern(self, attr):
+        key = freeze(attr)
+        entry = self.attrs.get(key)
+        if entry is None:
+            entry = self.attrs[key] = [key, 0]
+        return entry[0]
+
+    def _release(self, key):
+        entry = self.attrs[key]
+        entry[1] -= 1
+        if not entry[1]:
+            del self.attrs[key]
+
+    def _update(self, peer, key, nlri, withdraw):
+        rib = self.ribs.get(peer)
+        if rib is None:
+            rib = self.ribs[peer] = RadixTree()
+        sent_withdraw = []
+        for prefix in withdraw:
+            old = rib.delete(prefix)
+            if old is None:
+                self.dup_withdraws += 1
+            else:
+                self._release(old)
+                sent_withdraw.append(prefix)
+        sent_nlri = []
+        for prefix in nlri:
+            old = rib.insert(prefix, key)
+            if old is key:
+                self.dup_announces += 1
+                continue
+            entry = self.attrs.get(key)
+            if entry is None:  # released by a withdrawal in this same update
+                entry = self.attrs[key] = [key, 0]
+            entry[1] += 1
+            if old is not None:
+                self._release(old)
+            sent_nlri.append(prefix)
+        self.announced += len(sent_nlri)
+        self.withdrawn += len(sent_withdraw)
+        return sent_nlri, sent_withdraw
+
+    def filter(self, update):
+        """Return the updates to send instead of update; an empty list if nothing changed."""
+        nlri = update.get('nlri') or []
+        withdraw = update.get('withdraw') or []
+        key = self._intern(update['attr']) if nlri else None
+        peers = update.get('peers')
+        if not peers:
+            nlri, withdraw = self._update(None, key, nlri, withdraw)
+            results = [dict(update, nlri=nlri, withdraw=withdraw)] if nlri or withdraw else []
+        else:
+            # peers may differ in what they already have; group those that get the same update
+            groups = {}
+            for peer in peers:
+                sent = self._update(peer, key, nlri, withdraw)
+                if sent[0] or sent[1]:
+                    groups.setdefault((tuple(sent[0]), tuple(sent[1])), []).append(peer)
+            results = [dict(update, nlri=list(n), withdraw=list(w), peers=p)
+                       for (n, w), p in groups.items()]
+        if key is not None and key in self.attrs and not self.attrs[key][1]:
+            del self.attrs[key]
+        return results
+
+    def withdraw_all(self, size=10000):
+        """Yield updates withdrawing every announced route, size prefixes each, and forget them."""
+        for peer, rib in self.ribs.items():
+            prefixes = [prefix for prefix, _ in rib.items()]
+            for i in range(0, len(prefixes), size):
+                update = {'attr': {}, 'nlri': [], 'withdraw': prefixes[i:i + size]}
+                if peer is not None:
+                    update['peers'] = [peer]
+                self.withdrawn += len(update['withdraw'])
+                yield update
+            rib.clear()
+        self.attrs = {}
+
+    def size(self):
+        return sum(len(rib) for rib in self.ribs.values())
+
+    def report(self):
+        ribs = ', '.join('%s: %d' % (peer or 'all peers', len(rib))
+                         for peer, rib in sorted(self.ribs.items(), key=lambda i: str(i[0])))
+        return ('adj-rib-out: %d routes (%s) with %d attribute sets; announced %d, withdrew %d, '
+                'dropped %d unchanged announcements and %d withdrawals of unknown routes' % (
+                    self.size(), ribs or 'empty', len(self.attrs), self.announced, self.withdrawn,
+                    self.dup_announces, self.dup_withdraws))
@@ -0,0 +1,175 @@
+"""Interned, read-only sets of path attributes.
+
+Sources that see the same attributes over and over (MRT records sharing
+their attribute bytes, text lines with the same columns, RIB routes) hand
+out one AttrSet per distinct set instead of a fresh dict per update, keyed
+by what they read (the raw bytes or text). An AttrSet is a dict that
+cannot be modified and hashes by content once, so an agent can keep what
+it derives from it (ExaBGP text, YaBGP JSON, wire bytes) in an AttrCache
+and find it again with one dict lookup.
+
+Updates may still carry plain dicts (random updates, BGPStream, --timestamps);
+AttrCache encodes those every time.
+"""
+import threading
+from collections import OrderedDict
+
+from . import metrics
+
+
+def _freeze(value):
+    if isinstance(value, (list, tuple)):
+        return tuple(_freeze(v) for v in value)
+    if isinstance(value, dict):
+        return tuple(sorted((k, _freeze(v)) for k, v in value.items()))
+    return value
+
+
+class AttrSet(dict):
+    """A read-only attribute dict, hashed by content the first time it is hashed."""
+    __slots__ = ('_hash',)  # set by the first __hash__, there is no __init__ to keep creation cheap
+
+    def __hash__(self):
+        try:
+            return self._hash
+        except AttributeError:
+            pass
+        try:  # values are scalars or flat lists (AS path, communities)
+            value = hash(frozenset([(k, tuple(v) if type(v) is list else v) for k, v in self.items()]))
+        except TypeError:
+            value = hash(_freeze(self))
+        self._hash = value
+        return value
+
+    def _read_only(self, *args, **kwargs):
+        raise TypeError('AttrSet is read-only, use with_value() or dict(attr)')
+
+    __setitem__ = __delitem__ = __ior__ = _read_only
+    clear = pop = popitem = setdefault = update = _read_only
+
+    def __reduce__(self):
+        return AttrSet, (dict(self),)
+
+
+EMPTY = AttrSet()
+
+
+class Memo(object):
+    """A bounded dict for the caches of the sources, emptied when it is full.
+
+    Entries that are never looked up again are not free: they outlive the
+    young garbage collections and get promoted. When a fill of the memo saw
+    fewer than size / 8 hits, the data does not repeat itself and nothing is
+    stored for the next idle * size puts.
+    """
+
+    def __init__(self, size=4096, idle=8):
+        self.size = size
+        self.idle = idle
+        self.entries = {}
+        self.hits = 0
+        self.skip = 0
+
+    def get(self, key):
+        value = self.entries.get(key)
+        if value is not None:
+            self.hits += 1
+        return value
+
+    def put(self, key, value):
+        if self.skip:
+            self.skip -= 1
+            return value
+        entries = self.entries
+        if len(entries) >= self.size:
+            entries.clear()
+            if self.hits < self.size >> 3:
+                self.skip = self.size * self.idle
+            self.hits = 0
+            if self.skip:
+                return value
+        entries[key] = value
+        return value
+
+
+# (id of an AttrSet, name, value) -> (that AttrSet, the AttrSet with name set to value);
+# keeping the original alive keeps its id from being reused
+_replaced = Memo()
+
+
+def with_value(attr, name, value):
+    """Set attr[name] to value: in place for a dict, as another AttrSet for an AttrSet.
+
+    The AttrSet made for an AttrSet, name and value is remembered by the
+    identity of the original, so the same replacement (a next hop out of
+    --nexthop, a prepended AS path) gives the same object without hashing
+    the attributes.
+    """
+    if type(attr) is not AttrSet:
+        attr[name] = value
+        return attr
+    key = (id(attr), name, tuple(value) if type(value) is list else value)
+    found = _replaced.get(key)
+    if found is None:
+        found = _replaced.put(key, (attr, AttrSet(attr, **{name: value})))
+    return found[1]
+
+
+class AttrCache(object):
+    """A bounded LRU map from AttrSets to what an agent encodes them into.
+
+    get(attr) returns encode(attr), calling encode only for AttrSets it has
+    not seen recently and for plain dicts. The counters tell whether size
+    (--attr_cache) fits the working set of the replay. The --fanout channel
+    threads share their agent's cache, so the entries are updated under a
+    lock; encode runs outside it.
+    """
+    default_size = 4096  # set from --attr_cache
+
+    def __init__(self, encode, name, size=None):
+        self.encode = encode
+        self.name = name
+        self.size = self.default_size if size is None else size
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.uncached = 0
+        if metrics.registry.enabled:
+            self._register_metrics()
+
+    def _register_metrics(self):
+        registry = metrics.registry
+        registry.gauge('bgpreplay_attr_cache_hits', 'Attribute sets found encoded',
+                       lambda: self.hits, agent=self.name)
+        registry.gauge('bgpreplay_attr_cache_misses', 'Attribute sets encoded and cached',
+                       lambda: self.misses, agent=self.name)
+        registry.gauge('bgpreplay_attr_cache_uncached', 'Plain attribute dicts encoded',
+                       lambda: self.uncached, agent=self.name)
+        registry.gauge('bgpreplay_attr_cache_entries', 'Encoded attribute sets kept',
+                       lambda: len(self.entries), agent=self.name)
+
+    def get(self, attr):
+        if type(attr) is not AttrSet or not self.size:
+            self.uncached += 1
+            return self.encode(attr)
+        entries = self.entries
+        with self.lock:
+            value = entries.get(attr)
+            if value is not None:
+                self.hits += 1
+                entries.move_to_end(attr)
+                return value
+            self.misses += 1
+        value = self.encode(attr)
+        with self.lock:
+            entries[attr] = value
+            if len(entries) > self.size:
+                entries.popitem(last=False)
+        return value
+
+    def report(self):
+        lookups = self.hits + self.misses
+        return '%s attribute cache: %d hits, %d misses (%.1f%% hits), %d plain dicts, %d/%d entries' % (
+            self.name, self.hits, self.misses, 100.0 * self.hits / lookups if lookups else 0.0,
+            self.uncached, len(self.entries), self.size)
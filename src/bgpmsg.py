@@ -0,0 +1,401 @@
+"""Encode and decode BGP-4 messages (RFC 4271) in wire format.
+"""
+import struct
+import socket
+
+MARKER = b'\xff' * 16
+HEADER_LEN = 19
+MAX_MESSAGE_LEN = 4096
+BGP_VERSION = 4
+
+# message types
+OPEN = 1
+UPDATE = 2
+NOTIFICATION = 3
+KEEPALIVE = 4
+
+# path attribute type codes
+ORIGIN = 1
+AS_PATH = 2
+NEXT_HOP = 3
+MULTI_EXIT_DISC = 4
+LOCAL_PREF = 5
+COMMUNITIES = 8
+MP_REACH_NLRI = 14
+MP_UNREACH_NLRI = 15
+AS4_PATH = 17
+TIMESTAMP = 255  # reserved for development (RFC 2042): send time, a double
+
+# path attribute flags
+FLAG_OPTIONAL = 0x80
+FLAG_TRANSITIVE = 0x40
+FLAG_EXTENDED_LENGTH = 0x10
+
+AS_SET = 1
+AS_SEQUENCE = 2
+AS_TRANS = 23456
+
+# capabilities (RFC 5492)
+OPT_PARAM_CAPABILITY = 2
+CAP_MULTIPROTOCOL = 1
+CAP_FOUR_OCTET_AS = 65
+
+AFI_IPV4 = 1
+AFI_IPV6 = 2
+SAFI_UNICAST = 1
+
+# notification error codes
+ERR_MSG_HEADER = 1
+ERR_OPEN_MESSAGE = 2
+ERR_UPDATE_MESSAGE = 3
+ERR_HOLD_TIMER_EXPIRED = 4
+ERR_FSM = 5
+ERR_CEASE = 6
+
+ORIGIN_CODES = {'igp': 0, 'egp': 1, 'incomplete': 2}
+
+_HEADER = struct.Struct('!16sHB')
+_UPDATE_HEADER = MARKER + b'\x00\x00' + bytes([UPDATE])
+
+KEEPALIVE_MESSAGE = _HEADER.pack(MARKER, HEADER_LEN, KEEPALIVE)
+
+
+def _message(msg_type, body):
+    return _HEADER.pack(MARKER, HEADER_LEN + len(body), msg_type) + body
+
+
+def encode_open(local_as, hold_time, router_id):
+    """Build an OPEN advertising IPv4 and IPv6 unicast and 4-octet AS number support."""
+    caps = struct.pack('!BBHBB', CAP_MULTIPROTOCOL, 4, AFI_IPV4, 0, SAFI_UNICAST)
+    caps += struct.pack('!BBHBB', CAP_MULTIPROTOCOL, 4, AFI_IPV6, 0, SAFI_UNICAST)
+    caps += struct.pack('!BBI', CAP_FOUR_OCTET_AS, 4, local_as)
+    params = struct.pack('!BB', OPT_PARAM_CAPABILITY, len(caps)) + caps
+    my_as = local_as if local_as <= 0xffff else AS_TRANS
+    body = struct.pack('!BHH4sB', BGP_VERSION, my_as, hold_time,
+                       socket.inet_aton(router_id), len(params)) + params
+    return _message(OPEN, body)
+
+
+def decode_open(body):
+    """Return (version, asn, hold_time, router_id, capabilities) from an OPEN body.
+
+    The ASN is taken from the 4-octet AS capability if it is present.
+    """
+    version, asn, hold_time, router_id, params_len = struct.unpack_from('!BHH4sB', body)
+    caps = {}
+    params = body[10:10 + params_len]
+    i = 0
+    while i + 2 <= len(params):
+        p_type, p_len = params[i], params[i + 1]
+        if p_type == OPT_PARAM_CAPABILITY:
+            j = i + 2
+            while j + 2 <= i + 2 + p_len:
+                c_code, c_len = params[j], params[j + 1]
+                caps.setdefault(c_code, []).append(bytes(params[j + 2:j + 2 + c_len]))
+                j += 2 + c_len
+        i += 2 + p_len
+    if CAP_FOUR_OCTET_AS in caps:
+        asn = struct.unpack('!I', caps[CAP_FOUR_OCTET_AS][0])[0]
+    return version, asn, hold_time, socket.inet_ntoa(router_id), caps
+
+
+def encode_notification(code, subcode=0, data=b''):
+    return _message(NOTIFICATION, struct.pack('!BB', code, subcode) + data)
+
+
+def encode_prefix(prefix):
+    """Encode 'a.b.c.d/len' (or an IPv6 prefix) as an NLRI prefix: length byte followed by the significant octets."""
+    addr, _, length = prefix.partition('/')
+    if ':' in addr:
+        length = int(length) if length else 128
+        return bytes([length]) + socket.inet_pton(socket.AF_INET6, addr)[:(length + 7) // 8]
+    length = int(length) if length else 32
+    return bytes([length]) + socket.inet_aton(addr)[:(length + 7) // 8]
+
+
+def split_afi(prefixes):
+    """Encode a list of prefix strings into lists of IPv4 and IPv6 NLRI prefixes."""
+    ipv4, ipv6 = [], []
+    for prefix in prefixes:
+        (ipv6 if ':' in prefix else ipv4).append(encode_prefix(prefix))
+    return ipv4, ipv6
+
+
+def ipv6_nexthop(nexthop):
+    """The IPv6 next hop for nexthop, IPv4-mapped if nexthop is an IPv4 address."""
+    nexthop = str(nexthop)
+    if ':' in nexthop:
+        return socket.inet_pton(socket.AF_INET6, nexthop)
+    return b'\x00' * 10 + b'\xff\xff' + socket.inet_aton(nexthop)
+
+
+def decode_prefixes(data):
+    """Decode a run of IPv4 NLRI prefixes into 'a.b.c.d/len' strings."""
+    prefixes = []
+    i = 0
+    end = len(data)
+    while i < end:
+        length = data[i]
+        octets = (length + 7) // 8
+        addr = bytes(data[i + 1:i + 1 + octets]) + b'\x00' * (4 - octets)
+        prefixes.append('%s/%d' % (socket.inet_ntoa(addr), length))
+        i += 1 + octets
+    return prefixes
+
+
+def decode_prefixes6(data):
+    """Decode a run of IPv6 NLRI prefixes into strings."""
+    prefixes = []
+    i = 0
+    end = len(data)
+    while i < end:
+        length = data[i]
+        octets = (length + 7) // 8
+        addr = bytes(data[i + 1:i + 1 + octets]) + b'\x00' * (16 - octets)
+        prefixes.append('%s/%d' % (socket.inet_ntop(socket.AF_INET6, addr), length))
+        i += 1 + octets
+    return prefixes
+
+
+def _attribute(flags, code, value):
+    if len(value) > 255:
+        return struct.pack('!BBH', flags | FLAG_EXTENDED_LENGTH, code, len(value)) + value
+    return struct.pack('!BBB', flags, code, len(value)) + value
+
+
+def _as_path_segments(as_path, four_octet):
+    fmt = '!%dI' if four_octet else '!%dH'
+    value = b''
+    for i in range(0, len(as_path), 255):
+        seg = as_path[i:i + 255]
+        if not four_octet:
+            seg = [asn if asn <= 0xffff else AS_TRANS for asn in seg]
+        value += struct.pack('!BB', AS_SEQUENCE, len(seg)) + struct.pack(fmt % len(seg), *seg)
+    return value
+
+
+def _community(community):
+    if isinstance(community, int):
+        return community
+    if isinstance(community, str):
+        asn, _, value = community.partition(':')
+        return (int(asn) << 16) | int(value)
+    if isinstance(community, dict):
+        return (int(community['asn']) << 16) | int(community['value'])
+    return (int(community.asn) << 16) | int(community.value)
+
+
+def _as_list(as_path):
+    if isinstance(as_path, str):
+        return [int(asn) for asn in as_path.split() if asn.isdigit()]
+    return [int(asn) for asn in as_path]
+
+
+def encode_attributes(attr, four_octet=True):
+    """Encode the attributes of an update dict as a path attribute blob.
+
+    Attributes set to None are left out, unknown attribute names are ignored.
+    """
+    out = b''
+    origin = attr.get('origin')
+    if origin is not None:
+        origin = ORIGIN_CODES.get(origin, origin)
+        out += _attribute(FLAG_TRANSITIVE, ORIGIN, bytes([int(origin)]))
+    as_path = attr.get('as_path')
+    if as_path is not None:
+        as_path = _as_list(as_path)
+        out += _attribute(FLAG_TRANSITIVE, AS_PATH, _as_path_segments(as_path, four_octet))
+        if not four_octet and any(asn > 0xffff for asn in as_path):
+            out += _attribute(FLAG_OPTIONAL | FLAG_TRANSITIVE, AS4_PATH,
+                              _as_path_segments(as_path, True))
+    nexthop = attr.get('nexthop')
+    if nexthop is not None and ':' not in str(nexthop):  # IPv6 next hops go in MP_REACH_NLRI
+        out += _attribute(FLAG_TRANSITIVE, NEXT_HOP, socket.inet_aton(str(nexthop)))
+    med = attr.get('med')
+    if med is not None:
+        out += _attribute(FLAG_OPTIONAL, MULTI_EXIT_DISC, struct.pack('!I', int(med)))
+    local_pref = attr.get('local_pref')
+    if local_pref is not None:
+        out += _attribute(FLAG_TRANSITIVE, LOCAL_PREF, struct.pack('!I', int(local_pref)))
+    community = attr.get('community')
+    if community:
+        if isinstance(community, str):
+            community = community.split()
+        values = [_community(c) for c in community]
+        out += _attribute(FLAG_OPTIONAL | FLAG_TRANSITIVE, COMMUNITIES,
+                          struct.pack('!%dI' % len(values), *values))
+    timestamp = attr.get('timestamp')
+    if timestamp is not None:
+        out += _attribute(FLAG_OPTIONAL | FLAG_TRANSITIVE, TIMESTAMP, struct.pack('!d', timestamp))
+    return out
+
+
+def encode_update(out, attrs, nlri, withdraw):
+    """Append UPDATE messages to the bytearray out.
+
+    attrs is an encoded path attribute blob, nlri and withdraw are lists of
+    encoded prefixes. Prefixes are packed into as few messages as the
+    4096-byte message limit allows; withdrawals go first so that a prefix
+    both withdrawn and announced ends up announced.
+    """
+    room = MAX_MESSAGE_LEN - HEADER_LEN - 4
+    if nlri and len(attrs) + max(map(len, nlri)) > room:
+        raise ValueError('path attributes too large for a single UPDATE')
+    w = n = 0
+    n_withdraw = len(withdraw)
+    n_nlri = len(nlri)
+    while w < n_withdraw or n < n_nlri:
+        start = len(out)
+        out += _UPDATE_HEADER
+        out += b'\x00\x00'
+        space = room
+        while w < n_withdraw and len(withdraw[w]) <= space:
+            out += withdraw[w]
+            space -= len(withdraw[w])
+            w += 1
+        struct.pack_into('!H', out, start + HEADER_LEN, len(out) - start - HEADER_LEN - 2)
+        if w == n_withdraw and n < n_nlri and len(attrs) + len(nlri[n]) <= space:
+            out += struct.pack('!H', len(attrs))
+            out += attrs
+            space -= len(attrs)
+            while n < n_nlri and len(nlri[n]) <= space:
+                out += nlri[n]
+                space -= len(nlri[n])
+                n += 1
+        else:
+            out += b'\x00\x00'
+        struct.pack_into('!H', out, start + 16, len(out) - start)
+
+
+def _chunks(prefixes, room):
+    """Split prefixes into runs of at most room bytes."""
+    chunk = []
+    size = 0
+    for prefix in prefixes:
+        if size + len(prefix) > room:
+            yield chunk
+            chunk = []
+            size = 0
+        chunk.append(prefix)
+        size += len(prefix)
+    if chunk:
+        yield chunk
+
+
+def _mp_message(out, attrs):
+    out += _HEADER.pack(MARKER, HEADER_LEN + 4 + len(attrs), UPDATE)
+    out += struct.pack('!HH', 0, len(attrs))
+    out += attrs
+
+
+def encode_mp_update(out, attrs, nexthop, nlri, withdraw, afi=AFI_IPV6):
+    """Append UPDATE messages carrying nlri and withdraw in MP_REACH_NLRI/MP_UNREACH_NLRI.
+
+    nexthop is the encoded next hop address; the other arguments are as for
+    encode_update().
+    """
+    flags = FLAG_OPTIONAL | FLAG_EXTENDED_LENGTH
+    room = MAX_MESSAGE_LEN - HEADER_LEN - 4 - 4 - 3
+    for chunk in _chunks(withdraw, room):
+        value = struct.pack('!HB', afi, SAFI_UNICAST) + b''.join(chunk)
+        _mp_message(out, struct.pack('!BBH', flags, MP_UNREACH_NLRI, len(value)) + value)
+    head = struct.pack('!HBB', afi, SAFI_UNICAST, len(nexthop)) + nexthop + b'\x00'
+    room -= len(attrs) + len(nexthop) + 2
+    if nlri and room < max(map(len, nlri)):
+        raise ValueError('path attributes too large for a single UPDATE')
+    for chunk in _chunks(nlri, room):
+        value = head + b''.join(chunk)
+        _mp_message(out, attrs + struct.pack('!BBH', flags, MP_REACH_NLRI, len(value)) + value)
+
+
+def encode_end_of_rib(afi=AFI_IPV4):
+    """The End-of-RIB marker (RFC 4724): an empty UPDATE for IPv4, an empty MP_UNREACH_NLRI otherwise."""
+    if afi == AFI_IPV4:
+        return _message(UPDATE, b'\x00\x00\x00\x00')
+    out = bytearray()
+    _mp_message(out, struct.pack('!BBBHB', FLAG_OPTIONAL, MP_UNREACH_NLRI, 3, afi, SAFI_UNICAST))
+    return bytes(out)
+
+
+def split_messages(buf):
+    """Split buf into complete messages.
+
+    Returns a list of (type, body) and the number of bytes consumed, so the
+    caller can keep a trailing partial message for the next read.
+    """
+    messages = []
+    i = 0
+    end = len(buf)
+    while end - i >= HEADER_LEN:
+        length = (buf[i + 16] << 8) | buf[i + 17]
+        if length < HEADER_LEN or length > MAX_MESSAGE_LEN:
+            raise ValueError('bad message length %d' % length)
+        if end - i < length:
+            break
+        messages.append((buf[i + 18], bytes(buf[i + HEADER_LEN:i + length])))
+        i += length
+    return messages, i
+
+
+def append_raw(out, data):
+    """Append already encoded messages to out."""
+    out += data
+
+
+def decode_attributes(data, four_octet=True):
+    """Decode a path attribute blob into an attribute dict like encode_attributes() takes."""
+    attr = {}
+    i = 0
+    end = len(data)
+    while i < end:
+        flags, code = data[i], data[i + 1]
+        if flags & FLAG_EXTENDED_LENGTH:
+            length = struct.unpack_from('!H', data, i + 2)[0]
+            i += 4
+        else:
+            length = data[i + 2]
+            i += 3
+        value = data[i:i + length]
+        i += length
+        if code == ORIGIN:
+            attr['origin'] = value[0]
+        elif code == AS_PATH or (code == AS4_PATH and not four_octet):
+            size = 4 if four_octet or code == AS4_PATH else 2
+            fmt = '!%dI' if size == 4 else '!%dH'
+            as_path = []
+            j = 0
+            while j < length:
+                seg_type, seg_len = value[j], value[j + 1]
+                if seg_type == AS_SEQUENCE:
+                    as_path.extend(struct.unpack_from(fmt % seg_len, value, j + 2))
+                j += 2 + seg_len * size
+            attr['as_path'] = as_path
+        elif code == NEXT_HOP:
+            attr['nexthop'] = socket.inet_ntoa(bytes(value))
+        elif code == MULTI_EXIT_DISC:
+            attr['med'] = struct.unpack_from('!I', value)[0]
+        elif code == LOCAL_PREF:
+            attr['local_pref'] = struct.unpack_from('!I', value)[0]
+        elif code == COMMUNITIES:
+            attr['community'] = ['%d:%d' % (c >> 16, c & 0xffff)
+                                 for c in struct.unpack_from('!%dI' % (length // 4), value)]
+        elif code == TIMESTAMP and length == 8:
+            attr['timestamp'] = struct.unpack_from('!d', value)[0]
+        elif code == MP_REACH_NLRI and value[0:3] == b'\x00\x02\x01':
+            nh_len = value[3]
+            attr.setdefault('nexthop', socket.inet_ntop(socket.AF_INET6, bytes(value[4:20])))
+            attr['mp_nlri'] = decode_prefixes6(value[5 + nh_len:])
+        elif code == MP_UNREACH_NLRI and value[0:3] == b'\x00\x02\x01':
+            attr['mp_withdraw'] = decode_prefixes6(value[3:])
+    return attr
+
+
+def decode_update(body, four_octet=True):
+    """Decode an UPDATE body into (attr, nlri, withdraw) with prefixes as strings."""
+    wlen = struct.unpack_from('!H', body)[0]
+    withdraw = decode_prefixes(body[2:2 + wlen])
+    alen = struct.unpack_from('!H', body, 2 + wlen)[0]
+    attr = decode_attributes(body[4 + wlen:4 + wlen + alen], four_octet)
+    nlri = decode_prefixes(body[4 + wlen + alen:]) + attr.pop('mp_nlri', [])
+    withdraw += attr.pop('mp_withdraw', [])
+    return attr, nlri, withdraw
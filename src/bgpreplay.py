@@ -11,13 +11,32 @@ import json
 import traceback
 import ipaddress
 import socket
-import requests
 import logging
-from requests.auth import HTTPBasicAuth
+from array import array
 from oslo_config import cfg
 
+from . import bgpmsg, metrics
+from .adjribout import AdjRibOut
+from .attrset import AttrCache, AttrSet, with_value
+from .exabgpapi import ExaBGPChannel
+from .mrtmerge import MRTMerge, expand_files
+from .fanout import FanoutAgent, parse_peer_values
+from .mrtindex import ReplayProgress, parse_time
+from .mrtparser import ALL_ATTRS, ATTR_CODES, MRTParser, RIBParser, decode_attributes
+from .packer import UpdatePacker
+from .pacer import Pacer
+from .pipeline import Pipeline
+from .prefixset import PrefixSet
+from .randomgen import RandomUpdates, parse_histogram
+from .recorder import Recorder
+from .speaker import BGPSpeaker
+from .textsource import TextSource, check_prefix
+from .update import Update, prefix_counts, replace, split_prefixes
+from .updatefilter import UpdateFilter, parse_asns, parse_nexthop_map
+from .workers import Shard, run_workers
+
 logger = logging.getLogger('bgpreplay')
-logger.setLevel(logging.INFO)
+logger.setLevel(logging.WARNING)  # INFO, with every update sent, only with --logfile
 
 WELLKNOWN_DEFAULTS = {
     'as_path': [1],
@@ -27,6 +46,8 @@ WELLKNOWN_DEFAULTS = {
 
 class ConsoleAgent(object):
     """Print BGP messages to stdout."""
+    multi_peer = True
+
     def start(self, *args):
         return
 
@@ -37,21 +58,48 @@ class ConsoleAgent(object):
         return True
 
     def send_update(self, update):
-        logger.info(str(update))
+        logger.info('%s', update)
         print(update)
 
+    def send_eor(self):
+        print('End-of-RIB')
+
+
+EXABGP_ATTRS = {
+    'local_pref': 'local-preference',
+    'nexthop': 'next-hop',
+    'as_path': 'as-path',
+    'med': 'med',
+    'origin': 'origin',
+    'community': 'community',
+}
+ORIGIN_NAMES = dict((code, name) for name, code in bgpmsg.ORIGIN_CODES.items())
+
+
+def _exabgp_value(name, value):
+    if name == 'origin' and not isinstance(value, str):
+        return ORIGIN_NAMES.get(value, 'incomplete')
+    if isinstance(value, (list, tuple)):
+        return '[ %s ]' % ' '.join(str(v) for v in value)
+    return str(value)
+
 
 class ExaBGPAgent(object):
     """This tells us to use ExaBGP as BGP library to connect to BGP routers and send out updates."""
+    multi_peer = True  # update['peers'] become neighbor selectors of the statements
     exabgp = None
     config_file = None
-    socket = None
+    channel = None
+    neighbors = {}
+
+    def __init__(self):
+        self.attributes = AttrCache(self._exabgp_attributes, 'exabgp')
 
     def start(self, peers, local_ip, local_as):
-        """Start ExaBGP in subprocess."""
+        """Start ExaBGP in subprocess and wait for its API process to connect back."""
         CONFIG = """
 process announce {
-    run nc -l -U %s;
+    run nc -U %s;
     encoder json;
 }
         """
@@ -65,115 +113,112 @@ neighbor %s {
     router-id 192.168.192.192;
     api {
         processes [announce];
+        neighbor-changes;
     }
 }
         """
-        _, self.config_file = tempfile.mkstemp()
-        _, self.logfile = tempfile.mkstemp()
-        self.sock_path = os.path.join(tempfile.gettempdir(), 'bgpreplay.sock')
+        fd, self.config_file = tempfile.mkstemp()
+        os.close(fd)
+        fd, self.logfile = tempfile.mkstemp()
+        os.close(fd)
+        sock_path = os.path.join(tempfile.gettempdir(), 'bgpreplay-%d.sock' % os.getpid())
         print('exabgp log is located at: %s' % self.logfile)
+        self.neighbors = {}
         with open(self.config_file, 'w') as f:
-            config = CONFIG % self.sock_path
+            config = CONFIG % sock_path
             f.write('%s\n' % config)
             for peer in peers:
                 peer_ip, peer_port, peer_as = peer
+                self.neighbors[peer_ip] = self.neighbors['%s:%s' % (peer_ip, peer_port)] = peer_ip
                 peer_config = PEER_CONFIG % (peer_ip, peer_port, peer_as, local_ip, local_as)
                 f.write('%s\n' % peer_config)
-        self.exabgp = subprocess.Popen(
-            ['env', 'exabgp.tcp.bind=' + '0.0.0.0', 'exabgp.tcp.port=' + '179',
-             'exabgp.daemon.daemonize=false', 'exabgp.daemon.user=root',
-             'exabgp.log.level=INFO',
-             'exabgp.log.all=true',
-             'exabgp.log.destination=%s' % self.logfile,
-             'exabgp', self.config_file],
-             stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        self.channel = ExaBGPChannel()
+        self.channel.listen(sock_path)
+        with open(self.logfile, 'a') as log:
+            self.exabgp = subprocess.Popen(
+                ['env', 'exabgp.tcp.bind=' + '0.0.0.0', 'exabgp.tcp.port=' + '179',
+                 'exabgp.daemon.daemonize=false', 'exabgp.daemon.user=root',
+                 'exabgp.api.ack=true',
+                 'exabgp.log.level=INFO',
+                 'exabgp.log.all=true',
+                 'exabgp.log.destination=%s' % self.logfile,
+                 'exabgp', self.config_file],
+                stdin=subprocess.DEVNULL, stdout=log, stderr=log)
         self.peers = peers
-        self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
-        success = False
-        for _ in range(10):
-            try:
-                self.socket.connect(sock_path)
-                success = True
-                break
-            except:
-                time.sleep(1)
-        if not success:
-            print('ExaBGPAgent failed to start')
+        if not self.channel.accept(60, lambda: self.exabgp.poll() is None):
+            print('ExaBGPAgent failed to start, see %s' % self.logfile)
             sys.exit(-1)
 
     def stop(self):
         """stop Exabgp running in the subprocess."""
         print('stopping...')
-        if self.socket:
-            self.socket.close()
+        if self.channel:
+            self.channel.flush(timeout=10)
+            print(self.channel.report())
+            print(self.attributes.report())
+            self.channel.close()
+            self.channel = None
         if self.exabgp:
             self.exabgp.kill()
+            self.exabgp = None
         if self.config_file:
             os.remove(self.config_file)
-        if self.sock_path:
-            os.remove(self.sock_path)
+            self.config_file = None
 
     def connected(self, timeout=60):
-        """wait for connection to BGP peers."""
-        with open(self.logfile) as f:
-            for _ in range(timeout):
-                log = f.read()
-                for peer_ip, _, _ in self.peers: # must have at least one connected peer
-                    if re.search('connected.*%s' % peer_ip, log):
-                        return True
-                time.sleep(1)
-        return False
+        """wait until ExaBGP reports a session to one of the peers up."""
+        return self.channel.wait_up(timeout)
+
+    @staticmethod
+    def _exabgp_attributes(attr):
+        return ' '.join(['%s %s' % (EXABGP_ATTRS[name], _exabgp_value(name, value))
+                         for name, value in attr.items()
+                         if name in EXABGP_ATTRS and value is not None])
 
     def _to_exabgp_format(self, update):
-        exabgp_attr_name_conversion = {
-                'local_pref': 'local-preference', 'nexthop': 'next-hop', 'as_path': 'as-path',
-                'med': 'med', 'origin': 'origin',
-                }
-        statements = []
-        peers = update.get('peers', [])
+        peers = update.get('peers')
         if peers:
-            announce_template = 'neighbor {neighbor} announce attributes {attr} nlri {nlri}'
-            withdraw_template = 'neihgbor {neighbor} withdraw {withdraw}'
+            selectors = ['neighbor %s ' % self.neighbors.get(peer, peer) for peer in peers]
         else:
-            announce_template = 'announce attributes {attr} nlri {nlri}'
-            withdraw_template = 'withdraw route {withdraw}'
-        nlri = update.get('nlri', [])
+            selectors = ['']
+        statements = []
+        nlri = update.get('nlri')
         if nlri:
-            attr = ''
-            for at_name, at_value in update['attr'].items():
-                if at_name in exabgp_attr_name_conversion:
-                    attr += ' %s %s' % (exabgp_attr_name_conversion[at_name], str(at_value))
-                else:
-                    print(at_name, at_value)
+            attr = self.attributes.get(update['attr'])
             nlri = ' '.join(nlri)
-            for peer in peers:
-                statements.append(announce_template.format(neighbor=peer, attr=attr, nlri=nlri))
-            if not peers:
-                statements.append(announce_template.format(attr=attr, nlri=nlri))
-        withdraw = update.get('withdraw', [])
+            statements.extend(['%sannounce attributes %s nlri %s' % (selector, attr, nlri)
+                               for selector in selectors])
+        withdraw = update.get('withdraw')
         if withdraw:
-            withdraw = ' '.join(withdraw)
-            for peer in peers:
-                statements.append(withdraw_template.format(neighbor=peer, withdraw=withdraw))
-            if not peers:
-                statements.append(withdraw_template.format(withdraw=withdraw))
+            statements.extend(['%swithdraw route %s' % (selector, prefix)
+                               for selector in selectors for prefix in withdraw])
         return statements
 
+    def send_eor(self):
+        """ask ExaBGP to send End-of-RIB for IPv4 and IPv6 unicast and wait until it is acknowledged."""
+        if self.channel:
+            self.channel.send(['announce eor ipv4 unicast', 'announce eor ipv6 unicast'])
+            self.channel.flush()
+
     def send_update(self, update):
-        """send the update to client process in ExaBGP."""
-        if self.socket:
-            logger.info(str(update))
-            for statement in self._to_exabgp_format(update):
-                statement += '\r\n'
-                self.socket.sendall(statement.encode('utf-8'))
+        """queue the update for the client process in ExaBGP."""
+        if self.channel:
+            logger.info('%s', update)
+            self.channel.send(self._to_exabgp_format(update))
 
 
 class YaBGPAgent(object):
-    """
-    """
+    """Use YaBGP as BGP speaker, sending the updates through its REST API."""
     yabgp = None
+    client = None
     yabgp_port = 5555
     yabgp_url = 'http://localhost:%d/v1' % yabgp_port
+    window = 8  # requests in flight, see --yabgp_window
+    attr_codes = {'origin': 1, 'as_path': 2, 'nexthop': 3, 'med': 4, 'local_pref': 5, 'community': 8}
+
+    def __init__(self):
+        self.attributes = AttrCache(self._yabgp_attributes, 'yabgp')
+
     def start(self, peers, local_ip, local_as):
         peer_ip, peer_port, peer_as = peers[0]
         self.yabgp = subprocess.Popen([
@@ -184,83 +229,194 @@ class YaBGPAgent(object):
             '--bgp-remote_port', str(peer_port),
             '--rest-bind_host', '127.0.0.1',
             '--rest-bind_port', str(self.yabgp_port)],
-            stdin=subprocess.PIPE, stdout=subprocess.PIPE)
-        time.sleep(5)
-        self.session = requests.Session()
+            stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL)
+        from .yabgpapi import YaBGPClient
         self.peer = None
-        self.headers = {'content-type':'application/json'}
+        self.client = YaBGPClient(self.yabgp_url, self.window)
+        if not self.client.wait_ready(60, lambda: self.yabgp.poll() is None):
+            print('YaBGPAgent failed to start')
+            sys.exit(-1)
+        self.client.probe_transport()
+        self.client.start()
 
     def stop(self):
+        if self.client:
+            self.client.flush()
+            print(self.client.report())
+            print(self.attributes.report())
+            self.client.stop()
+            self.client = None
         if self.yabgp:
             self.yabgp.kill()
+            self.yabgp = None
 
-    def _get(self, path):
-        data = self.session.get(self.yabgp_url + '/' + path, auth=HTTPBasicAuth('admin', 'admin'))
-        return data.json()
-
-    def connected(self):
-        for _ in range(60):
-            data = self._get('peers')
-            for peer in data.get('peers', []):
+    def connected(self, timeout=60):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            for peer in self.client.get('peers').get('peers', []):
                 if peer['fsm'] == 'ESTABLISHED':
                     self.peer = peer
                     return True
-        return
+            time.sleep(0.2)
+        return False
+
+    def _yabgp_attributes(self, attr):
+        """map attribute names to YaBGP's codes and add the missing well-known attributes."""
+        attributes = {}
+        for name, value in attr.items():
+            code = self.attr_codes.get(name)
+            if code is None or value is None:
+                continue
+            if name == 'as_path':
+                value = [[bgpmsg.AS_SEQUENCE, value]]
+            elif name == 'origin' and isinstance(value, str):
+                value = bgpmsg.ORIGIN_CODES.get(value, 2)
+            attributes[code] = value
+        for name, value in WELLKNOWN_DEFAULTS.items():
+            if name not in attr:
+                code = self.attr_codes[name]
+                attributes[code] = [[bgpmsg.AS_SEQUENCE, value]] if name == 'as_path' else value
+        return attributes
 
-    def _build_yabgp_msgs(self, update):
-        yabgp_attr_name_conversion = {
-            'nexthop': 3, 'origin': 1, 'as_path': 2, 'local_pref': 5 }
-        yabgp_msg = {}
-        if not self.peer:
-            return {}
+    def _build_yabgp_msg(self, update):
+        msg = {}
         nlri = update.get('nlri')
         if nlri:
-            attributes = {}
-            attr = update['attr']
-            for at_name, at_value in attr.items():
-                if at_name == 'as_path':
-                    at_value = [[2, at_value]]
-                if at_name in yabgp_attr_name_conversion:
-                    if at_name == 'origin':
-                        if at_value == 'igp':
-                            at_value = 0
-                        elif at_value == 'egp':
-                            at_value = 1
-                        else:
-                            at_value = 2
-                    attributes[yabgp_attr_name_conversion[at_name]] = at_value
-            yabgp_msg['attr'] = attributes
-            yabgp_msg['nlri'] = nlri
+            msg['attr'] = self.attributes.get(update['attr'])
+            msg['nlri'] = list(nlri)
         withdraw = update.get('withdraw')
         if withdraw:
-            yabgp_msg['withdraw'] = withdraw
-        return {self.peer['remote_addr']: yabgp_msg}
-
-    def _send_yabgp(self, update):
-        yabgp_msg = self._build_yabgp_msgs(update)
-        for peer_ip, msg in yabgp_msg.items():
-            if not msg:
-                continue
-            res = self.session.post(
-                    '%s/peer/%s/send/update' % (self.yabgp_url, peer_ip),
-                    data=json.dumps(msg), auth=HTTPBasicAuth('admin', 'admin'),
-                    headers=self.headers)
-            print(res)
+            msg['withdraw'] = list(withdraw)
+        return msg
 
     def send_update(self, update):
-        # verify if well-known, mandatory attrbiutes exist
-        for attr, value in WELLKNOWN_DEFAULTS.items():
-            if attr not in update['attr']:
-                update['attr'][attr] = value
         if self.peer:
-            logger.info(str(update))
-            self._send_yabgp(update)
+            logger.info('%s', update)
+            msg = self._build_yabgp_msg(update)
+            if msg:
+                self.client.send(self.peer['remote_addr'], msg)
+
+    def send_eor(self):
+        """YaBGP has no End-of-RIB call; wait until the updates are posted."""
+        if self.client:
+            self.client.flush()
+
+
+class NativeAgent(object):
+    """Speak BGP ourselves on asyncio and write wire-format UPDATEs to the peers."""
+    speaker = None
+    multi_peer = True  # update['peers'] selects sessions by address or address:port
+
+    def __init__(self):
+        self.attributes = AttrCache(self._native_attributes, 'native')
+
+    @staticmethod
+    def _native_attributes(attr):
+        """(attr with the well-known defaults, IPv6 next hop, {four_octet: encoded attributes})."""
+        attr = dict(attr)
+        for name, value in WELLKNOWN_DEFAULTS.items():
+            if attr.get(name) is None:
+                attr[name] = value
+        return attr, bgpmsg.ipv6_nexthop(attr['nexthop']), {}
+
+    def start(self, peers, local_ip, local_as):
+        self.speaker = BGPSpeaker(local_ip, local_as)
+        self.speaker.start(peers)
+
+    def stop(self):
+        if self.speaker:
+            self.speaker.stop()
+            print(self.attributes.report())
+            self.speaker = None
+
+    def connected(self, timeout=60):
+        return self.speaker.wait_established(timeout)
+
+    def send_raw(self, payload):
+        """write pre-encoded UPDATE messages (with 4-octet AS numbers) to each established session."""
+        for session in self.speaker.established_sessions():
+            if session.four_octet:
+                session.write_updates(bgpmsg.append_raw, payload)
+            else:
+                messages, _ = bgpmsg.split_messages(payload)
+                for _, body in messages:
+                    attr, nlri, withdraw = bgpmsg.decode_update(body)
+                    self.send_update({'attr': attr, 'nlri': nlri, 'withdraw': withdraw,
+                                      'peers': [session.peer_ip]})
+
+    def send_update(self, update):
+        """encode the update once and append it to the write buffer of each established session."""
+        sessions = self.speaker.established_sessions()
+        peers = update.get('peers')
+        if peers:
+            sessions = [s for s in sessions if s.peer_ip in peers or s.key in peers]
+        if not sessions:
+            return
+        logger.info('%s', update)
+        nlri, nlri6, withdraw, withdraw6 = split_prefixes(update)
+        attrs = {}
+        nexthop6 = b''
+        if nlri or nlri6:
+            attr, nexthop6, attrs = self.attributes.get(update['attr'])
+        for session in sessions:
+            four_octet = session.four_octet
+            if (nlri or nlri6) and four_octet not in attrs:
+                attrs[four_octet] = bgpmsg.encode_attributes(attr, four_octet)
+            if nlri or withdraw:
+                session.write_updates(bgpmsg.encode_update, attrs.get(four_octet, b''), nlri, withdraw)
+            if nlri6 or withdraw6:
+                session.write_updates(bgpmsg.encode_mp_update, attrs.get(four_octet, b''),
+                                      nexthop6, nlri6, withdraw6)
+
+    def send_eor(self):
+        """send End-of-RIB for IPv4 and IPv6 unicast and wait until it is written out."""
+        for session in self.speaker.established_sessions():
+            for afi in (bgpmsg.AFI_IPV4, bgpmsg.AFI_IPV6):
+                session.write_updates(bgpmsg.append_raw, bgpmsg.encode_end_of_rib(afi))
+        self.speaker.wait_flushed()
+
+
+class NullAgent(object):
+    """Count the updates and drop them, to measure bgpreplay itself."""
+    multi_peer = True
+
+    def __init__(self):
+        self.updates = 0
+        self.prefixes = 0
+        self.raw_bytes = 0
+
+    def start(self, *args):
+        return
+
+    def stop(self):
+        return
+
+    def connected(self, timeout=60):
+        return True
+
+    def send_raw(self, payload):
+        self.updates += 1
+        self.raw_bytes += len(payload)
+
+    def send_update(self, update):
+        announced, withdrawn = prefix_counts(update)
+        self.updates += 1
+        self.prefixes += announced + withdrawn
+
+    def send_eor(self):
+        return
+
+    def report(self):
+        return 'null agent: %d updates, %d prefixes, %d raw bytes' % (
+            self.updates, self.prefixes, self.raw_bytes)
 
 
 BGP_AGENTS  = {
         'console': ConsoleAgent,
+        'null': NullAgent,
         'yabgp': YaBGPAgent,
-        'exabgp': ExaBGPAgent
+        'exabgp': ExaBGPAgent,
+        'native': NativeAgent,
         }
 
 class BgpUpdateGenerator(object):
@@ -269,7 +425,62 @@ class BgpUpdateGenerator(object):
 
     def __init__(self, config):
         self.config = config
-        self.agent = BGP_AGENTS[config['agent']]()
+        if config['metrics_port'] or config['stats_interval']:
+            metrics.registry.enable()
+        YaBGPAgent.window = config.get('yabgp_window') or YaBGPAgent.window
+        AttrCache.default_size = config.get('attr_cache') or AttrCache.default_size
+        if config['fanout']:
+            self.agent = FanoutAgent(BGP_AGENTS[config['agent']], config['fanout_depth'],
+                                     config['fanout_policy'],
+                                     parse_peer_values(config['peer_nexthop']),
+                                     parse_peer_values(config['peer_prepend'], int))
+        else:
+            self.agent = BGP_AGENTS[config['agent']]()
+        self.packer = None
+        self.pacer = None
+        self.filter = None
+        if any(config.get(name) for name in FILTER_OPTIONS):
+            self.filter = UpdateFilter(config['filter_prefix'], config['filter_peer_as'],
+                                       config['filter_origin_as'], config['filter_as_path'],
+                                       config['rewrite_nexthop'], config['rewrite_prepend'],
+                                       config['rewrite_strip'], config['rewrite_community'])
+        self.shard = Shard(*config['shard']) if config.get('shard') else None
+        self.ribout = AdjRibOut() if config['adj_rib_out'] or config['withdraw_at_end'] else None
+        if config['pack']:
+            self.packer = UpdatePacker(self._deliver,
+                                       config['pack_window'] / 1000.0, config['pack_size'])
+        self.timestamps = config.get('timestamps')
+        self.recorder = None
+        if config.get('record'):
+            self.recorder = Recorder(config['record'], WELLKNOWN_DEFAULTS,
+                                     config['record_depth'], config['record_policy'])
+        self.metered = metrics.registry.enabled
+        if self.metered:
+            self._register_metrics()
+
+    def _register_metrics(self):
+        registry = metrics.registry
+        agent = self.config['agent']
+        self.m_updates = registry.counter('bgpreplay_updates_total', 'Updates handed to the agent', agent=agent)
+        self.m_announced = registry.counter('bgpreplay_prefixes_total', 'Prefixes handed to the agent',
+                                            agent=agent, type='announce')
+        self.m_withdrawn = registry.counter('bgpreplay_prefixes_total', 'Prefixes handed to the agent',
+                                            agent=agent, type='withdraw')
+        self.m_send_time = registry.histogram('bgpreplay_send_seconds',
+                                              'Time the agent took to accept one update', agent=agent)
+        if self.packer:
+            registry.gauge('bgpreplay_packer_updates_in', 'Updates given to the packer',
+                           lambda: self.packer.updates_in)
+            registry.gauge('bgpreplay_packer_updates_out', 'Updates sent by the packer',
+                           lambda: self.packer.updates_out)
+        if self.ribout:
+            registry.gauge('bgpreplay_adj_rib_out_routes', 'Routes in the Adj-RIB-Out', self.ribout.size)
+            registry.gauge('bgpreplay_adj_rib_out_suppressed', 'Updates dropped by the Adj-RIB-Out',
+                           lambda: self.ribout.dup_announces + self.ribout.dup_withdraws)
+        if self.config['metrics_port']:
+            registry.serve(self.config['metrics_port'])
+        if self.config['stats_interval']:
+            registry.report_every(self.config['stats_interval'])
 
     def run(self):
         """Start sending updates."""
@@ -279,163 +490,331 @@ class BgpUpdateGenerator(object):
                 print('no BGP router is connected')
                 return
             time.sleep(1)
-            if self.config['mrt']:
-                self._send_update_from_source(source_type='mrt_file', filename=self.config['mrt'])
+            if self.config['rib']:
+                self._preload_rib(self.config['rib'])
+            if self.config['replay_recording']:
+                self._send_update_from_compiled(self.config['replay_recording'], rate=0)
+            elif self.config['compiled']:
+                self._send_update_from_compiled(self.config['compiled'])
+            elif self.config['mrt']:
+                self._send_update_from_source(source_type='mrt_file', filenames=self.config['mrt'])
             elif self.config['live']:
-                self._send_update_from_source(source_type='live', collector=self.config['live'])
+                self._send_update_from_source(source_type='live', collectors=self.config['live'])
             elif self.config['text']:
                 self._send_update_from_text_file(self.config['text'], self.config['count'])
+            elif self.config['rib']:
+                print('RIB loaded, press Ctrl-C to stop')
+                while True:
+                    time.sleep(3600)
             else:
                 self._send_random_update()
+            if self.packer:
+                self.packer.close()
+                print('packed %d updates into %d' % (self.packer.updates_in, self.packer.updates_out))
+            if self.filter and self.filter.updates:  # 0 when the filter ran in pipeline processes
+                print(self.filter.report())
+            if self.config['withdraw_at_end']:
+                self._withdraw_all()
+            self._close_recorder()
+            if self.ribout:
+                print(self.ribout.report())
+            if self.pacer:
+                print(self.pacer.report())
+            if hasattr(self.agent, 'report'):
+                print(self.agent.report())
+            if self.config['stats_interval']:
+                print(json.dumps(dict(metrics.registry.snapshot(), time=time.time()), sort_keys=True))
+            metrics.registry.stop()
             self.agent.stop()
         except (KeyboardInterrupt, Exception):
+            if self.packer:
+                self.packer.stopped.set()  # no flush into the stopped agent
             self.agent.stop()
+            self._close_recorder()
             traceback.print_exc()
 
+    def _send(self, update):
+        if self.packer:
+            self.packer.add(update)
+        else:
+            self._deliver(update)
+
+    def _deliver(self, update):
+        if self.ribout:
+            for update in self.ribout.filter(update):
+                self._send_agent(update)
+        else:
+            self._send_agent(update)
+
+    def _send_agent(self, update):
+        if self.timestamps and prefix_counts(update)[0]:
+            # stamped last, so that packing and the Adj-RIB-Out see the same attributes
+            update = replace(update, attr=dict(update['attr'], timestamp=time.time()))
+        if self.recorder:
+            self.recorder.record(update)
+        if not self.metered:
+            self.agent.send_update(update)
+            return
+        began = time.monotonic()
+        self.agent.send_update(update)
+        self.m_send_time.observe(time.monotonic() - began)
+        announced, withdrawn = prefix_counts(update)
+        self.m_updates.inc()
+        self.m_announced.inc(announced)
+        self.m_withdrawn.inc(withdrawn)
+
+    def _withdraw_all(self):
+        """withdraw every route announced during the run."""
+        start = time.monotonic()
+        withdrawn = self.ribout.withdrawn
+        for update in self.ribout.withdraw_all():
+            self._send_agent(update)
+        print('withdrew %d routes in %.2fs' % (self.ribout.withdrawn - withdrawn, time.monotonic() - start))
+
+    def _new_pacer(self, rate):
+        idle = idle_after = None
+        if self.packer:
+            # don't hold packed updates back while idle
+            idle, idle_after = self.packer.flush, self.packer.window
+        self.pacer = Pacer(rate, self.config['speed'], self.config['max_gap'], self.config['burst'],
+                           idle=idle, idle_after=idle_after)
+        return self.pacer
+
     def _random_nexthop(self):
         if not self.config['nexthop']:
             return None
         return str(random.choice(self.config['nexthop']))
 
-    def _send_update_from_text_file(self, fname, count=0):
-        """
-        time different from the previous
-        delay(ms),update,prefix,nexthop,local_pref,as_path
-        0,annouce,1.0.0.0/24,10.0.0.1,None,1 2 3
-        10,withdraw,2.0.0.0/24,10.0.0.1,120,1 2 3
+    def _set_nexthop(self, attr):
+        """give attributes read from a MRT or live source one of --nexthop, unless --rewrite_nexthop set it."""
+        if self.filter and attr.get('nexthop') in self.filter.mapped:
+            return attr
+        return with_value(attr, 'nexthop', self._random_nexthop())
+
+    def _preload_rib(self, fname, group_size=1000, max_pending=100000):
+        """send the routes of one peer in a TABLE_DUMP_V2 RIB dump at full speed, then End-of-RIB.
+
+        Routes with the same path attributes are grouped into one update of up to
+        group_size prefixes; at most max_pending prefixes wait to be grouped.
         """
+        stream = RIBParser(fname, self.config['rib_peer'])
+        wanted = frozenset(ATTR_CODES.values())
+        attrs = {}
+        groups = {}
+        pending = 0
         sent = 0
-        with open(fname, 'r') as f:
-            for line in f:
-                try:
-                    if count and sent == count:
-                        break
-                    delay, update, prefix, nexthop, localpref, aspath = line.split(',')
-                    delay = float(delay)
-                    prefix = str(ipaddress.ip_network(prefix))
-                    if update == 'announce':
-                        nexthop = str(ipaddress.ip_address(nexthop))
-                        localpref = int(localpref)
-                        aspath = list(map(int, aspath.split(' ')))
-                        nlri = [ prefix ]
-                        withdraw = []
-                    else:
-                        nexthop = None
-                        localpref = None
-                        aspath = []
-                        nlri = []
-                        withdraw = [ prefix ]
-                    attr = {
-                            'nexthop': nexthop,
-                            'as_path': aspath,
-                            'local_pref': localpref}
-                    update = {
-                            'attr': attr,
-                            'nlri': nlri,
-                            'withdraw': withdraw,
-                            }
-                    time.sleep(delay/1000)
-                    self.agent.send_update(update)
-                    sent += 1
-                except Exception as e:
-                    print(e)
+        start = time.monotonic()
+
+        def send_group(blob, prefixes):
+            attr = attrs.get(blob)
+            if attr is None:
+                attr = attrs[blob] = AttrSet(decode_attributes(blob, 0, len(blob), wanted, 4))
+            update = Update(attr, prefixes, [])
+            if self.filter:
+                update = self.filter.apply(update, stream.peer_as)
+                if update is None:
+                    return
+            self._deliver(replace(update, attr=self._set_nexthop(update.attr)))
 
+        for prefix, blob in stream:
+            group = groups.setdefault(blob, [])
+            group.append(prefix)
+            pending += 1
+            sent += 1
+            if len(group) >= group_size:
+                send_group(blob, groups.pop(blob))
+                pending -= group_size
+            elif pending >= max_pending:
+                for blob, prefixes in groups.items():
+                    send_group(blob, prefixes)
+                groups = {}
+                pending = 0
+        for blob, prefixes in groups.items():
+            send_group(blob, prefixes)
+        send_eor = getattr(self.agent, 'send_eor', None)
+        if send_eor:
+            send_eor()
+        print('loaded %d prefixes of peer %s (AS%s) in %.2fs' % (
+            sent, stream.peer_ip, stream.peer_as, time.monotonic() - start))
+
+    def _send_update_from_text_file(self, fname, count=0):
+        """replay a text scenario file, see textsource for the format."""
+        pipeline = source = None
+        if self.config['pipeline'] != 'none':
+            stream = pipeline = Pipeline(TextSource, (fname,), self.config['pipeline'],
+                                         self.config['queue_depth'], self.config['batch_size'])
+        else:
+            stream = source = TextSource(fname)
+        sent = 0
+        pacer = self._new_pacer(0)
+        shard = self.shard
+        for timestamp, attr, nlri, withdraw in iter(stream.next, None):
+            if count and sent == count:
+                break
+            if shard and not shard.mine((nlri or withdraw)[0]):
+                continue
+            update = Update(attr, nlri, withdraw)
+            if self.filter:
+                update = self.filter.apply(update)
+                if update is None:
+                    continue
+            pacer.wait(timestamp)
+            self._send(update)
+            sent += 1
+        if pipeline:
+            print(pipeline.report())
+            pipeline.close()
+        else:
+            print(source.report())
 
     def _send_random_update(self):
         """generate updates randomly."""
-        def random_prefix():
-            prefix = ".".join(map(str, (random.randint(0,255) for _ in range(3))))
-            prefix += '.0/24'
-            return prefix
-
-        def random_prefixes(max_prefix):
-            prefixes = []
-            for _ in range(random.randint(1, max_prefix)):
-                prefixes.append(random_prefix())
-            return prefixes
-
-        def random_as_path(max_length=5):
-            as_path = [self.config['local_as']]
-            for _ in range(random.randint(0, max_length)):
-                as_path.append(random.randint(1, 64999))
-            return as_path
-
-        def sample(seq, num):
-            if len(seq) >= num:
-                return random.sample(seq, num)
-            else:
-                return list(seq)
+        update_type = self.config['update_type']
+        random.seed(self.config['seed'])
+        updates = RandomUpdates(self.config['local_as'], self.config['max_prefix'], self.config['nexthop'],
+                                'withdraw' if update_type == 'withdraw' else 'announce',
+                                self.config['seed'], self.config['prefix_lengths'],
+                                self.config['path_lengths'], self.config['asn_dist'],
+                                shard=(self.shard.index, self.shard.count) if self.shard else None)
         sent = 0
-        update_per_sec = self.config['rate'] or 1
-        update_per_sec = float(update_per_sec)
-        announced_prefixes = set()
-        rate = self.config['rate']
-        while sent < self.config['count'] or self.config['count'] == 0:
-            update = {
-                'attr': {
-                        'nexthop': self._random_nexthop(),
-                        'med': random.randint(0, 100),
-                        'origin': random.choice(['igp', 'incomplete', 'egp']),
-                        'as_path': random_as_path(),
-                        'local_pref': random.randint(100, 150),
-                        }
-                }
-            update['nlri'] = []
-            update['withdraw'] = []
-            if self.config['update_type'] == 'announce':
-                update['nlri'] = random_prefixes(self.config['max_prefix'])
-                announced_prefixes.update(update['nlri'])
-            elif self.config['update_type'] == 'withdraw':
-                update['withdraw'] = random_prefixes(self.config['max_prefix'])
-            else:
-                if random.getrandbits(1):
-                    update['withdraw'] = sample(announced_prefixes, self.config['max_prefix'])
-                if random.getrandbits(1):
-                    update['nlri'] = random_prefixes(self.config['max_prefix'])
-                    announced_prefixes.update(update['nlri'])
-            self.agent.send_update(update)
+        announced = PrefixSet()  # only needed to withdraw announced prefixes in mixed mode
+        pacer = self._new_pacer(self.config['rate'] or 1)
+        for update in updates:
+            if self.config['count'] and sent >= self.config['count']:
+                break
+            if update_type not in ('announce', 'withdraw'):
+                choice = random.getrandbits(2)
+                if choice & 1:
+                    update.withdraw = array('Q', announced.pop_sample(self.config['max_prefix']))
+                if choice & 2:
+                    for key in update.packed_nlri:
+                        announced.add(key)
+                else:
+                    update.nlri = array('Q')
+            if self.filter:
+                update = self.filter.apply(update)
+                if update is None:
+                    continue
+            pacer.wait()
+            self._send(update)
             sent += 1
-            time.sleep(1/update_per_sec)
 
     def _send_update_from_source(self, source_type, **kwargs):
         stream = None
-        if source_type == 'mrt_file':
-            from .pybgpdump import BGPDump
-            stream = BGPDump(kwargs['filename'])
+        pipeline = None
+        progress = None
+        start_time, end_time = self.config['from'], self.config['until']
+        if self.config['resume']:
+            progress = ReplayProgress(self.config['resume'])
+            if progress.timestamp:
+                print('resuming replay at %s' % progress.timestamp)
+                start_time = progress.timestamp
+        merge_mode = self.config['pipeline'] if self.config['pipeline'] != 'none' else 'process'
+        if source_type == 'mrt_file' and len(kwargs['filenames']) > 1:
+            stream = pipeline = MRTMerge(kwargs['filenames'], merge_mode, self.config['queue_depth'],
+                                         self.config['batch_size'], start_time, end_time, self.filter)
         elif source_type == 'live':
-            from bgpstream import BGPStreamReader
-            stream = BGPStreamReader({'collector': kwargs['collector']})
+            from .bgpstream import BGPStreamMerge
+            live_config = {'update_filter': self.filter}
+            if start_time:
+                live_config['from_date'] = int(start_time)
+            if end_time:
+                live_config['until_date'] = int(end_time)
+            print('reading updates from %s' % ', '.join(kwargs['collectors']))
+            stream = pipeline = BGPStreamMerge(kwargs['collectors'], live_config, merge_mode,
+                                               self.config['queue_depth'], self.config['batch_size'])
         else:
-            print('unsupported type: %s' % source_type)
-            sys.exit(-1)
+            if source_type == 'mrt_file':
+                make_source, args = MRTParser, (kwargs['filenames'][0], ALL_ATTRS, start_time, end_time,
+                                                self.filter)
+            else:
+                print('unsupported type: %s' % source_type)
+                sys.exit(-1)
+            if self.config['pipeline'] != 'none':
+                stream = pipeline = Pipeline(make_source, args, self.config['pipeline'],
+                                             self.config['queue_depth'], self.config['batch_size'])
+            else:
+                stream = make_source(*args)
 
-        delay = 0.0
-        prev_timestamp = 0
         sent = 0
-        self.update_per_sec = self.config['rate']
-        while sent < self.config['count'] or self.config['count'] == 0:
-            try:
-                timestamp, attr, nlri, withdraw = stream.next()
-                attr['nexthop'] = self._random_nexthop()
-                update = {
-                        'attr': attr,
-                        'nlri': nlri,
-                        'withdraw': withdraw,
-                        }
-                self.agent.send_update(update)
-                sent += 1
-                if prev_timestamp == 0:
-                    delay = 0.0
-                else:
-                    delay = timestamp - prev_timestamp
-                prev_timestamp = timestamp
-                if self.update_per_sec:
-                    time.sleep(1/self.update_per_sec)
-                else:
-                    time.sleep(delay)
-            except Exception as e:
-                traceback.print_exc()
-                sys.exit(-1)
+        pacer = self._new_pacer(self.config['rate'])
+        try:
+            for timestamp, attr, nlri, withdraw in stream:
+                if self.config['count'] and sent >= self.config['count']:
+                    break
+                if progress and progress.should_skip(timestamp):
+                    continue
+                try:
+                    update = Update(self._set_nexthop(attr), nlri, withdraw)
+                    if self.shard:
+                        update = self.shard.filter(update)
+                    if update is not None:
+                        pacer.wait(timestamp)
+                        self._send(update)
+                        sent += 1
+                    if progress:  # counted before the shard filter, as should_skip() counts
+                        progress.sent(timestamp)
+                except Exception as e:
+                    traceback.print_exc()
+                    sys.exit(-1)
+        finally:
+            if progress:
+                progress.save()
+        if pipeline:
+            print(pipeline.report())
+            pipeline.close()
+
+    def _close_recorder(self):
+        if self.recorder:
+            self.recorder.close()
+            print(self.recorder.report())
+            self.recorder = None
+
+    def _send_update_from_compiled(self, fname, rate=None):
+        """replay pre-encoded updates from a file built by `bgpreplay compile` or --record.
+
+        rate=0 keeps the timing of the file even if --rate is set. --from jumps
+        to its time with the index of the file, --until ends the replay.
+        """
+        from .replayfile import ReplayFile
+        stream = ReplayFile(fname)
+        start_time, end_time = self.config['from'], self.config['until']
+        if start_time:
+            stream.seek_time(start_time)
+        send_raw = getattr(self.agent, 'send_raw', None)
+        if self.shard or self.ribout or self.filter:
+            send_raw = None  # the payloads have to be decoded to pick, filter or track their prefixes
+        sent = 0
+        pacer = self._new_pacer(self.config['rate'] if rate is None else rate)
+        for timestamp, payload in stream:
+            if self.config['count'] and sent >= self.config['count']:
+                break
+            if end_time and timestamp > end_time:
+                break
+            if start_time and timestamp < start_time:
+                continue
+            pacer.wait(timestamp)
+            if send_raw:
+                send_raw(payload)
+                if self.recorder:
+                    self.recorder.record_raw(payload)
+            else:
+                messages, _ = bgpmsg.split_messages(payload)
+                for _, body in messages:
+                    attr, nlri, withdraw = bgpmsg.decode_update(body)
+                    update = {'attr': attr, 'nlri': nlri, 'withdraw': withdraw}
+                    if self.filter:
+                        update = self.filter.apply(update)
+                        if update is None:
+                            continue
+                    if self.shard:
+                        update = self.shard.filter(update)
+                        if update is None:
+                            continue
+                    self._send(update)
+            sent += 1
+        payload = None  # release the last slice so the mmap can be closed
+        stream.close()
 
     def cleanup(self):
         self.agent.stop()
@@ -445,28 +824,99 @@ def setup_cli_opts():
     cli_opts = [
         cfg.MultiStrOpt('peers', short='p',
             help='one or more peers to send update to. It takes format address:port/asn, ex: 127.0.0.1:179/65000'),
-        cfg.StrOpt('mrt', help='BGP MRT file to replay'),
+        cfg.MultiStrOpt('mrt',
+            help='BGP MRT file(s) or glob(s) to replay. Several files are merged by timestamp'),
+        cfg.StrOpt('rib', help='TABLE_DUMP_V2 RIB dump to load at full speed before the updates are replayed'),
+        cfg.StrOpt('rib_peer', help='Address or index of the peer whose routes are loaded from --rib. Default=0'),
+        cfg.StrOpt('compiled', help='Replay a file of pre-encoded updates built by `bgpreplay compile`'),
+        cfg.StrOpt('replay_recording', help='Replay a file written by --record with its original timing'),
+        cfg.StrOpt('from', help='Start the MRT, live or compiled replay at this time (epoch or UTC "YYYY-mm-dd HH:MM")'),
+        cfg.StrOpt('until', help='End the MRT, live or compiled replay at this time (epoch or UTC "YYYY-mm-dd HH:MM")'),
+        cfg.StrOpt('resume',
+            help='Progress file of a MRT or live replay. An interrupted replay restarts where it stopped'),
         cfg.StrOpt('text', help='Generate BGP updates from a text file'),
-        cfg.StrOpt('live', help='Replay BGP updates from live feed (a valid CAIDA collector, ex:rrc00)'),
+        cfg.MultiStrOpt('live',
+            help='Replay BGP updates from live feed of BGPStream collector(s), ex: rrc00. '
+                 'Several collectors are merged by timestamp, ex: --live rrc00 --live route-views2'),
         cfg.BoolOpt('rand', help='Randomly generate BGP updates. It is enabled by default if file or live is not specified'),
         cfg.StrOpt('agent', short='a',
             choices=[('yabgp', 'https://github.com/smartbgp/yabgp'),
                      ('exabgp', 'https://github.com/Exa-Networks/exabgp'),
-                     ('console', 'Print to screen')],
-            help='Use YaBGP or ExaBGP for BGP peering or simply print to screen'),
+                     ('native', 'Built-in asyncio BGP speaker'),
+                     ('console', 'Print to screen'),
+                     ('null', 'Count and drop the updates, to benchmark bgpreplay')],
+            help='Use YaBGP, ExaBGP or the built-in speaker for BGP peering or simply print to screen'),
         cfg.IntOpt('count', short='c',
             help='Number of updates to send. Use 0 for no limit (default)'),
         cfg.FloatOpt('rate', short='r',
             help='Number of updates per sec, if not specified, based on timestamp in MRT file, or 1 for random updates'),
+        cfg.FloatOpt('speed', short='s',
+            help='Replay speed relative to the timestamps of MRT, live or text updates, ex: 10 for 10x. Default=1'),
+        cfg.FloatOpt('max_gap',
+            help='Cap (sec) on idle gaps between MRT, live or text timestamps. Default=0 (no cap)'),
+        cfg.IntOpt('burst',
+            help='Number of updates that may be sent back-to-back to catch up with --rate. Default=one second worth'),
         cfg.IntOpt('max_prefix', short='m',
             help='Max number of prefixes per updates. Default=1. The actual number is randomly between 1 to the max'),
+        cfg.IntOpt('seed', help='Seed of the random updates, to generate the same updates again'),
+        cfg.StrOpt('prefix_lengths',
+            help='Histogram of random prefix lengths, format length:weight,..., ex: 24:60,22:12,16:2. Default=IPv4 DFZ'),
+        cfg.StrOpt('path_lengths',
+            help='Histogram of random AS path lengths (without the local AS), format length:weight,... Default=1-9 hops'),
+        cfg.StrOpt('asn_dist', choices=['uniform', 'zipf'],
+            help='Distribution of random ASNs: uniform (default) or zipf (few ASes appear in most paths)'),
         cfg.StrOpt('update_type', short='t', choices=['announce', 'withdraw', 'mixed'],
             help='Type of updates: announce, withdraw or mixed (default)'),
         cfg.MultiStrOpt('nexthop', short='nh',
             help='A nexthop(s) to use for announcements. Default=IP address used to establish the peering'),
         cfg.IntOpt('local_as', help='Local ASN, default=65000'),
         cfg.StrOpt('local_ip', help='Local IP, default=127.0.0.1'),
-        cfg.StrOpt('logfile', help='Log file'),
+        cfg.StrOpt('pipeline', choices=['none', 'thread', 'process'],
+            help='Decode MRT or live updates in a separate thread or process. Default=none'),
+        cfg.IntOpt('queue_depth', help='Number of decoded batches queued for the sender, default=64'),
+        cfg.IntOpt('batch_size', help='Number of updates per decoded batch, default=256'),
+        cfg.BoolOpt('fanout',
+            help='Send to each peer from its own queue and thread (console, null, native and exabgp '
+                 'agents; with exabgp all the threads write to the one ExaBGP API pipe)'),
+        cfg.IntOpt('fanout_depth', help='Max number of updates queued per peer with --fanout, default=10000'),
+        cfg.StrOpt('fanout_policy', choices=['block', 'drop'],
+            help='What to do when a peer queue is full: wait (default) or drop the update for that peer'),
+        cfg.MultiStrOpt('peer_nexthop',
+            help='Per-peer nexthop with --fanout, format address[:port]=nexthop, ex: 10.0.0.1=10.0.0.254'),
+        cfg.MultiStrOpt('peer_prepend',
+            help='Per-peer number of local AS prepends with --fanout, format address[:port]=count'),
+        cfg.BoolOpt('pack', help='Group updates with identical attributes into fewer, larger updates'),
+        cfg.FloatOpt('pack_window', help='Max time (ms) an update waits to be packed, default=100'),
+        cfg.IntOpt('pack_size', help='Max number of prefixes pending to be packed, default=10000'),
+        cfg.IntOpt('workers', short='w',
+            help='Number of processes sending updates, sharded by peer. With fewer peers than workers '
+                 'updates are sharded by prefix, with the console and null agents only. Default=1'),
+        cfg.BoolOpt('adj_rib_out',
+            help='Keep the routes announced to each peer and drop updates that change nothing'),
+        cfg.BoolOpt('withdraw_at_end', help='Withdraw all announced routes at the end (implies --adj_rib_out)'),
+        cfg.IntOpt('metrics_port', help='Serve Prometheus metrics on http://127.0.0.1:<port>/metrics'),
+        cfg.FloatOpt('stats_interval', help='Print all metrics as a JSON line every <stats_interval> sec'),
+        cfg.IntOpt('yabgp_window', help='Number of requests in flight to the YaBGP REST API, default=8'),
+        cfg.IntOpt('attr_cache', help='Attribute sets each agent keeps encoded, default=4096'),
+        cfg.BoolOpt('timestamps',
+            help='Add the send time to announcements as attribute 255, for the latency of bgpreplay-sink'),
+        cfg.StrOpt('record', help='Write the updates sent to a file that --replay_recording replays'),
+        cfg.IntOpt('record_depth', help='Max number of updates waiting to be recorded, default=100000'),
+        cfg.StrOpt('record_policy', choices=['block', 'drop'],
+            help='What to do when the recorder falls behind: wait (default) or leave updates out'),
+        cfg.MultiStrOpt('filter_prefix',
+            help='Send only these prefixes and more specific ones, ex: 10.0.0.0/8'),
+        cfg.MultiStrOpt('filter_peer_as',
+            help='Send only the MRT, live or RIB updates received from these peer ASes, ex: 3356,174'),
+        cfg.MultiStrOpt('filter_origin_as', help='Send only the announcements originated by these ASes'),
+        cfg.StrOpt('filter_as_path',
+            help='Send only the announcements whose AS path matches this regular expression, ex: "^3356 "'),
+        cfg.MultiStrOpt('rewrite_nexthop',
+            help='Replace a next hop of the MRT, live or text updates, format old=new, ex: 192.0.2.1=10.0.0.1'),
+        cfg.StrOpt('rewrite_prepend', help='ASNs to prepend to the AS path, ex: "65000 65000"'),
+        cfg.StrOpt('rewrite_strip', help='ASNs to remove from the AS path, ex: "64512 64513"'),
+        cfg.MultiStrOpt('rewrite_community', help='Communities to add to the announcements, ex: 65000:1'),
+        cfg.StrOpt('logfile', help='Log file (slow: every update is formatted as text)'),
     ]
     CONF.register_cli_opts(cli_opts)
     return CONF
@@ -475,18 +925,64 @@ DEFAULTS = {
         'live': None,
         'text': None,
         'mrt': None,
+        'rib': None,
+        'rib_peer': None,
+        'compiled': None,
+        'replay_recording': None,
+        'from': None,
+        'until': None,
+        'resume': None,
         'rand': True,
         'peers': ['127.0.0.1:9179/65000'],
         'agent': 'console',
         'count': 0,
         'rate': 0,
+        'speed': 1.0,
+        'max_gap': 0,
+        'burst': 0,
         'max_prefix': 1,
         'update_type': 'mixed',
+        'seed': None,
+        'prefix_lengths': None,
+        'path_lengths': None,
+        'asn_dist': 'uniform',
         'nexthop': ['127.0.0.1'],
         'local_as': 65000,
         'local_ip': '127.0.0.1',
+        'pipeline': 'none',
+        'queue_depth': 64,
+        'batch_size': 256,
+        'fanout': False,
+        'fanout_depth': 10000,
+        'fanout_policy': 'block',
+        'peer_nexthop': [],
+        'peer_prepend': [],
+        'pack': False,
+        'pack_window': 100,
+        'pack_size': 10000,
+        'workers': 1,
+        'adj_rib_out': False,
+        'withdraw_at_end': False,
+        'metrics_port': 0,
+        'stats_interval': 0,
+        'yabgp_window': 8,
+        'attr_cache': 4096,
+        'timestamps': False,
+        'record': None,
+        'record_depth': 100000,
+        'record_policy': 'block',
+        'filter_prefix': None,
+        'filter_peer_as': None,
+        'filter_origin_as': None,
+        'filter_as_path': None,
+        'rewrite_nexthop': None,
+        'rewrite_prepend': None,
+        'rewrite_strip': None,
+        'rewrite_community': None,
         }
 
+FILTER_OPTIONS = [name for name in DEFAULTS if name.startswith(('filter_', 'rewrite_'))]
+
 def check_peer_format(peers):
     results = []
     try:
@@ -506,6 +1002,30 @@ def check_peer_format(peers):
         sys.exit(-1)
     return results
 
+def check_mrt_files(patterns):
+    if not patterns:
+        return None
+    if type(patterns) == str:
+        patterns = patterns.split(' ')
+    files = expand_files(p for p in patterns if p)
+    for fname in files:
+        if not os.path.isfile(fname):
+            print('MRT file not found: %s' % fname)
+            sys.exit(-1)
+    return files
+
+def check_collectors(collectors):
+    """--live values -> list of collectors; a value may list several, separated by commas."""
+    if isinstance(collectors, str):
+        collectors = [collectors]
+    results = []
+    for value in collectors or ():
+        for collector in value.split(','):
+            collector = collector.strip()
+            if collector and collector not in results:
+                results.append(collector)
+    return results or None
+
 def check_nexthop_format(nexthops):
     results = []
     try:
@@ -520,14 +1040,115 @@ def check_nexthop_format(nexthops):
         sys.exit(-1)
     return results
 
+def check_prefixes(prefixes):
+    if isinstance(prefixes, str):
+        prefixes = prefixes.replace(',', ' ').split()
+    try:
+        return [check_prefix(prefix) for prefix in prefixes or ()] or None
+    except ValueError as e:
+        print('Incorrect prefix: %s' % e)
+        sys.exit(-1)
+
+def check_as_path_regex(pattern):
+    if not pattern:
+        return None
+    try:
+        re.compile(pattern)
+    except re.error as e:
+        print('Incorrect AS path regular expression %r: %s' % (pattern, e))
+        sys.exit(-1)
+    return pattern
+
+def check_nexthop_map(values):
+    try:
+        mapping = parse_nexthop_map(values)
+        for old, new in mapping.items():
+            ipaddress.ip_address(old)
+            ipaddress.ip_address(new)
+    except ValueError as e:
+        print('Incorrect argument format: %s. Error: %s' % (values, e))
+        sys.exit(-1)
+    return mapping or None
+
+def check_communities(values):
+    if isinstance(values, str):
+        values = values.replace(',', ' ').split()
+    for value in values or ():
+        high, sep, low = value.partition(':')
+        if not (sep and high.isdigit() and low.isdigit() and int(high) <= 0xffff and int(low) <= 0xffff):
+            print('Incorrect community %r, expected asn:value' % value)
+            sys.exit(-1)
+    return list(values or ()) or None
+
+def check_optional_int(value):
+    return None if value is None else int(value)
+
 
 CHECKS = {
         'peers': check_peer_format,
         'nexthop': check_nexthop_format,
+        'mrt': check_mrt_files,
+        'live': check_collectors,
+        'from': parse_time,
+        'until': parse_time,
         'local_as': int,
+        'count': int,
+        'max_prefix': int,
+        'seed': check_optional_int,
+        'prefix_lengths': parse_histogram,
+        'path_lengths': parse_histogram,
+        'rate': float,
+        'speed': float,
+        'max_gap': float,
+        'burst': int,
+        'queue_depth': int,
+        'batch_size': int,
+        'fanout_depth': int,
+        'pack_window': float,
+        'pack_size': int,
+        'workers': int,
+        'metrics_port': int,
+        'stats_interval': float,
+        'yabgp_window': int,
+        'attr_cache': int,
+        'record_depth': int,
+        'filter_prefix': check_prefixes,
+        'filter_peer_as': parse_asns,
+        'filter_origin_as': parse_asns,
+        'filter_as_path': check_as_path_regex,
+        'rewrite_nexthop': check_nexthop_map,
+        'rewrite_prepend': parse_asns,
+        'rewrite_strip': parse_asns,
+        'rewrite_community': check_communities,
         }
 
+def compile_main(args):
+    """bgpreplay compile --mrt|--text FILE --output FILE: pre-encode the updates of a file for replay."""
+    from .replayfile import compile_mrt
+    from .textsource import compile_text
+    conf = cfg.ConfigOpts()
+    conf.register_cli_opts([
+        cfg.StrOpt('mrt', help='BGP MRT file to compile (raw, gz or bz2)'),
+        cfg.StrOpt('text', help='Text scenario file to compile, nexthops are kept'),
+        cfg.StrOpt('output', short='o', required=True, help='Compiled replay file to write'),
+        cfg.MultiStrOpt('nexthop', short='nh',
+            help='A nexthop(s) to use for MRT announcements. Default=%s' % DEFAULTS['nexthop'][0]),
+    ])
+    conf(args=args, prog='bgpreplay compile')
+    if bool(conf.mrt) == bool(conf.text):
+        print('bgpreplay compile needs either --mrt or --text')
+        sys.exit(-1)
+    if conf.text:
+        count = compile_text(conf.text, conf.output, WELLKNOWN_DEFAULTS)
+    else:
+        nexthops = check_nexthop_format(conf.nexthop or DEFAULTS['nexthop'])
+        count = compile_mrt(conf.mrt, conf.output, nexthops, WELLKNOWN_DEFAULTS)
+    print('compiled %d records from %s into %s' % (count, conf.mrt or conf.text, conf.output))
+
 def main():
+    if sys.argv[1:2] == ['compile']:
+        compile_main(sys.argv[2:])
+        return
     conf = setup_cli_opts()
     conf(args=sys.argv[1:])
 
@@ -541,11 +1162,19 @@ def main():
     logfile = getattr(conf, 'logfile') or os.environ.get('BGPREPLAY_LOGFILE', None)
     if logfile:
         print('The generated BGP updates are being recorded to: %s' % logfile)
+        logger.setLevel(logging.INFO)
         hdl = logging.FileHandler(logfile)
         hdl.setLevel(logging.INFO)
         hdl.setFormatter(logging.Formatter('%(asctime)s %(name)s %(levelname)s %(message)s'))
         logger.addHandler(hdl)
 
+    if config['fanout'] and not getattr(BGP_AGENTS[config['agent']], 'multi_peer', False):
+        print('--fanout is only supported with the %s agents' % ', '.join(
+            name for name, agent in BGP_AGENTS.items() if getattr(agent, 'multi_peer', False)))
+        sys.exit(-1)
+    if config['workers'] > 1:
+        run_workers(config, config['workers'])
+        return
     bgpgen = BgpUpdateGenerator(config)
     atexit.register(bgpgen.cleanup)
     bgpgen.run()
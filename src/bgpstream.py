@@ -1,77 +1,164 @@
-#!/usr/bin/env python
-import os, sys, time
-from datetime import datetime
-import yaml
-from _pybgpstream import BGPStream, BGPRecord, BGPElem
+"""Read updates from BGPStream collectors, live or from a MRT file.
+
+Every BGPStreamReader has a BGPStream of its own, so several collectors
+can be read by one process. BGPStreamMerge reads each collector in a
+background Pipeline worker, which prefetches records into a bounded queue
+and hands them over in batches, and merges the collectors by timestamp.
+"""
+import heapq
+import operator
+import time
+
+from .attrset import EMPTY, AttrSet, Memo
+from .pipeline import Pipeline
+
+WEEK = 3600 * 24 * 7
+
+
+def parse_as_path(path):
+    """AS path text -> list of ASNs; AS sets ({1,2}) are left out."""
+    return [int(asn) for asn in path.split() if asn.isdigit()]
+
+
+def _community(value):
+    if isinstance(value, dict):  # older pybgpstream: {'asn': 1, 'value': 2}
+        return '%d:%d' % (value['asn'], value['value'])
+    return str(value)
 
-stream = BGPStream()
 
 class BGPStreamReader(object):
+    """Iterate over (timestamp, attr, nlri, withdraw) of the update records of one collector.
+
+    Records that are not valid are skipped and counted. Records sharing
+    AS path, next hop and communities share one read-only AttrSet. An
+    update_filter (see updatefilter) sees the prefixes and the peer AS
+    before the attributes are read.
+    """
     defaults = {
         'mrt_file': None,
         'collector': 'rrc00',
         'record_type': 'update',
-        'from_date': int(time.time()) - 3600*24*7, # back up a week
+        'from_date': None,  # a week back
         'until_date': 0,
         'prefix_filter': None,
         'peer_as_filter': None,
         'communities_filter': None,
+        'update_filter': None,
     }
 
-    def __init__(self, config={}):
-        self.config = config
-        for k, v in self.defaults.items():
-            self.config.setdefault(k, v)
-        if self.config['mrt_file'] is None:
-            stream.add_filter('collector', self.config['collector'])
-            stream.add_filter('record-type', self.config['record_type'])
-            stream.add_interval_filter(self.config['from_date'], self.config['until_date'])
+    def __init__(self, config=None):
+        from _pybgpstream import BGPStream, BGPRecord
+        self.config = dict(self.defaults, **(config or {}))
+        config = self.config
+        if config['from_date'] is None:
+            config['from_date'] = int(time.time()) - WEEK
+        self.stream = stream = BGPStream()
+        if config['mrt_file'] is None:
+            stream.add_filter('collector', config['collector'])
+            stream.add_filter('record-type', config['record_type'])
+            stream.add_interval_filter(config['from_date'], config['until_date'])
             stream.set_live_mode()
         else:
             stream.set_data_interface('singlefile')
-            stream.set_data_interface_option('singlefile', 'upd-file', self.config['mrt_file'])
-        if self.config['prefix_filter']:
-            for prefix in self.config['prefix_filter']:
-                stream.add_filter('prefix', prefix)
-        if self.config['peer_as_filter']:
-            for asn in self.config['peer_as_filter']:
-                stream.add_filter('peer-asn', str(asn))
-        if self.config['communities_filter']:
-            for community in self.config['communities_filter']:
-                stream.add_filter('community', community)
+            stream.set_data_interface_option('singlefile', 'upd-file', config['mrt_file'])
+        for prefix in config['prefix_filter'] or ():
+            stream.add_filter('prefix', prefix)
+        for asn in config['peer_as_filter'] or ():
+            stream.add_filter('peer-asn', str(asn))
+        for community in config['communities_filter'] or ():
+            stream.add_filter('community', community)
         stream.start()
-        print('BGPSteamReader has started')
+        self.record = BGPRecord()
+        self.records = 0
+        self.invalid = 0
+        self.attrs = Memo()
+        self.update_filter = config['update_filter']
 
     def __iter__(self):
         return self
 
-    def next(self):
-        rec = BGPRecord()
-        print('get next rec')
-        if stream.get_next_record(rec):
-            if rec.status == 'valid':
-                elem = rec.get_next_elem()
-                timestamp = rec.time
-                nlri = []
-                withdraw = []
-                attr = {}
-                while(elem):
-                    peer_address = elem.peer_address
-                    peer_asn = elem.peer_asn
-                    if elem.type == 'A' or elem.type == 'R':
-                        nlri.append(elem.fields['prefix'])
-                        attr['as_path'] = elem.fields['as-path']
-                        attr['nexthop'] = elem.fields['next-hop']
-                        attr['community'] = elem.fields['communities']
-                    elif elem.type == 'W':
-                        withdraw.append(elem.fields['prefix'])
-                    elem = rec.get_next_elem()
-                return (timestamp, attr, nlri, withdraw)
-            else:
-                return self.next(rec)
-        else:
-            StopIteration
+    def __next__(self):
+        stream, rec = self.stream, self.record
+        while stream.get_next_record(rec):
+            self.records += 1
+            if rec.status != 'valid':
+                self.invalid += 1
+                continue
+            update = self._update(rec)
+            if update is not None:
+                return update
+        raise StopIteration
+
+    next = __next__
+
+    def at_boundary(self):
+        """True after the last record of a dump: nothing follows until the collector publishes the next one."""
+        return getattr(self.record, 'dump_position', None) == 'end'
+
+    def _update(self, rec):
+        fields = None
+        peer_as = None
+        nlri = []
+        withdraw = []
+        elem = rec.get_next_elem()
+        while elem:
+            peer_as = elem.peer_asn
+            if elem.type == 'A' or elem.type == 'R':
+                nlri.append(elem.fields['prefix'])
+                if fields is None:
+                    fields = elem.fields
+            elif elem.type == 'W':
+                withdraw.append(elem.fields['prefix'])
+            elem = rec.get_next_elem()
+        if not nlri and not withdraw:
+            return None
+        if self.update_filter is not None:
+            kept = self.update_filter.filter(
+                nlri, withdraw, (lambda: self._attributes(fields)) if nlri else EMPTY, peer_as)
+            return None if kept is None else (rec.time,) + kept
+        return rec.time, self._attributes(fields) if nlri else EMPTY, nlri, withdraw
+
+    def _attributes(self, fields):
+        communities = tuple(sorted(_community(c) for c in fields.get('communities') or ()))
+        key = (fields['as-path'], fields['next-hop'], communities)
+        attr = self.attrs.get(key)
+        if attr is None:
+            attr = {'as_path': parse_as_path(fields['as-path']), 'nexthop': fields['next-hop']}
+            if communities:
+                attr['community'] = list(communities)
+            attr = self.attrs.put(key, AttrSet(attr))
+        return attr
+
+
+class BGPStreamMerge(object):
+    """Merge the updates of several collectors in timestamp order.
+
+    Each collector is read by its own Pipeline worker (a process by
+    default), which prefetches while the sender is busy. The merge has to
+    see the next update of every collector before it passes one on, so
+    the merged stream keeps the pace of the collector that publishes last.
+    It ends once every collector has ended.
+    """
+
+    def __init__(self, collectors, config=None, mode='process', depth=8, batch_size=256):
+        self.collectors = collectors
+        self.pipelines = [Pipeline(BGPStreamReader, (dict(config or {}, collector=collector),),
+                                   mode, depth, batch_size, name='bgpstream-%s' % collector)
+                          for collector in collectors]
+        self.merged = heapq.merge(*self.pipelines, key=operator.itemgetter(0))
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return next(self.merged)
+
+    next = __next__
+
+    def report(self):
+        return '\n'.join('%s %s' % (collector, pipeline.report())
+                         for collector, pipeline in zip(self.collectors, self.pipelines))
 
-if __name__=='__main__':
-    stream = BGPStreamGenerator("")
-    stream.run()
+    def close(self):
+        for pipeline in self.pipelines:
+            pipeline.close()
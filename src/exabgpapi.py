@@ -0,0 +1,224 @@
+"""A channel to the API of an ExaBGP process.
+
+bgpreplay listens on a UNIX socket and ExaBGP runs ``nc -U <socket>`` as
+its API process, so the connection arrives as soon as ExaBGP is up. Over
+it bgpreplay writes statements and ExaBGP answers every statement with
+``done`` or ``error`` and reports neighbor state changes as JSON.
+"""
+import json
+import logging
+import os
+import select
+import socket
+import threading
+import time
+from collections import deque
+
+from . import metrics
+
+logger = logging.getLogger('bgpreplay')
+
+# seconds to wait for the first acknowledgement before assuming ExaBGP sends none
+ACK_TIMEOUT = 5.0
+
+
+class ExaBGPChannel(object):
+    """Write statements to ExaBGP in batches and follow its replies.
+
+    send() only queues the statements; a writer thread joins whatever has
+    queued up into one write, so the batches grow with the load. At most
+    window statements are written but not acknowledged yet, which keeps
+    ExaBGP's input buffer bounded; ExaBGP versions that do not acknowledge
+    are detected and then written to without flow control. send() blocks
+    when max_queued statements are waiting.
+    """
+
+    def __init__(self, window=4000, batch=2000, max_queued=100000):
+        self.window = window
+        self.batch = batch
+        self.max_queued = max_queued
+        self.path = None
+        self.listener = None
+        self.sock = None
+        self.changed = threading.Condition()
+        self.queue = deque()
+        self.written = 0
+        self.acked = 0
+        self.errors = 0
+        self.bytes = 0
+        self.writes = 0
+        self.in_flight = 0  # statements being written
+        self.acks = None  # True once ExaBGP acknowledged a statement, False if it does not
+        self.up = set()
+        self.closed = False
+        if metrics.registry.enabled:
+            self._register_metrics()
+
+    def _register_metrics(self):
+        registry = metrics.registry
+        registry.gauge('bgpreplay_exabgp_statements', 'Statements written to ExaBGP',
+                       lambda: self.written)
+        registry.gauge('bgpreplay_exabgp_queued', 'Statements waiting to be written',
+                       lambda: len(self.queue))
+        registry.gauge('bgpreplay_exabgp_unacked', 'Statements written but not acknowledged',
+                       lambda: self.written - self.acked)
+        registry.gauge('bgpreplay_exabgp_errors', 'Statements ExaBGP answered with error',
+                       lambda: self.errors)
+        registry.gauge('bgpreplay_exabgp_neighbors_up', 'Neighbors ExaBGP reported up',
+                       lambda: len(self.up))
+
+    def listen(self, path):
+        if os.path.exists(path):
+            os.remove(path)
+        self.path = path
+        self.listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.listener.bind(path)
+        self.listener.listen(1)
+
+    def accept(self, timeout, alive):
+        """Wait for the API process to connect; alive() is False once ExaBGP has exited."""
+        deadline = time.monotonic() + timeout
+        while alive():
+            left = deadline - time.monotonic()
+            if left <= 0:
+                break
+            if select.select([self.listener], [], [], min(left, 0.5))[0]:
+                self.sock, _ = self.listener.accept()
+                threading.Thread(target=self._read, name='exabgp-reader', daemon=True).start()
+                threading.Thread(target=self._write, name='exabgp-writer', daemon=True).start()
+                return True
+        return False
+
+    def send(self, statements):
+        with self.changed:
+            while len(self.queue) >= self.max_queued and not self.closed:
+                self.changed.wait()
+            if not self.queue:
+                self.changed.notify_all()
+            self.queue.extend(statements)
+
+    def wait_up(self, timeout=60):
+        """Wait until ExaBGP reports at least one neighbor up."""
+        with self.changed:
+            self.changed.wait_for(lambda: self.up or self.closed, timeout)
+            return bool(self.up)
+
+    def flush(self, timeout=60):
+        """Wait until everything queued is written and acknowledged."""
+        deadline = time.monotonic() + timeout
+        with self.changed:
+            while not self.closed and (self.queue or self.in_flight or
+                                       (self.acks is not False and self.acked < self.written)):
+                left = deadline - time.monotonic()
+                if left <= 0:
+                    return False
+                if not self.changed.wait(min(left, ACK_TIMEOUT)) and not self.queue:
+                    self._no_acks()
+            return not self.queue
+
+    def _no_acks(self):
+        if self.acks is None:
+            self.acks = False
+            logger.warning('ExaBGP does not acknowledge statements, writing without flow control')
+            self.changed.notify_all()
+
+    def _write(self):
+        changed = self.changed
+        while True:
+            with changed:
+                while not self.closed and (not self.queue or (
+                        self.acks is not False and self.written - self.acked >= self.window)):
+                    if not changed.wait(ACK_TIMEOUT) and self.queue:
+                        self._no_acks()
+                if self.closed:
+                    return
+                count = min(len(self.queue), self.batch)
+                if self.acks is not False:
+                    count = min(count, self.window - (self.written - self.acked))
+                popleft = self.queue.popleft
+                statements = [popleft() for _ in range(count)]
+                self.written += count
+                self.in_flight = count
+                changed.notify_all()
+            data = ('\n'.join(statements) + '\n').encode('utf-8')
+            try:
+                self.sock.sendall(data)
+            except OSError as e:
+                logger.error('ExaBGP API connection lost: %s', e)
+                self._closed()
+                return
+            with changed:
+                self.in_flight = 0
+                self.bytes += len(data)
+                self.writes += 1
+                changed.notify_all()
+
+    def _read(self):
+        buf = b''
+        while True:
+            try:
+                data = self.sock.recv(65536)
+            except OSError:
+                data = b''
+            if not data:
+                break
+            lines = (buf + data).split(b'\n')
+            buf = lines.pop()
+            acked = errors = 0
+            for line in lines:
+                line = line.strip()
+                if line == b'done':
+                    acked += 1
+                elif line == b'error':
+                    acked += 1
+                    errors += 1
+                elif line.startswith(b'{'):
+                    self._event(line)
+            if acked:
+                with self.changed:
+                    self.acked += acked
+                    self.errors += errors
+                    self.acks = True
+                    self.changed.notify_all()
+        self._closed()
+
+    def _event(self, line):
+        try:
+            message = json.loads(line.decode('utf-8'))
+        except ValueError:
+            return
+        if message.get('type') != 'state':
+            return
+        neighbor = message.get('neighbor', {})
+        peer = neighbor.get('address', {}).get('peer')
+        state = neighbor.get('state')
+        logger.info('ExaBGP neighbor %s %s', peer, state)
+        with self.changed:
+            if state == 'up':
+                self.up.add(peer)
+            else:
+                self.up.discard(peer)
+            self.changed.notify_all()
+
+    def _closed(self):
+        with self.changed:
+            self.closed = True
+            self.changed.notify_all()
+
+    def close(self):
+        self._closed()
+        if self.sock:
+            try:
+                self.sock.shutdown(socket.SHUT_RDWR)  # wakes up the reader
+            except OSError:
+                pass
+        for sock in (self.sock, self.listener):
+            if sock:
+                sock.close()
+        self.sock = self.listener = None
+        if self.path and os.path.exists(self.path):
+            os.remove(self.path)
+
+    def report(self):
+        return 'exabgp: %d statements in %d writes (%d bytes), %d acknowledged, %d errors' % (
+            self.written, self.writes, self.bytes, self.acked, self.errors)
@@ -0,0 +1,194 @@
+"""Deliver one stream of updates to many peers concurrently.
+"""
+import queue
+import threading
+import time
+import traceback
+
+from . import metrics
+from .attrset import AttrSet, with_value
+from .update import prefix_counts, replace
+
+_STOP = object()
+
+
+def parse_peer_values(values, convert=str):
+    """Parse 'peer=value' options into {peer: value}; peer is an address or address:port."""
+    results = {}
+    for value in values or []:
+        peer, _, v = value.partition('=')
+        results[peer.strip()] = convert(v.strip())
+    return results
+
+
+class PeerChannel(object):
+    """A send queue and thread for one peer.
+
+    Per-peer transforms (next hop, AS path prepend) are applied in the
+    channel thread, just before the update is handed to the agent.
+    """
+
+    def __init__(self, agent, peer, local_as, depth, policy, nexthop=None, prepend=0):
+        peer_ip, peer_port, _ = peer
+        self.agent = agent
+        self.key = '%s:%s' % (peer_ip, peer_port)
+        self.local_as = int(local_as)
+        self.policy = policy
+        self.nexthop = nexthop
+        self.prepend = prepend
+        self.queue = queue.Queue(depth)
+        self.sent = 0
+        self.dropped = 0
+        self.blocked = 0.0  # time the producer waited on this peer's full queue
+        self.max_depth = 0
+        self.thread = threading.Thread(target=self._run, name='fanout-%s' % self.key, daemon=True)
+
+    def put(self, update):
+        if self.policy == 'drop':
+            try:
+                self.queue.put_nowait(update)
+            except queue.Full:
+                self.dropped += 1
+                return
+        else:
+            try:
+                self.queue.put_nowait(update)
+            except queue.Full:
+                start = time.monotonic()
+                self.queue.put(update)
+                self.blocked += time.monotonic() - start
+        depth = self.queue.qsize()
+        if depth > self.max_depth:
+            self.max_depth = depth
+
+    def _transform(self, update):
+        update = replace(update, peers=[self.key])
+        if prefix_counts(update)[0] and (self.nexthop or self.prepend):
+            attr = update['attr']
+            if type(attr) is not AttrSet:
+                attr = dict(attr)
+            if self.nexthop:
+                attr = with_value(attr, 'nexthop', self.nexthop)
+            if self.prepend:
+                attr = with_value(attr, 'as_path',
+                                  [self.local_as] * self.prepend + list(attr.get('as_path') or []))
+            update['attr'] = attr
+        return update
+
+    def _run(self):
+        while True:
+            update = self.queue.get()
+            try:
+                if update is _STOP:
+                    return
+                self.agent.send_update(self._transform(update))
+                self.sent += 1
+            except Exception:
+                traceback.print_exc()
+            finally:
+                self.queue.task_done()
+
+
+class FanoutAgent(object):
+    """Send every update to each peer through its own queue and thread.
+
+    A slow peer only fills its own queue; with the 'block' policy the
+    producer waits once that queue is full, with 'drop' the update is
+    dropped for that peer and counted. Agents that can address a single
+    peer of a multi-peer session set (multi_peer = True) are shared by all
+    channels, others get one agent instance per peer.
+    """
+
+    def __init__(self, agent_cls, depth=10000, policy='block', nexthops=None, prepends=None):
+        self.agent_cls = agent_cls
+        self.depth = depth
+        self.policy = policy
+        self.nexthops = nexthops or {}
+        self.prepends = prepends or {}
+        self.agents = []
+        self.channels = []
+        self.start_time = None
+
+    def _peer_value(self, values, peer, default=None):
+        peer_ip, peer_port, _ = peer
+        return values.get('%s:%s' % (peer_ip, peer_port), values.get(peer_ip, default))
+
+    def start(self, peers, local_ip, local_as):
+        if getattr(self.agent_cls, 'multi_peer', False):
+            agent = self.agent_cls()
+            agent.start(peers, local_ip, local_as)
+            self.agents.append(agent)
+            agents = [agent] * len(peers)
+        else:
+            agents = []
+            for peer in peers:
+                agent = self.agent_cls()
+                agent.start([peer], local_ip, local_as)
+                self.agents.append(agent)
+                agents.append(agent)
+        for agent, peer in zip(agents, peers):
+            channel = PeerChannel(agent, peer, local_as, self.depth, self.policy,
+                                  self._peer_value(self.nexthops, peer),
+                                  self._peer_value(self.prepends, peer, 0))
+            channel.thread.start()
+            self.channels.append(channel)
+            if metrics.registry.enabled:
+                self._register_metrics(channel)
+
+    @staticmethod
+    def _register_metrics(channel):
+        registry = metrics.registry
+        peer = channel.key
+        registry.gauge('bgpreplay_fanout_sent', 'Updates sent from the peer queue',
+                       lambda: channel.sent, peer=peer)
+        registry.gauge('bgpreplay_fanout_queue_depth', 'Updates waiting in the peer queue',
+                       channel.queue.qsize, peer=peer)
+        registry.gauge('bgpreplay_fanout_blocked_seconds', 'Time the producer waited on the full peer queue',
+                       lambda: channel.blocked, peer=peer)
+        registry.gauge('bgpreplay_fanout_dropped', 'Updates dropped for the peer',
+                       lambda: channel.dropped, peer=peer)
+
+    def connected(self, timeout=60):
+        return any(agent.connected(timeout) for agent in self.agents)
+
+    def send_update(self, update):
+        if self.start_time is None:
+            self.start_time = time.monotonic()
+        for channel in self.channels:
+            channel.put(update)
+
+    def send_eor(self):
+        for channel in self.channels:
+            channel.queue.join()
+        for agent in self.agents:
+            send_eor = getattr(agent, 'send_eor', None)
+            if send_eor:
+                send_eor()
+
+    def stats(self):
+        elapsed = time.monotonic() - self.start_time if self.start_time else 0.0
+        return dict((channel.key, {
+            'sent': channel.sent,
+            'rate': channel.sent / elapsed if elapsed else 0.0,
+            'queue_depth': channel.queue.qsize(),
+            'max_queue_depth': channel.max_depth,
+            'blocked': channel.blocked,
+            'dropped': channel.dropped,
+        }) for channel in self.channels)
+
+    def report(self):
+        lines = []
+        for key, stats in sorted(self.stats().items()):
+            lines.append('%s: sent %d (%.1f/s), queue %d (max %d), producer blocked %.2fs, dropped %d' % (
+                key, stats['sent'], stats['rate'], stats['queue_depth'], stats['max_queue_depth'],
+                stats['blocked'], stats['dropped']))
+        return '\n'.join(lines)
+
+    def stop(self):
+        for channel in self.channels:
+            if channel.thread.is_alive():
+                channel.queue.put(_STOP)
+        for channel in self.channels:
+            channel.thread.join(5)
+        for agent in self.agents:
+            agent.stop()
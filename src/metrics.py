@@ -0,0 +1,222 @@
+"""Counters and histograms of the send path, exported over HTTP and as JSON lines.
+
+Metrics are disabled unless the registry is enabled before the components
+are created; until then counter(), gauge() and histogram() hand out a
+shared object whose methods do nothing, and the hot paths skip taking
+timestamps altogether (see Registry.enabled).
+
+Counters are updated without locks: an increment racing with another
+thread can be lost, which is fine for rates and totals.
+"""
+import bisect
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# latency buckets in seconds
+BUCKETS = (0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005,
+           0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class _NullMetric(object):
+    __slots__ = ()
+
+    def inc(self, amount=1):
+        pass
+
+    def observe(self, value):
+        pass
+
+    def set(self, value):
+        pass
+
+
+NULL = _NullMetric()
+
+
+class Counter(object):
+    kind = 'counter'
+    __slots__ = ('value',)
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+    def sample(self):
+        return self.value
+
+
+class Gauge(object):
+    """A value that is set, or read from func when sampled."""
+    kind = 'gauge'
+    __slots__ = ('value', 'func')
+
+    def __init__(self, func=None):
+        self.value = 0
+        self.func = func
+
+    def set(self, value):
+        self.value = value
+
+    def inc(self, amount=1):
+        self.value += amount
+
+    def sample(self):
+        return self.func() if self.func else self.value
+
+
+class Histogram(object):
+    kind = 'histogram'
+    __slots__ = ('buckets', 'counts', 'sum', 'count')
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q):
+        """Upper bound of the bucket holding the q quantile."""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return float('inf')
+
+    def sample(self):
+        return {
+            'count': self.count,
+            'sum': self.sum,
+            'p50': self.quantile(0.5),
+            'p99': self.quantile(0.99),
+        }
+
+
+def _label_str(labels):
+    if not labels:
+        return ''
+    return '{%s}' % ','.join('%s="%s"' % (k, str(v).replace('"', '\\"')) for k, v in labels)
+
+
+class Registry(object):
+    """All metrics of this process, by name and labels."""
+
+    def __init__(self):
+        self.enabled = False
+        self.families = {}  # name -> (kind, help, {labels: metric})
+        self.lock = threading.Lock()
+        self.server = None
+        self.reporter = None
+
+    def enable(self):
+        self.enabled = True
+
+    def _get(self, factory, name, help, labels, *args):
+        if not self.enabled:
+            return NULL
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            family = self.families.get(name)
+            if family is None:
+                family = self.families[name] = (factory.kind, help, {})
+            metric = family[2].get(key)
+            if metric is None:
+                metric = family[2][key] = factory(*args)
+        return metric
+
+    def counter(self, name, help='', **labels):
+        return self._get(Counter, name, help, labels)
+
+    def gauge(self, name, help='', func=None, **labels):
+        return self._get(Gauge, name, help, labels, func)
+
+    def histogram(self, name, help='', buckets=BUCKETS, **labels):
+        return self._get(Histogram, name, help, labels, buckets)
+
+    def _items(self):
+        with self.lock:
+            return [(name, kind, help, list(metrics.items()))
+                    for name, (kind, help, metrics) in sorted(self.families.items())]
+
+    def snapshot(self):
+        """{'name{labels}': value} of every metric."""
+        stats = {}
+        for name, _, _, metrics in self._items():
+            for labels, metric in metrics:
+                stats[name + _label_str(labels)] = metric.sample()
+        return stats
+
+    def exposition(self):
+        """All metrics in the Prometheus text format."""
+        lines = []
+        for name, kind, help, metrics in self._items():
+            if help:
+                lines.append('# HELP %s %s' % (name, help))
+            lines.append('# TYPE %s %s' % (name, kind))
+            for labels, metric in metrics:
+                if kind != 'histogram':
+                    lines.append('%s%s %s' % (name, _label_str(labels), metric.sample()))
+                    continue
+                seen = 0
+                for bound, count in zip(metric.buckets + (float('inf'),), metric.counts):
+                    seen += count
+                    le = '+Inf' if bound == float('inf') else repr(bound)
+                    lines.append('%s_bucket%s %d' % (name, _label_str(labels + (('le', le),)), seen))
+                lines.append('%s_sum%s %s' % (name, _label_str(labels), metric.sum))
+                lines.append('%s_count%s %d' % (name, _label_str(labels), metric.count))
+        return '\n'.join(lines) + '\n'
+
+    def serve(self, port, host='127.0.0.1'):
+        """Serve /metrics on host:port from a background thread."""
+        registry = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = registry.exposition().encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, name='bgpreplay-metrics', daemon=True).start()
+        print('metrics on http://%s:%d/metrics' % (host, port))
+
+    def report_every(self, interval, out=print):
+        """Write a JSON line with all metrics every interval seconds."""
+        stop = threading.Event()
+
+        def run():
+            while not stop.wait(interval):
+                out(json.dumps(dict(self.snapshot(), time=time.time()), sort_keys=True))
+
+        self.reporter = stop
+        threading.Thread(target=run, name='bgpreplay-stats', daemon=True).start()
+
+    def stop(self):
+        if self.reporter:
+            self.reporter.set()
+        if self.server:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+
+
+registry = Registry()
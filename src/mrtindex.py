@@ -0,0 +1,168 @@
+"""Time index of MRT files, to start a replay in the middle of a file.
+
+The index maps timestamps to the (uncompressed) offset of the first record
+at or after that time. It is saved next to the MRT file as <file>.idx and
+rebuilt when the MRT file changes.
+
+Layout (network byte order):
+
+    header  8s magic, Q size and Q mtime (ns) of the indexed MRT file
+    entry   I timestamp, Q offset
+"""
+import bisect
+import calendar
+import os
+import struct
+import time
+
+from .mrtparser import MRT_HEADER, open_mrt
+
+MAGIC = b'BGPRIDX1'
+HEADER = struct.Struct('!8sQQ')
+ENTRY = struct.Struct('!IQ')
+INDEX_SUFFIX = '.idx'
+INTERVAL = 10  # seconds of updates between index entries
+
+
+def parse_time(value):
+    """Parse epoch seconds or an UTC 'YYYY-mm-dd HH:MM[:SS]' time."""
+    if value is None or isinstance(value, (int, float)):
+        return value
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    for fmt in ('%Y-%m-%d %H:%M:%S', '%Y-%m-%d %H:%M', '%Y-%m-%dT%H:%M:%S', '%Y-%m-%dT%H:%M'):
+        try:
+            return calendar.timegm(time.strptime(value, fmt))
+        except ValueError:
+            continue
+    raise ValueError('unknown time format: %s' % value)
+
+
+class MRTIndex(object):
+    """Sorted (timestamp, offset) checkpoints of a MRT file."""
+
+    def __init__(self, times, offsets):
+        self.times = times
+        self.offsets = offsets
+
+    def lookup(self, timestamp):
+        """Offset of a record at or before the first record at timestamp."""
+        i = bisect.bisect_right(self.times, timestamp)
+        return self.offsets[i - 1] if i > 0 else 0
+
+    @staticmethod
+    def _stat(filename):
+        st = os.stat(filename)
+        return st.st_size, st.st_mtime_ns
+
+    @classmethod
+    def build(cls, filename, interval=INTERVAL):
+        """Scan the record headers of filename; the bodies are skipped, not parsed."""
+        times, offsets = [], []
+        offset = 0
+        latest = None
+        with open_mrt(filename) as f:
+            while True:
+                hdr = f.read(MRT_HEADER.size)
+                if len(hdr) < MRT_HEADER.size:
+                    break
+                timestamp, _, _, length = MRT_HEADER.unpack(hdr)
+                if latest is None or timestamp >= latest + interval:
+                    times.append(timestamp)
+                    offsets.append(offset)
+                    latest = timestamp
+                f.seek(length, 1)
+                offset += MRT_HEADER.size + length
+        return cls(times, offsets)
+
+    def save(self, filename, index_file):
+        size, mtime = self._stat(filename)
+        with open(index_file, 'wb') as f:
+            f.write(HEADER.pack(MAGIC, size, mtime))
+            for entry in zip(self.times, self.offsets):
+                f.write(ENTRY.pack(*entry))
+
+    @classmethod
+    def load(cls, filename, index_file):
+        """Load index_file, or return None if it is missing or out of date."""
+        try:
+            with open(index_file, 'rb') as f:
+                data = f.read()
+        except IOError:
+            return None
+        if len(data) < HEADER.size:
+            return None
+        magic, size, mtime = HEADER.unpack_from(data)
+        if magic != MAGIC or (size, mtime) != cls._stat(filename):
+            return None
+        times, offsets = [], []
+        for timestamp, offset in ENTRY.iter_unpack(data[HEADER.size:]):
+            times.append(timestamp)
+            offsets.append(offset)
+        return cls(times, offsets)
+
+    @classmethod
+    def get(cls, filename):
+        """Load the sidecar index of filename, building and saving it first if needed."""
+        index_file = filename + INDEX_SUFFIX
+        index = cls.load(filename, index_file)
+        if index is None:
+            index = cls.build(filename)
+            try:
+                index.save(filename, index_file)
+            except IOError:
+                pass  # read-only directory, keep the index in memory
+        return index
+
+
+class ReplayProgress(object):
+    """Remember how far a replay got, so an interrupted replay can resume.
+
+    The progress file holds the timestamp of the last update read from the
+    source and sent (or left to the other shards of --workers) and how many
+    updates with that timestamp were. A resumed replay starts at that
+    timestamp through the time index and skips those updates.
+    """
+
+    def __init__(self, filename, every=1000):
+        self.filename = filename
+        self.every = every
+        self.timestamp = None
+        self.count = 0  # updates sent with self.timestamp
+        self.skip = 0
+        self.unsaved = 0
+        try:
+            with open(filename) as f:
+                timestamp, count = f.read().split()
+            self.timestamp, self.count = float(timestamp), int(count)
+            self.skip = self.count
+        except (IOError, ValueError):
+            pass
+
+    def should_skip(self, timestamp):
+        """True for updates already sent before the replay was interrupted."""
+        if self.skip and timestamp == self.timestamp:
+            self.skip -= 1
+            return True
+        self.skip = 0
+        return False
+
+    def sent(self, timestamp):
+        if timestamp == self.timestamp:
+            self.count += 1
+        else:
+            self.timestamp, self.count = timestamp, 1
+        self.unsaved += 1
+        if self.unsaved >= self.every:
+            self.save()
+
+    def save(self):
+        if self.timestamp is None:
+            return
+        tmp = self.filename + '.tmp'
+        with open(tmp, 'w') as f:
+            f.write('%r %d\n' % (self.timestamp, self.count))
+        os.replace(tmp, self.filename)
+        self.unsaved = 0
@@ -0,0 +1,52 @@
+"""Replay several MRT files as one timeline.
+"""
+import glob
+import heapq
+import operator
+
+from .mrtparser import ALL_ATTRS, MRTParser
+from .pipeline import Pipeline
+
+
+def expand_files(patterns):
+    """Expand glob patterns into a sorted list of files, keeping names that match nothing."""
+    files = []
+    for pattern in patterns:
+        matches = sorted(glob.glob(pattern)) or [pattern]
+        for filename in matches:
+            if filename not in files:
+                files.append(filename)
+    return files
+
+
+class MRTMerge(object):
+    """Merge the updates of several MRT files in timestamp order.
+
+    Each file is decoded by its own Pipeline worker (a process by default)
+    and the streams are merged with a heap. Every worker queues at most
+    depth batches, so memory stays bounded however large the files are.
+    """
+
+    def __init__(self, filenames, mode='process', depth=8, batch_size=256,
+                 start_time=None, end_time=None, update_filter=None):
+        self.filenames = filenames
+        self.pipelines = [Pipeline(MRTParser, (filename, ALL_ATTRS, start_time, end_time, update_filter),
+                                   mode, depth, batch_size, name=filename)
+                          for filename in filenames]
+        self.merged = heapq.merge(*self.pipelines, key=operator.itemgetter(0))
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return next(self.merged)
+
+    next = __next__
+
+    def report(self):
+        return '\n'.join('%s %s' % (filename, pipeline.report())
+                         for filename, pipeline in zip(self.filenames, self.pipelines))
+
+    def close(self):
+        for pipeline in self.pipelines:
+            pipeline.close()
@@ -0,0 +1,400 @@
+"""Streaming parser for BGP4MP updates in MRT files (RFC 6396).
+
+MRTParser reads the file in large chunks and walks the MRT, BGP4MP and
+BGP headers in place with struct.unpack_from, decoding only the path
+attributes the caller asks for. It yields the same
+(timestamp, attr, nlri, withdraw) tuples as BGPDump, except that nlri and
+withdraw are arrays of prefix keys (see update.Update) instead of strings.
+"""
+import bz2
+import gzip
+import struct
+import time
+from array import array
+from socket import AF_INET6, inet_ntoa, inet_ntop
+
+from . import bgpmsg, metrics
+from .attrset import EMPTY, AttrSet, Memo
+
+BZ2_MAGIC = b'BZh'
+GZIP_MAGIC = b'\x1f\x8b'
+CHUNK_SIZE = 1 << 20
+
+# MRT types and subtypes
+TABLE_DUMP_V2 = 13
+BGP4MP = 16
+BGP4MP_ET = 17
+BGP4MP_MESSAGE = 1
+BGP4MP_MESSAGE_AS4 = 4
+BGP4MP_MESSAGE_LOCAL = 6
+BGP4MP_MESSAGE_AS4_LOCAL = 7
+AS4_SUBTYPES = (BGP4MP_MESSAGE_AS4, BGP4MP_MESSAGE_AS4_LOCAL)
+MESSAGE_SUBTYPES = (BGP4MP_MESSAGE, BGP4MP_MESSAGE_LOCAL) + AS4_SUBTYPES
+
+AFI_IPV4 = 1
+AFI_IPV6 = 2
+
+MRT_HEADER = struct.Struct('!IHHI')
+ALL_ATTRS = ('origin', 'as_path', 'nexthop', 'med', 'local_pref', 'community')
+ATTR_CODES = {
+    'origin': bgpmsg.ORIGIN,
+    'as_path': bgpmsg.AS_PATH,
+    'nexthop': bgpmsg.NEXT_HOP,
+    'med': bgpmsg.MULTI_EXIT_DISC,
+    'local_pref': bgpmsg.LOCAL_PREF,
+    'community': bgpmsg.COMMUNITIES,
+}
+
+_PAD = [b'\x00' * (4 - n) for n in range(5)]
+_UNPACK_H = struct.Struct('!H').unpack_from
+_UNPACK_I = struct.Struct('!I').unpack_from
+
+
+def open_mrt(filename):
+    """Open a raw, gzip or bzip2 compressed MRT file, detected by its magic bytes."""
+    with open(filename, 'rb') as f:
+        magic = f.read(3)
+    if magic.startswith(BZ2_MAGIC):
+        return bz2.BZ2File(filename, 'rb')
+    if magic.startswith(GZIP_MAGIC):
+        return gzip.GzipFile(filename, 'rb')
+    return open(filename, 'rb')
+
+
+def decode_prefixes(data, start, end):
+    """Decode IPv4 NLRI prefixes in data[start:end] into an array of prefixset keys."""
+    prefixes = array('Q')
+    append = prefixes.append
+    from_bytes = int.from_bytes
+    i = start
+    while i < end:
+        length = data[i]
+        if length > 32:
+            raise IndexError('invalid IPv4 prefix length %d' % length)
+        n = (length + 7) >> 3
+        i += 1
+        append(from_bytes(data[i:i + n], 'big') << (38 - 8 * n) | length)
+        i += n
+    return prefixes
+
+
+def decode_as_path(data, start, end, size):
+    """Return the ASNs of the first AS_SEQUENCE segment, as BGPDump does."""
+    fmt = '!%dI' if size == 4 else '!%dH'
+    i = start
+    while i < end:
+        seg_type, seg_len = data[i], data[i + 1]
+        if seg_type == bgpmsg.AS_SEQUENCE:
+            return list(struct.unpack_from(fmt % seg_len, data, i + 2))
+        i += 2 + seg_len * size
+    return []
+
+
+def decode_attributes(data, start, end, wanted, as_size):
+    """Decode the attribute codes in wanted from the path attributes in data[start:end]."""
+    attr = {}
+    as4_path = None
+    i = start
+    while i < end:
+        flags, code = data[i], data[i + 1]
+        if flags & bgpmsg.FLAG_EXTENDED_LENGTH:
+            length = _UNPACK_H(data, i + 2)[0]
+            i += 4
+        else:
+            length = data[i + 2]
+            i += 3
+        if code in wanted:
+            if code == bgpmsg.ORIGIN:
+                attr['origin'] = data[i]
+            elif code == bgpmsg.AS_PATH:
+                attr['as_path'] = decode_as_path(data, i, i + length, as_size)
+            elif code == bgpmsg.NEXT_HOP:
+                attr['nexthop'] = inet_ntoa(data[i:i + 4])
+            elif code == bgpmsg.MULTI_EXIT_DISC:
+                attr['med'] = _UNPACK_I(data, i)[0]
+            elif code == bgpmsg.LOCAL_PREF:
+                attr['local_pref'] = _UNPACK_I(data, i)[0]
+            elif code == bgpmsg.COMMUNITIES:
+                attr['community'] = ['%d:%d' % (c >> 16, c & 0xffff) for c in
+                                     struct.unpack_from('!%dI' % (length >> 2), data, i)]
+        elif code == bgpmsg.AS4_PATH and as_size == 2 and bgpmsg.AS_PATH in wanted:
+            as4_path = decode_as_path(data, i, i + length, 4)
+        i += length
+    if as4_path is not None and 'as_path' in attr and len(as4_path) <= len(attr['as_path']):
+        # rebuild the 4-octet path as in RFC 6793 4.2.3
+        attr['as_path'] = attr['as_path'][:len(attr['as_path']) - len(as4_path)] + as4_path
+    return attr
+
+
+class MRTParser(object):
+    """Iterate over the IPv4 updates of a MRT file.
+
+    attrs names the attributes to decode (default all of ALL_ATTRS); the
+    others are skipped without being looked at. Updates with the same
+    attribute bytes share one read-only AttrSet. After each update
+    the peer_as and peer_ip attributes describe the peer it was received from.
+    Records that are not BGP4MP updates are skipped, malformed ones are
+    counted in errors.
+
+    With start_time the parser jumps to the right place using the sidecar
+    time index (see mrtindex) and skips the few records before start_time;
+    iteration stops at the first record after end_time. An update_filter
+    (see updatefilter) sees the prefixes before the attributes are decoded.
+    """
+
+    def __init__(self, filename, attrs=ALL_ATTRS, start_time=None, end_time=None,
+                 update_filter=None, chunk_size=CHUNK_SIZE):
+        self.f = open_mrt(filename)
+        self.wanted = frozenset(ATTR_CODES[a] for a in attrs)
+        self.start_time = start_time
+        self.end_time = end_time
+        self.update_filter = update_filter
+        self.chunk_size = chunk_size
+        self.buf = b''
+        self.pos = 0
+        self.buf_offset = 0  # file offset of buf[0]
+        self.eof = False
+        self.records = 0
+        self.errors = 0
+        self.peer_as = None
+        self._peer_ip = None
+        self._attrs = {2: Memo(), 4: Memo()}  # AS size -> attribute bytes -> AttrSet
+        self.metered = metrics.registry.enabled
+        if self.metered:
+            metrics.registry.gauge('bgpreplay_mrt_records', 'MRT records read', lambda: self.records,
+                                   file=filename)
+            metrics.registry.gauge('bgpreplay_mrt_errors', 'Malformed MRT records', lambda: self.errors,
+                                   file=filename)
+            self.parse_time = metrics.registry.histogram('bgpreplay_parse_seconds',
+                                                         'Time to decode one update', source='mrt')
+        if start_time:
+            from .mrtindex import MRTIndex
+            self.buf_offset = MRTIndex.get(filename).lookup(start_time)
+            self.f.seek(self.buf_offset)
+
+    @property
+    def offset(self):
+        """Uncompressed file offset of the next record."""
+        return self.buf_offset + self.pos
+
+    @property
+    def peer_ip(self):
+        return inet_ntoa(self._peer_ip)
+
+    def _fill(self, needed):
+        """Make sure needed bytes are buffered at pos; return False at end of file."""
+        while len(self.buf) - self.pos < needed:
+            if self.eof:
+                return False
+            data = self.f.read(max(self.chunk_size, needed))
+            if not data:
+                self.eof = True
+            self.buf = self.buf[self.pos:] + data
+            self.buf_offset += self.pos
+            self.pos = 0
+        return True
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        while True:
+            if not self._fill(MRT_HEADER.size):
+                self.close()
+                raise StopIteration
+            timestamp, mrt_type, subtype, length = MRT_HEADER.unpack_from(self.buf, self.pos)
+            if not self._fill(MRT_HEADER.size + length):
+                self.close()
+                raise StopIteration
+            start = self.pos + MRT_HEADER.size
+            self.pos = end = start + length
+            self.records += 1
+            if self.end_time and timestamp > self.end_time:
+                self.close()
+                raise StopIteration
+            if self.start_time and timestamp < self.start_time:
+                continue
+            if mrt_type == BGP4MP_ET:
+                timestamp += _UNPACK_I(self.buf, start)[0] / 1000000.0
+                start += 4
+            elif mrt_type != BGP4MP:
+                continue
+            if subtype not in MESSAGE_SUBTYPES:
+                continue
+            try:
+                if self.metered:
+                    began = time.monotonic()
+                    update = self._parse_message(self.buf, start, end, subtype)
+                    self.parse_time.observe(time.monotonic() - began)
+                else:
+                    update = self._parse_message(self.buf, start, end, subtype)
+            except (struct.error, IndexError):
+                self.errors += 1
+                continue
+            if update:
+                return (timestamp,) + update
+
+    next = __next__
+
+    def _parse_message(self, buf, i, end, subtype):
+        if subtype in AS4_SUBTYPES:
+            peer_as = _UNPACK_I(buf, i)[0]
+            i += 10  # peer AS, local AS, interface index
+            as_size = 4
+        else:
+            peer_as = _UNPACK_H(buf, i)[0]
+            i += 6
+            as_size = 2
+        afi = _UNPACK_H(buf, i)[0]
+        if afi != AFI_IPV4:
+            return None
+        self.peer_as = peer_as
+        self._peer_ip = buf[i + 2:i + 6]
+        i += 10  # afi, peer and local address
+        if buf[i + 18] != bgpmsg.UPDATE:
+            return None
+        if self.update_filter is not None and not self.update_filter.wants_peer(peer_as):
+            return None
+        msg_end = i + _UNPACK_H(buf, i + 16)[0]
+        if msg_end > end:
+            raise IndexError('BGP message overruns MRT record')
+        i += bgpmsg.HEADER_LEN
+        wlen = _UNPACK_H(buf, i)[0]
+        withdraw = decode_prefixes(buf, i + 2, i + 2 + wlen) if wlen else array('Q')
+        i += 2 + wlen
+        alen = _UNPACK_H(buf, i)[0]
+        i += 2
+        nlri = decode_prefixes(buf, i + alen, msg_end)
+        if not nlri and not withdraw:
+            return None
+        if self.update_filter is not None:
+            return self.update_filter.filter(
+                nlri, withdraw, (lambda: self._attributes(buf, i, alen, as_size)) if nlri else EMPTY)
+        if not nlri:
+            return EMPTY, nlri, withdraw
+        return self._attributes(buf, i, alen, as_size), nlri, withdraw
+
+    def _attributes(self, buf, i, alen, as_size):
+        attrs = self._attrs[as_size]
+        key = buf[i:i + alen]
+        attr = attrs.get(key)
+        if attr is None:
+            attr = attrs.put(key, AttrSet(decode_attributes(buf, i, i + alen, self.wanted, as_size)))
+        return attr
+
+    def close(self):
+        self.eof = True
+        if self.f:
+            self.f.close()
+            self.f = None
+
+
+# TABLE_DUMP_V2 subtypes
+PEER_INDEX_TABLE = 1
+RIB_IPV4_UNICAST = 2
+RIB_IPV6_UNICAST = 4
+PEER_TYPE_IPV6 = 0x01
+PEER_TYPE_AS4 = 0x02
+
+
+def _format_prefix(data, i, length, family):
+    n = (length + 7) >> 3
+    if family == AFI_IPV4:
+        return '%s/%d' % (inet_ntoa(data[i:i + n] + _PAD[n]), length)
+    return '%s/%d' % (inet_ntop(AF_INET6, data[i:i + n] + b'\x00' * (16 - n)), length)
+
+
+class RIBParser(MRTParser):
+    """Iterate over the routes of one peer in a TABLE_DUMP_V2 RIB dump.
+
+    Yields (prefix, attributes) where attributes is the raw path attribute
+    blob of the route, so routes sharing attributes can be grouped without
+    decoding them. The peer is picked from the PEER_INDEX_TABLE by address
+    or by index; by default the first peer is used.
+    """
+
+    def __init__(self, filename, peer=None, chunk_size=CHUNK_SIZE):
+        MRTParser.__init__(self, filename, chunk_size=chunk_size)
+        self.peer = peer
+        self.peer_index = None
+        self.peers = []
+
+    def _parse_peer_index(self, buf, i):
+        i += 4  # collector BGP ID
+        i += 2 + _UNPACK_H(buf, i)[0]  # view name
+        count = _UNPACK_H(buf, i)[0]
+        i += 2
+        for _ in range(count):
+            peer_type = buf[i]
+            i += 5  # peer type, peer BGP ID
+            if peer_type & PEER_TYPE_IPV6:
+                address = inet_ntop(AF_INET6, buf[i:i + 16])
+                i += 16
+            else:
+                address = inet_ntoa(buf[i:i + 4])
+                i += 4
+            if peer_type & PEER_TYPE_AS4:
+                asn = _UNPACK_I(buf, i)[0]
+                i += 4
+            else:
+                asn = _UNPACK_H(buf, i)[0]
+                i += 2
+            self.peers.append((address, asn))
+        if self.peer is None:
+            self.peer_index = 0
+        elif str(self.peer).isdigit():
+            self.peer_index = int(self.peer)
+            if not 0 <= self.peer_index < len(self.peers):
+                raise ValueError('peer %s is not in the RIB dump' % self.peer)
+        else:
+            addresses = [address for address, _ in self.peers]
+            if self.peer not in addresses:
+                raise ValueError('peer %s is not in the RIB dump' % self.peer)
+            self.peer_index = addresses.index(self.peer)
+        self._peer_ip = self.peers[self.peer_index][0]
+        self.peer_as = self.peers[self.peer_index][1]
+
+    @property
+    def peer_ip(self):
+        return self._peer_ip
+
+    def __next__(self):
+        while True:
+            if not self._fill(MRT_HEADER.size):
+                self.close()
+                raise StopIteration
+            _, mrt_type, subtype, length = MRT_HEADER.unpack_from(self.buf, self.pos)
+            if not self._fill(MRT_HEADER.size + length):
+                self.close()
+                raise StopIteration
+            start = self.pos + MRT_HEADER.size
+            self.pos = start + length
+            self.records += 1
+            if mrt_type != TABLE_DUMP_V2:
+                continue
+            try:
+                if subtype == PEER_INDEX_TABLE:
+                    self._parse_peer_index(self.buf, start)
+                elif subtype in (RIB_IPV4_UNICAST, RIB_IPV6_UNICAST) and self.peer_index is not None:
+                    family = AFI_IPV4 if subtype == RIB_IPV4_UNICAST else AFI_IPV6
+                    route = self._parse_rib(self.buf, start, family)
+                    if route:
+                        return route
+            except (struct.error, IndexError):
+                self.errors += 1
+
+    next = __next__
+
+    def _parse_rib(self, buf, i, family):
+        length = buf[i + 4]  # after the sequence number
+        prefix = _format_prefix(buf, i + 5, length, family)
+        i += 5 + ((length + 7) >> 3)
+        count = _UNPACK_H(buf, i)[0]
+        i += 2
+        for _ in range(count):
+            peer_index, _, attr_len = struct.unpack_from('!HIH', buf, i)
+            i += 8
+            if peer_index == self.peer_index:
+                return prefix, buf[i:i + attr_len]
+            i += attr_len
+        return None
@@ -0,0 +1,94 @@
+"""Pace updates against absolute deadlines.
+"""
+import time
+
+from . import metrics
+
+
+class Pacer(object):
+    """Decide when the next update is due and sleep until then.
+
+    Deadlines are computed from the start of the run on the monotonic clock
+    rather than as a sleep after each send, so the time spent sending does
+    not slow the run down and errors do not accumulate. When the sender
+    falls behind, updates are released back-to-back until it has caught up.
+
+    With a rate, update n is due at start + n/rate. Debt is capped to burst
+    updates (a token bucket of that size), so after a stall at most burst
+    updates go out at full speed.
+
+    Without a rate, updates are due at their own timestamps (MRT, live or
+    text delays) divided by speed. Gaps between timestamps longer than
+    max_gap seconds are cut down to max_gap.
+
+    idle is called before any sleep of at least idle_after seconds, giving
+    the caller a chance to flush what it has buffered.
+    """
+
+    def __init__(self, rate=0, speed=1.0, max_gap=0, burst=0, idle=None, idle_after=0):
+        self.rate = float(rate or 0)
+        self.speed = float(speed or 1.0)
+        self.max_gap = max_gap or 0
+        self.burst = burst or max(1, int(self.rate))
+        self.idle = idle
+        self.idle_after = idle_after
+        self.start = None
+        self.sent = 0
+        self.next_due = 0.0
+        self.first_timestamp = None
+        self.prev_timestamp = None
+        self.skipped = 0.0  # seconds of timestamp gaps cut by max_gap
+        self.max_lag = 0.0
+        self.metered = metrics.registry.enabled
+        if self.metered:
+            self.lag = metrics.registry.histogram('bgpreplay_pacer_lag_seconds',
+                                                  'How late updates were released')
+            metrics.registry.gauge('bgpreplay_pacer_released', 'Updates released by the pacer',
+                                   lambda: self.sent)
+
+    def wait(self, timestamp=None):
+        """Block until the next update is due; timestamp is only used when no rate is set."""
+        now = time.monotonic()
+        if self.start is None:
+            self.start = self.next_due = now
+        if self.rate:
+            due = self.next_due
+            if now - due > self.burst / self.rate:
+                due = now - self.burst / self.rate
+            self.next_due = due + 1.0 / self.rate
+        elif timestamp is not None:
+            if self.first_timestamp is None:
+                self.first_timestamp = self.prev_timestamp = timestamp
+            gap = timestamp - self.prev_timestamp
+            if self.max_gap and gap > self.max_gap:
+                self.skipped += gap - self.max_gap
+            self.prev_timestamp = max(timestamp, self.prev_timestamp)  # out of order goes right away
+            due = self.start + (self.prev_timestamp - self.first_timestamp - self.skipped) / self.speed
+        else:
+            due = now
+        self.sent += 1
+        if due > now:
+            if self.idle and due - now >= self.idle_after:
+                self.idle()
+                now = time.monotonic()
+            if due > now:
+                time.sleep(due - now)
+        elif now - due > self.max_lag:
+            self.max_lag = now - due
+        if self.metered:
+            self.lag.observe(max(0.0, now - due))
+
+    def report(self):
+        if not self.start or not self.sent:
+            return 'no updates sent'
+        elapsed = time.monotonic() - self.start
+        achieved = self.sent / elapsed if elapsed else 0.0
+        if self.rate:
+            target = self.rate
+        elif self.first_timestamp is not None and self.prev_timestamp > self.first_timestamp:
+            span = (self.prev_timestamp - self.first_timestamp - self.skipped) / self.speed
+            target = self.sent / span if span > 0 else 0.0
+        else:
+            target = 0.0
+        return 'sent %d updates in %.2fs: target %.1f/s, achieved %.1f/s, max lag %.3fs' % (
+            self.sent, elapsed, target, achieved, self.max_lag)
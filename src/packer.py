@@ -0,0 +1,150 @@
+"""Pack updates that share attributes into fewer, larger updates.
+"""
+import threading
+import time
+import traceback
+
+from .attrset import AttrSet
+
+_SCALARS = frozenset((int, str, float, bool, type(None)))
+
+
+def freeze(value):
+    """Turn an attribute value into something hashable."""
+    kind = type(value)
+    if kind in _SCALARS:
+        return value
+    if kind is AttrSet:  # interned by the source, already hashable
+        return value
+    if kind is dict:
+        return tuple(sorted((k, freeze(v)) for k, v in value.items()))
+    if kind is list or kind is tuple:
+        frozen = tuple(value)
+        try:
+            hash(frozen)  # flat lists (AS paths) need no recursion
+            return frozen
+        except TypeError:
+            pass
+    if isinstance(value, (list, tuple)):
+        return tuple(freeze(v) for v in value)
+    if isinstance(value, dict):
+        return tuple(sorted((k, freeze(v)) for k, v in value.items()))
+    try:
+        hash(value)
+    except TypeError:
+        return str(value)
+    return value
+
+
+def attr_key(attr, peers=None):
+    return freeze(attr), freeze(peers)
+
+
+class UpdatePacker(object):
+    """Collect updates for a short window and send them grouped by attributes.
+
+    Announcements with identical attributes (and target peers) are merged
+    into one update, all withdrawals into another. A group is sent when the
+    window (in seconds) has passed since the first pending update or when
+    size prefixes are pending. A prefix announced and withdrawn inside the
+    window only keeps its last state, so grouping never reorders the
+    updates of a prefix. A timer thread sends the groups older than the
+    window when no update comes to do it, ex: while a live source waits
+    for its next record; send is then called from that thread, under the
+    lock add() and flush() take.
+    """
+
+    def __init__(self, send, window=0.1, size=10000):
+        self.send = send
+        self.window = window
+        self.size = size
+        self.groups = {}     # attr key -> (attr, peers, {prefix: None})
+        self.withdraws = {}  # peers -> {prefix: None}
+        self.pending = {}    # prefix -> attr key of its group, None if withdrawn
+        self.first = None
+        self.updates_in = 0
+        self.updates_out = 0
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.timer = None
+
+    def _discard(self, prefix, peers):
+        key = self.pending.pop((prefix, peers), False)
+        if key is None:
+            self.withdraws[peers].pop(prefix, None)
+        elif key is not False:
+            self.groups[key][2].pop(prefix, None)
+
+    def add(self, update):
+        if self.timer is None:
+            self.timer = threading.Thread(target=self._run_timer, name='bgpreplay-packer', daemon=True)
+            self.timer.start()
+        with self.lock:
+            self._add(update)
+
+    def _add(self, update):
+        now = time.monotonic()
+        if self.first is None:
+            self.first = now
+        peers = freeze(update.get('peers'))
+        withdraw = update.get('withdraw') or []
+        if withdraw:
+            group = self.withdraws.setdefault(peers, {})
+            for prefix in withdraw:
+                self._discard(prefix, peers)
+                group[prefix] = None
+                self.pending[(prefix, peers)] = None
+        nlri = update.get('nlri') or []
+        if nlri:
+            key = attr_key(update['attr'], peers)
+            if key not in self.groups:
+                self.groups[key] = (update['attr'], update.get('peers'), {})
+            group = self.groups[key][2]
+            for prefix in nlri:
+                self._discard(prefix, peers)
+                group[prefix] = None
+                self.pending[(prefix, peers)] = key
+        self.updates_in += 1
+        if len(self.pending) >= self.size or now - self.first >= self.window:
+            self._flush()
+
+    def _run_timer(self):
+        while not self.stopped.wait(self.window):
+            with self.lock:
+                if self.first is None or time.monotonic() - self.first < self.window:
+                    continue
+                try:
+                    self._flush()
+                except Exception:
+                    traceback.print_exc()
+
+    def flush(self):
+        """Send everything pending."""
+        with self.lock:
+            self._flush()
+
+    def close(self):
+        """Stop the timer and send everything pending."""
+        self.stopped.set()
+        if self.timer is not None:
+            self.timer.join()
+        self.flush()
+
+    def _flush(self):
+        groups, withdraws = self.groups, self.withdraws
+        self.groups, self.withdraws, self.pending = {}, {}, {}
+        self.first = None
+        for peers, prefixes in withdraws.items():
+            if prefixes:
+                update = {'attr': {}, 'nlri': [], 'withdraw': list(prefixes)}
+                if peers:
+                    update['peers'] = list(peers)
+                self.send(update)
+                self.updates_out += 1
+        for attr, peers, prefixes in groups.values():
+            if prefixes:
+                update = {'attr': attr, 'nlri': list(prefixes), 'withdraw': []}
+                if peers:
+                    update['peers'] = peers
+                self.send(update)
+                self.updates_out += 1
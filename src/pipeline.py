@@ -0,0 +1,143 @@
+"""Decode updates off the send thread.
+
+A Pipeline runs a source (MRTParser, BGPStreamReader, ...) in a thread or
+a process and hands batches of decoded updates to the sender through a
+bounded queue. When the queue is full the decoder waits, when it is empty
+the sender waits; the time each side spends waiting shows which stage
+limits the replay. A source with an at_boundary() method (the live reader
+at the end of each dump) has its partial batch handed over there, instead
+of keeping it until the next dump fills the batch. The report() of the
+source, if it has one (the skipped lines of a text file), is sent back
+with the end of the stream and added to the report of the pipeline.
+"""
+import multiprocessing
+import queue
+import threading
+import time
+import traceback
+
+from . import metrics
+
+_END = 'end'
+_ERROR = 'error'
+
+
+def _produce(make_source, args, q, batch_size, decoded, put_wait):
+    try:
+        batch = []
+        source = make_source(*args)
+        at_boundary = getattr(source, 'at_boundary', None)
+        for update in iter(source.next, None):
+            batch.append(update)
+            if len(batch) >= batch_size or (at_boundary is not None and at_boundary()):
+                start = time.monotonic()
+                q.put(batch)
+                put_wait.value += time.monotonic() - start
+                decoded.value += len(batch)
+                batch = []
+        if batch:
+            q.put(batch)
+            decoded.value += len(batch)
+        report = getattr(source, 'report', None)
+        q.put((_END, report() if report else None))
+    except Exception:
+        q.put((_ERROR, traceback.format_exc()))
+
+
+class Pipeline(object):
+    """Iterate over the updates of make_source(*args) decoded in a background worker.
+
+    mode is 'thread' or 'process'; in process mode make_source and args
+    must be picklable. depth is the number of batches the queue holds.
+    name labels the metrics of the pipeline, the name of make_source by default.
+    """
+
+    def __init__(self, make_source, args=(), mode='thread', depth=64, batch_size=256, name=None):
+        self.mode = mode
+        # shared counters, so the decoder can update them from another process
+        self.decoded = multiprocessing.RawValue('L', 0)
+        self.put_wait = multiprocessing.RawValue('d', 0.0)
+        self.get_wait = 0.0
+        self.sent = 0
+        if mode == 'process':
+            self.queue = multiprocessing.Queue(depth)
+            worker = multiprocessing.Process
+        else:
+            self.queue = queue.Queue(depth)
+            worker = threading.Thread
+        self.worker = worker(target=_produce, name='bgpreplay-decoder', daemon=True,
+                             args=(make_source, args, self.queue, batch_size,
+                                   self.decoded, self.put_wait))
+        self.worker.start()
+        self.batch = iter(())
+        self.start = time.monotonic()
+        self.done = False
+        self.source_report = None
+        if metrics.registry.enabled:
+            registry = metrics.registry
+            stage = name or getattr(make_source, '__name__', 'source')
+            registry.gauge('bgpreplay_pipeline_decoded', 'Updates decoded by the pipeline worker',
+                           lambda: self.decoded.value, source=stage)
+            registry.gauge('bgpreplay_pipeline_queue_depth', 'Batches waiting for the sender',
+                           self.queue_depth, source=stage)
+            registry.gauge('bgpreplay_pipeline_decoder_wait_seconds', 'Time the decoder waited on a full queue',
+                           lambda: self.put_wait.value, source=stage)
+            registry.gauge('bgpreplay_pipeline_sender_wait_seconds', 'Time the sender waited on an empty queue',
+                           lambda: self.get_wait, source=stage)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        for update in self.batch:
+            self.sent += 1
+            return update
+        if self.done:
+            raise StopIteration
+        start = time.monotonic()
+        batch = self.queue.get()
+        self.get_wait += time.monotonic() - start
+        if isinstance(batch, tuple):  # _END or _ERROR
+            self.done = True
+            if batch[0] == _ERROR:
+                raise RuntimeError('decoder failed:\n%s' % batch[1])
+            self.source_report = batch[1]
+            raise StopIteration
+        self.batch = iter(batch)
+        return self.__next__()
+
+    next = __next__
+
+    def queue_depth(self):
+        try:
+            return self.queue.qsize()
+        except NotImplementedError:  # multiprocessing.Queue on macOS
+            return -1
+
+    def stats(self):
+        return {
+            'decoded': self.decoded.value,
+            'sent': self.sent,
+            'queue_depth': self.queue_depth(),
+            'decoder_wait': self.put_wait.value,
+            'sender_wait': self.get_wait,
+            'elapsed': time.monotonic() - self.start,
+        }
+
+    def report(self):
+        stats = self.stats()
+        if stats['decoder_wait'] > stats['sender_wait']:
+            limit = 'send'
+        else:
+            limit = 'decode'
+        report = ('pipeline: decoded %(decoded)d, sent %(sent)d in %(elapsed).2fs; '
+                  'decoder waited %(decoder_wait).2fs on a full queue, '
+                  'sender waited %(sender_wait).2fs on an empty queue' % stats) + \
+                 ' -> %s is the limiting stage' % limit
+        if self.source_report:
+            report += '\n' + self.source_report
+        return report
+
+    def close(self):
+        if self.mode == 'process' and self.worker.is_alive():
+            self.worker.terminate()
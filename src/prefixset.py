@@ -0,0 +1,112 @@
+"""A compact set of IPv4 prefixes with O(1) add, remove and random sample.
+
+Prefixes are stored as integers (address << 6 | length) in a dense array,
+so a random member is just a random position. An open-addressing hash
+table of positions finds a prefix in the dense array; removing swaps the
+last member into the freed position. Both arrays take about 24 bytes per
+prefix, however many prefixes are held.
+"""
+import array
+import random
+
+_EMPTY = -1
+_MULT = 0x9E3779B97F4A7C15  # Fibonacci hashing
+_MASK64 = (1 << 64) - 1
+
+
+def encode(prefix):
+    """'10.0.0.0/8' -> integer key."""
+    addr, _, length = prefix.partition('/')
+    a, b, c, d = addr.split('.')
+    return (((int(a) << 24) | (int(b) << 16) | (int(c) << 8) | int(d)) << 6) | int(length or 32)
+
+
+def decode(key):
+    """Integer key -> '10.0.0.0/8'."""
+    addr = key >> 6
+    return '%d.%d.%d.%d/%d' % (addr >> 24, (addr >> 16) & 0xff, (addr >> 8) & 0xff, addr & 0xff, key & 0x3f)
+
+
+class PrefixSet(object):
+    """Set of prefix keys (see encode) supporting uniform random sampling."""
+
+    def __init__(self, rng=None, capacity=1024):
+        self.rng = rng or random
+        self.keys = array.array('Q')
+        self._resize(capacity)
+
+    def __len__(self):
+        return len(self.keys)
+
+    def __contains__(self, key):
+        return self.table[self._find(key)] != _EMPTY
+
+    def _resize(self, capacity):
+        size = 8
+        while size < capacity * 2:
+            size <<= 1
+        self.shift = 64 - size.bit_length() + 1
+        self.mask = size - 1
+        self.table = array.array('q', [_EMPTY]) * size
+        for pos, key in enumerate(self.keys):
+            self.table[self._find(key)] = pos
+
+    def _find(self, key):
+        """Slot holding key, or the empty slot where it would go."""
+        table, keys, mask = self.table, self.keys, self.mask
+        slot = ((key * _MULT) & _MASK64) >> self.shift
+        while True:
+            pos = table[slot]
+            if pos == _EMPTY or keys[pos] == key:
+                return slot
+            slot = (slot + 1) & mask
+
+    def add(self, key):
+        """Add key; return False if it was already there."""
+        slot = self._find(key)
+        if self.table[slot] != _EMPTY:
+            return False
+        self.table[slot] = len(self.keys)
+        self.keys.append(key)
+        if len(self.keys) * 2 > self.mask:
+            self._resize(len(self.keys) * 2)
+        return True
+
+    def discard(self, key):
+        """Remove key; return False if it was not there."""
+        table, keys, mask = self.table, self.keys, self.mask
+        slot = self._find(key)
+        pos = table[slot]
+        if pos == _EMPTY:
+            return False
+        if pos != len(keys) - 1:
+            last = keys[-1]
+            table[self._find(last)] = pos
+            keys[pos] = last
+        keys.pop()
+        # backward shift deletion keeps the probe chains intact without tombstones
+        table[slot] = _EMPTY
+        hole = slot
+        slot = (slot + 1) & mask
+        while table[slot] != _EMPTY:
+            home = ((keys[table[slot]] * _MULT) & _MASK64) >> self.shift
+            if (slot - home) & mask >= (slot - hole) & mask:
+                table[hole] = table[slot]
+                table[slot] = _EMPTY
+                hole = slot
+            slot = (slot + 1) & mask
+        return True
+
+    def sample(self, num):
+        """Return up to num distinct random keys."""
+        size = len(self.keys)
+        if size <= num:
+            return self.keys.tolist()
+        return [self.keys[pos] for pos in self.rng.sample(range(size), num)]
+
+    def pop_sample(self, num):
+        """Remove and return up to num random keys."""
+        keys = self.sample(num)
+        for key in keys:
+            self.discard(key)
+        return keys
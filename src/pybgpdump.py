@@ -34,6 +34,8 @@ class BGPDump:
         return self
 
     def next(self):
+        if self.f.closed:
+            raise StopIteration
         mrt_h = bgp_h = bgp_m = None
         while True:
             try:
@@ -64,10 +66,12 @@ class BGPDump:
                 if bgp_m.type not in SUPPORTED_TYPES:
                     continue
                 break
+            except StopIteration:
+                raise
             except:
                 pass
         if mrt_h is None or bgp_h is None or bgp_m is None:
-            StopIteration
+            raise StopIteration
         if bgp_m.type != dpkt.bgp.UPDATE:
             print(bgp_m.type, 'not an update')
             return self.next()
@@ -105,3 +109,5 @@ class BGPDump:
                 #TODO: handle mp unreach message
                 pass
         return (mrt_h.ts, attr, nlri, withdraw)
+
+    __next__ = next
@@ -0,0 +1,197 @@
+"""A radix (path-compressed binary) trie keyed by IPv4 and IPv6 prefixes.
+"""
+import ipaddress
+
+
+def parse_prefix(prefix):
+    """'10.0.0.0/8' -> (width, network int, length); host bits are cleared."""
+    addr, _, length = prefix.partition('/')
+    if ':' in addr:
+        width = 128
+        value = int(ipaddress.IPv6Address(addr))
+    else:
+        width = 32
+        a, b, c, d = addr.split('.')
+        value = (int(a) << 24) | (int(b) << 16) | (int(c) << 8) | int(d)
+    length = int(length) if length else width
+    if length < width:
+        value &= ~((1 << (width - length)) - 1)
+    return width, value, length
+
+
+def format_prefix(width, value, length):
+    if width == 32:
+        return '%d.%d.%d.%d/%d' % (value >> 24, (value >> 16) & 0xff, (value >> 8) & 0xff,
+                                   value & 0xff, length)
+    return '%s/%d' % (ipaddress.IPv6Address(value).compressed, length)
+
+
+class _Node(object):
+    __slots__ = ('value', 'length', 'data', 'has_data', 'children')
+
+    def __init__(self, value, length):
+        self.value = value
+        self.length = length
+        self.data = None
+        self.has_data = False
+        self.children = [None, None]
+
+
+class RadixTree(object):
+    """Map prefixes to values, with exact, longest-prefix and covered lookups.
+
+    Prefixes are given as strings ('10.0.0.0/8', '2001:db8::/32'); IPv4 and
+    IPv6 live in separate tries. Nodes only exist where prefixes are stored
+    or where two branches split, so the trie holds at most two nodes per
+    prefix.
+    """
+
+    def __init__(self):
+        self.roots = {32: None, 128: None}
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    def __contains__(self, prefix):
+        node = self._lookup(*parse_prefix(prefix))
+        return node is not None and node.has_data
+
+    def _lookup(self, width, value, length):
+        node = self.roots[width]
+        while node is not None:
+            node_length = node.length
+            if node_length > length or (value ^ node.value) >> (width - node_length):
+                return None
+            if node_length == length:
+                return node
+            node = node.children[(value >> (width - 1 - node_length)) & 1]
+        return None
+
+    def insert(self, prefix, data=None):
+        """Store data for prefix; return the previous data or None."""
+        width, value, length = parse_prefix(prefix)
+        parent, side = None, 0
+        node = self.roots[width]
+        while node is not None:
+            node_length = node.length
+            diff = value ^ node.value
+            if node_length <= length and not diff >> (width - node_length):
+                if node_length == length:
+                    old = node.data
+                    node.data = data
+                    if not node.has_data:
+                        node.has_data = True
+                        self.size += 1
+                    return old
+                parent, side = node, (value >> (width - 1 - node_length)) & 1
+                node = parent.children[side]
+                continue
+            # value/length and node part ways after common bits
+            common = min(width - diff.bit_length(), length, node_length)
+            new = _Node(value, length)
+            new.data, new.has_data = data, True
+            if common == length:
+                new.children[(node.value >> (width - 1 - length)) & 1] = node
+            else:
+                glue = _Node(value >> (width - common) << (width - common), common)
+                glue.children[(value >> (width - 1 - common)) & 1] = new
+                glue.children[(node.value >> (width - 1 - common)) & 1] = node
+                new = glue
+            break
+        else:
+            new = _Node(value, length)
+            new.data, new.has_data = data, True
+        if parent is None:
+            self.roots[width] = new
+        else:
+            parent.children[side] = new
+        self.size += 1
+        return None
+
+    def get(self, prefix, default=None):
+        node = self._lookup(*parse_prefix(prefix))
+        if node is None or not node.has_data:
+            return default
+        return node.data
+
+    def delete(self, prefix):
+        """Remove prefix; return its data or None if it was not stored."""
+        width, value, length = parse_prefix(prefix)
+        path = []
+        node = self.roots[width]
+        while node is not None and node.length < length:
+            if (value ^ node.value) >> (width - node.length):
+                return None
+            side = (value >> (width - 1 - node.length)) & 1
+            path.append((node, side))
+            node = node.children[side]
+        if node is None or node.length != length or node.value != value or not node.has_data:
+            return None
+        data = node.data
+        node.data, node.has_data = None, False
+        self.size -= 1
+        # drop nodes left without data and with fewer than two children
+        while node is not None and not node.has_data:
+            children = [c for c in node.children if c is not None]
+            if len(children) == 2:
+                break
+            replacement = children[0] if children else None
+            if path:
+                parent, side = path.pop()
+                parent.children[side] = replacement
+                node = parent
+            else:
+                self.roots[width] = replacement
+                node = None
+        return data
+
+    def longest_match(self, prefix):
+        """Return (prefix, data) of the most specific stored prefix covering prefix, or None."""
+        width, value, length = parse_prefix(prefix)
+        best = None
+        node = self.roots[width]
+        while node is not None and node.length <= length:
+            if (value ^ node.value) >> (width - node.length):
+                break
+            if node.has_data:
+                best = node
+            if node.length == length:
+                break
+            node = node.children[(value >> (width - 1 - node.length)) & 1]
+        if best is None:
+            return None
+        return format_prefix(width, best.value, best.length), best.data
+
+    def covers(self, prefix):
+        """True if prefix or a less specific prefix is stored."""
+        return self.covers_value(*parse_prefix(prefix))
+
+    def covers_value(self, width, value, length):
+        """covers() for a prefix given as parse_prefix() returns it."""
+        node = self.roots[width]
+        while node is not None and node.length <= length:
+            if (value ^ node.value) >> (width - node.length):
+                return False
+            if node.has_data:
+                return True
+            if node.length == length:
+                return False
+            node = node.children[(value >> (width - 1 - node.length)) & 1]
+        return False
+
+    def items(self):
+        """Yield (prefix, data) of all stored prefixes, less specifics first."""
+        for width, root in self.roots.items():
+            stack = [root] if root is not None else []
+            while stack:
+                node = stack.pop()
+                if node.has_data:
+                    yield format_prefix(width, node.value, node.length), node.data
+                for child in reversed(node.children):
+                    if child is not None:
+                        stack.append(child)
+
+    def clear(self):
+        self.roots = {32: None, 128: None}
+        self.size = 0
@@ -0,0 +1,174 @@
+"""Generate random updates in batches.
+
+Prefixes, prefix lengths, AS paths and the other attributes of a whole
+batch are drawn at once, with NumPy when it is installed, and handed out
+as Updates with packed prefix keys; they are only turned into strings for
+agents that need text. The prefix lengths and AS path
+lengths follow configurable histograms; the defaults approximate today's
+IPv4 default-free zone.
+"""
+import random
+from array import array
+
+from .update import Update
+
+# prefix length -> weight (percent of the IPv4 table)
+PREFIX_LENGTHS = {
+    8: 0.1, 12: 0.2, 13: 0.2, 14: 0.4, 15: 0.6, 16: 1.4, 17: 0.8, 18: 1.4,
+    19: 3.0, 20: 4.5, 21: 4.5, 22: 12.0, 23: 10.0, 24: 60.9,
+}
+# number of ASes after the local AS -> weight
+PATH_LENGTHS = {1: 2, 2: 12, 3: 30, 4: 28, 5: 15, 6: 7, 7: 3, 8: 2, 9: 1}
+ORIGINS = ['igp', 'egp', 'incomplete']
+MAX_ASN = 64999
+FIRST_OCTET, LAST_OCTET = 1, 223  # unicast space, without 0/8
+
+
+def parse_histogram(value):
+    """Parse 'value:weight,value:weight' (or a dict) into {int: float}."""
+    if not value or isinstance(value, dict):
+        return value
+    histogram = {}
+    for item in value.replace(' ', ',').split(','):
+        if item:
+            key, _, weight = item.partition(':')
+            histogram[int(key)] = float(weight or 1)
+    return histogram
+
+
+class RandomUpdates(object):
+    """Iterate over random updates, generated batch_size at a time.
+
+    update_type is 'announce' or 'withdraw' and sets whether the prefixes
+    go to nlri or withdraw. seed makes the sequence reproducible. With
+    shard=(index, count) only networks whose number is index modulo count
+    are drawn, so that workers never generate the same prefix.
+    """
+
+    def __init__(self, local_as, max_prefix=1, nexthops=None, update_type='announce',
+                 seed=None, prefix_lengths=None, path_lengths=None, asn_dist='uniform',
+                 batch_size=4096, shard=None):
+        self.local_as = int(local_as)
+        self.max_prefix = max(1, int(max_prefix))
+        self.nexthops = [str(nh) for nh in nexthops or []] or [None]
+        self.update_type = update_type
+        self.asn_dist = asn_dist
+        self.batch_size = batch_size
+        self.shard = shard or (0, 1)
+        lengths = prefix_lengths or PREFIX_LENGTHS
+        self.lengths = sorted(lengths)
+        self.length_weights = [float(lengths[l]) for l in self.lengths]
+        hops = path_lengths or PATH_LENGTHS
+        self.hops = sorted(hops)
+        self.hop_weights = [float(hops[h]) for h in self.hops]
+        for length in self.lengths:
+            if not 8 <= length <= 32:
+                raise ValueError('prefix length out of range (8-32): %d' % length)
+        try:
+            import numpy
+        except ImportError:
+            numpy = None
+        self.np = numpy
+        if numpy is not None:
+            self.rng = numpy.random.default_rng(seed)
+        else:
+            self.rng = random.Random(seed)
+        self.batch = iter(())
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        for update in self.batch:
+            return update
+        self.batch = iter(self.generate(self.batch_size))
+        return next(self.batch)
+
+    next = __next__
+
+    def prefixes(self, num):
+        """Return num random prefixes as a list of keys (address << 6 | length, see prefixset)."""
+        if self.np is not None:
+            return self._prefixes_numpy(num)
+        index, count = self.shard
+        keys = []
+        for length in self.rng.choices(self.lengths, self.length_weights, k=num):
+            lo, hi = FIRST_OCTET << (length - 8), (LAST_OCTET + 1) << (length - 8)
+            net = lo + self.rng.randrange((hi - lo) // count) * count + (index - lo) % count
+            keys.append(net << (38 - length) | length)
+        return keys
+
+    def _prefixes_numpy(self, num):
+        np = self.np
+        index, count = self.shard
+        weights = np.array(self.length_weights)
+        lengths = self.rng.choice(np.array(self.lengths, dtype=np.int64), num, p=weights / weights.sum())
+        lo = np.left_shift(FIRST_OCTET, lengths - 8)
+        hi = np.left_shift(LAST_OCTET + 1, lengths - 8)
+        span = (hi - lo) // count
+        nets = lo + (self.rng.random(num) * span).astype(np.int64) * count + (index - lo) % count
+        return (np.left_shift(nets, 38 - lengths) | lengths).tolist()
+
+    def generate(self, num):
+        """Return a list of num random updates."""
+        if self.np is not None:
+            counts, paths, meds, origins, prefs, nexthops = self._attributes_numpy(num)
+        else:
+            counts, paths, meds, origins, prefs, nexthops = self._attributes(num)
+        keys = self.prefixes(sum(counts))
+        announce = self.update_type == 'announce'
+        updates = []
+        pos = 0
+        for i in range(num):
+            end = pos + counts[i]
+            attr = {
+                'nexthop': self.nexthops[nexthops[i]],
+                'med': meds[i],
+                'origin': ORIGINS[origins[i]],
+                'as_path': paths[i],
+                'local_pref': prefs[i],
+            }
+            prefixes = array('Q', keys[pos:end])
+            if announce:
+                updates.append(Update(attr, prefixes, array('Q')))
+            else:
+                updates.append(Update(attr, array('Q'), prefixes))
+            pos = end
+        return updates
+
+    def _attributes(self, num):
+        rng = self.rng
+        counts = [rng.randint(1, self.max_prefix) for _ in range(num)]
+        paths = []
+        for hops in rng.choices(self.hops, self.hop_weights, k=num):
+            paths.append([self.local_as] + [self._asn() for _ in range(hops)])
+        meds = [rng.randint(0, 100) for _ in range(num)]
+        origins = [rng.randrange(len(ORIGINS)) for _ in range(num)]
+        prefs = [rng.randint(100, 150) for _ in range(num)]
+        nexthops = [rng.randrange(len(self.nexthops)) for _ in range(num)]
+        return counts, paths, meds, origins, prefs, nexthops
+
+    def _asn(self):
+        if self.asn_dist == 'zipf':
+            return (int(self.rng.paretovariate(1.2)) - 1) % MAX_ASN + 1
+        return self.rng.randint(1, MAX_ASN)
+
+    def _attributes_numpy(self, num):
+        np = self.np
+        rng = self.rng
+        counts = rng.integers(1, self.max_prefix + 1, num)
+        weights = np.array(self.hop_weights)
+        hops = rng.choice(np.array(self.hops), num, p=weights / weights.sum())
+        total = int(hops.sum())
+        if self.asn_dist == 'zipf':
+            asns = (rng.zipf(1.2, total) - 1) % MAX_ASN + 1
+        else:
+            asns = rng.integers(1, MAX_ASN + 1, total)
+        local = [self.local_as]
+        paths = [local + path for path in
+                 (chunk.tolist() for chunk in np.split(asns, np.cumsum(hops)[:-1]))]
+        meds = rng.integers(0, 101, num).tolist()
+        origins = rng.integers(0, len(ORIGINS), num).tolist()
+        prefs = rng.integers(100, 151, num).tolist()
+        nexthops = rng.integers(0, len(self.nexthops), num).tolist()
+        return counts.tolist(), paths, meds, origins, prefs, nexthops
@@ -0,0 +1,91 @@
+"""Record the updates of a run to a replay file, off the send path.
+
+The sender only appends (time, update) to a list; full lists are handed
+to a thread that encodes the updates and writes them through a large
+buffer, in the format of compiled replay files (see replayfile). Such a
+recording is replayed with its original timing by --replay_recording.
+"""
+import queue
+import threading
+import time
+
+from .replayfile import ReplayFileWriter, encode_record
+
+
+class Recorder(object):
+    """Encode and write the updates handed to the agent from a background thread.
+
+    At most depth updates wait for the writer. When they do, record() waits
+    with the 'block' policy, and with 'drop' the updates are not recorded
+    (and counted as dropped), so a slow disk never slows the run down.
+    """
+
+    def __init__(self, filename, defaults=None, depth=100000, policy='block', batch=256):
+        self.filename = filename
+        self.defaults = defaults
+        self.batch_size = batch
+        self.block = policy == 'block'
+        self.queue = queue.Queue(max(1, depth // batch))
+        self.batch = []
+        self.dropped = 0
+        self.blocked = 0.0
+        self.writer = ReplayFileWriter(filename)
+        self.thread = threading.Thread(target=self._run, name='bgpreplay-recorder', daemon=True)
+        self.thread.start()
+
+    def record(self, update):
+        batch = self.batch
+        batch.append((time.time(), update))
+        if len(batch) >= self.batch_size:
+            self._put()
+
+    def record_raw(self, payload):
+        """Record pre-encoded UPDATE messages, e.g. of a compiled replay file."""
+        batch = self.batch
+        batch.append((time.time(), bytes(payload)))
+        if len(batch) >= self.batch_size:
+            self._put()
+
+    def _put(self):
+        batch, self.batch = self.batch, []
+        if self.block:
+            if self.queue.full():
+                start = time.monotonic()
+                self.queue.put(batch)
+                self.blocked += time.monotonic() - start
+            else:
+                self.queue.put(batch)
+            return
+        try:
+            self.queue.put_nowait(batch)
+        except queue.Full:
+            self.dropped += len(batch)
+
+    def _run(self):
+        buf = bytearray()
+        write = self.writer.write
+        defaults = self.defaults
+        while True:
+            batch = self.queue.get()
+            if batch is None:
+                return
+            for timestamp, item in batch:
+                if isinstance(item, bytes):
+                    write(timestamp, item)
+                else:
+                    del buf[:]
+                    encode_record(buf, item, defaults)
+                    if buf:
+                        write(timestamp, buf)
+
+    def close(self):
+        if self.batch:
+            self.queue.put(self.batch)
+            self.batch = []
+        self.queue.put(None)
+        self.thread.join()
+        self.writer.close()
+
+    def report(self):
+        return 'recorded %d updates to %s, dropped %d, sender blocked %.2fs' % (
+            self.writer.count, self.filename, self.dropped, self.blocked)
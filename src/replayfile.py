@@ -0,0 +1,153 @@
+"""Compiled replay files of pre-encoded BGP UPDATE messages.
+
+An MRT file is decoded and encoded once by compile_mrt(), or the updates
+of a run are written as they are sent by a Recorder; the result is
+replayed by mmap-ing the file and handing out memoryview slices of the
+ready-to-send messages, so a replay does no parsing or encoding at all.
+
+Layout (network byte order):
+
+    header  8s magic, Q record count, Q index offset
+    record  d timestamp, I length, <length> bytes of BGP UPDATE messages
+    index   (d timestamp, Q record offset) for every INDEX_INTERVAL-th record
+"""
+import bisect
+import mmap
+import random
+import struct
+
+from . import bgpmsg
+from .mrtparser import MRTParser
+from .update import key_nlri, split_prefixes
+
+MAGIC = b'BGPRPLY1'
+HEADER = struct.Struct('!8sQQ')
+RECORD = struct.Struct('!dI')
+INDEX_ENTRY = struct.Struct('!dQ')
+INDEX_INTERVAL = 1024
+WRITE_BUFFER = 1 << 20
+
+
+class ReplayFileWriter(object):
+    """Append (timestamp, messages) records to a replay file."""
+
+    def __init__(self, filename):
+        self.f = open(filename, 'wb', buffering=WRITE_BUFFER)
+        self.f.write(HEADER.pack(MAGIC, 0, 0))
+        self.offset = HEADER.size
+        self.count = 0
+        self.index = []
+
+    def write(self, timestamp, payload):
+        if self.count % INDEX_INTERVAL == 0:
+            self.index.append((timestamp, self.offset))
+        self.f.write(RECORD.pack(timestamp, len(payload)))
+        self.f.write(payload)
+        self.offset += RECORD.size + len(payload)
+        self.count += 1
+
+    def close(self):
+        for entry in self.index:
+            self.f.write(INDEX_ENTRY.pack(*entry))
+        self.f.seek(0)
+        self.f.write(HEADER.pack(MAGIC, self.count, self.offset))
+        self.f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class ReplayFile(object):
+    """Iterate over (timestamp, memoryview of messages) records of a mmap-ed replay file."""
+
+    def __init__(self, filename):
+        self.f = open(filename, 'rb')
+        self.mm = mmap.mmap(self.f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.view = memoryview(self.mm)
+        magic, self.count, self.index_offset = HEADER.unpack_from(self.mm)
+        if magic != MAGIC:
+            self.close()
+            raise ValueError('%s is not a compiled replay file' % filename)
+        n_index = (len(self.mm) - self.index_offset) // INDEX_ENTRY.size
+        index = [INDEX_ENTRY.unpack_from(self.mm, self.index_offset + i * INDEX_ENTRY.size)
+                 for i in range(n_index)]
+        self.index_times = [ts for ts, _ in index]
+        self.index_offsets = [offset for _, offset in index]
+        self.offset = HEADER.size
+
+    def seek_time(self, timestamp):
+        """Position the reader at or shortly before the first record at timestamp."""
+        i = bisect.bisect_left(self.index_times, timestamp)
+        self.offset = self.index_offsets[i - 1] if i > 0 else HEADER.size
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        offset = self.offset
+        if offset >= self.index_offset:
+            raise StopIteration
+        timestamp, length = RECORD.unpack_from(self.mm, offset)
+        start = offset + RECORD.size
+        self.offset = start + length
+        return timestamp, self.view[start:self.offset]
+
+    next = __next__
+
+    def close(self):
+        if getattr(self, 'view', None) is not None:
+            self.view.release()
+            self.view = None
+        self.mm.close()
+        self.f.close()
+
+
+def encode_record(out, update, defaults=None):
+    """Append the UPDATE messages of an Update or update dict to out, as the native agent would send them.
+
+    Attributes missing from announcements are taken from defaults, IPv6
+    prefixes go into MP_REACH/MP_UNREACH messages. AS numbers are 4 octets.
+    """
+    nlri, nlri6, withdraw, withdraw6 = split_prefixes(update)
+    attrs = b''
+    if nlri or nlri6:
+        attr = update['attr']
+        if defaults:
+            attr = dict(attr)
+            for name, value in defaults.items():
+                if attr.get(name) is None:
+                    attr[name] = value
+        attrs = bgpmsg.encode_attributes(attr)
+    if nlri or withdraw:
+        bgpmsg.encode_update(out, attrs, nlri, withdraw)
+    if nlri6 or withdraw6:
+        nexthop6 = bgpmsg.ipv6_nexthop(attr['nexthop']) if nlri6 else b''
+        bgpmsg.encode_mp_update(out, attrs, nexthop6, nlri6, withdraw6)
+    return out
+
+
+def compile_mrt(mrt_file, output, nexthops=None, defaults=None):
+    """Convert the updates of an MRT file into a replay file.
+
+    Messages are encoded with 4-octet AS numbers. If nexthops is given, each
+    update gets one of them as next hop, as a live MRT replay would do.
+    Returns the number of records written.
+    """
+    buf = bytearray()
+    with ReplayFileWriter(output) as writer:
+        for timestamp, attr, nlri, withdraw in MRTParser(mrt_file):
+            attr = dict(attr)  # the parser's attribute sets are shared and read-only
+            if nexthops:
+                attr['nexthop'] = str(random.choice(nexthops))
+            for name, value in (defaults or {}).items():
+                if attr.get(name) is None:
+                    attr[name] = value
+            attrs = bgpmsg.encode_attributes(attr) if nlri else b''
+            del buf[:]
+            bgpmsg.encode_update(buf, attrs, list(map(key_nlri, nlri)), list(map(key_nlri, withdraw)))
+            if buf:
+                writer.write(timestamp, buf)
+        return writer.count
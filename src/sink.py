@@ -0,0 +1,283 @@
+"""bgpreplay-sink: a BGP receiver that measures the updates it gets.
+
+It accepts sessions from any peer, completes the OPEN/KEEPALIVE exchange
+and then only walks the UPDATE headers to count messages and prefixes,
+without decoding them. When the sender adds the timestamp attribute
+(bgpreplay --timestamps) the delay from send to receive is measured too;
+sender and sink must then share a clock, i.e. run on the same host.
+
+    bgpreplay-sink --listen 127.0.0.1:9179 --local_as 65000
+    bgpreplay --agent native --peers 127.0.0.1:9179/65000 --timestamps
+"""
+import asyncio
+import logging
+import struct
+import sys
+import time
+
+from oslo_config import cfg
+
+from . import bgpmsg
+from .metrics import Histogram
+
+logger = logging.getLogger('bgpreplay')
+
+_UNPACK_H = struct.Struct('!H').unpack_from
+_UNPACK_D = struct.Struct('!d').unpack_from
+# delays in seconds, finer than the default metric buckets
+DELAY_BUCKETS = (0.00005, 0.0001, 0.0002, 0.0005, 0.001, 0.002, 0.005, 0.01, 0.02, 0.05,
+                 0.1, 0.2, 0.5, 1.0, 2.0, 5.0, 10.0)
+
+
+def _count_prefixes(buf, i, end):
+    count = 0
+    while i < end:
+        i += 1 + ((buf[i] + 7) >> 3)
+        count += 1
+    return count
+
+
+def scan_update(buf, start, end):
+    """Return (announced, withdrawn, timestamp) of the UPDATE body buf[start:end]."""
+    wlen = _UNPACK_H(buf, start)[0]
+    i = start + 2
+    withdrawn = _count_prefixes(buf, i, i + wlen)
+    i += wlen
+    attr_end = i + 2 + _UNPACK_H(buf, i)[0]
+    i += 2
+    announced = 0
+    timestamp = None
+    while i < attr_end:
+        flags, code = buf[i], buf[i + 1]
+        if flags & bgpmsg.FLAG_EXTENDED_LENGTH:
+            length = _UNPACK_H(buf, i + 2)[0]
+            i += 4
+        else:
+            length = buf[i + 2]
+            i += 3
+        if code == bgpmsg.MP_REACH_NLRI:
+            nlri = i + 5 + buf[i + 3]  # afi, safi, next hop length, next hop, reserved
+            announced += _count_prefixes(buf, nlri, i + length)
+        elif code == bgpmsg.MP_UNREACH_NLRI:
+            withdrawn += _count_prefixes(buf, i + 3, i + length)
+        elif code == bgpmsg.TIMESTAMP and length == 8:
+            timestamp = _UNPACK_D(buf, i)[0]
+        i += length
+    announced += _count_prefixes(buf, attr_end, end)
+    return announced, withdrawn, timestamp
+
+
+class SinkStats(object):
+    """Counters of all sessions, for the whole run and for the current interval."""
+
+    def __init__(self):
+        self.start = time.monotonic()
+        self.updates = self.announced = self.withdrawn = self.bytes = 0
+        self.delay = Histogram(DELAY_BUCKETS)
+        self.max_delay = 0.0
+        self.jitter = 0.0  # RFC 3550 interarrival jitter of the delay
+        self.gap_jitter = 0.0  # the same, of the gaps between reads, when there are no timestamps
+        self._last_delay = None
+        self._last_read = None
+        self._last_gap = None
+        self.mark()
+
+    def mark(self):
+        self.mark_time = time.monotonic()
+        self.mark_counts = (self.updates, self.announced, self.withdrawn, self.bytes)
+        self.mark_delay = Histogram(DELAY_BUCKETS)
+
+    def read(self, now, size):
+        self.bytes += size
+        if self._last_read is not None:
+            gap = now - self._last_read
+            if self._last_gap is not None:
+                self.gap_jitter += (abs(gap - self._last_gap) - self.gap_jitter) / 16
+            self._last_gap = gap
+        self._last_read = now
+
+    def update(self, announced, withdrawn, delay):
+        self.updates += 1
+        self.announced += announced
+        self.withdrawn += withdrawn
+        if delay is not None:
+            self.delay.observe(delay)
+            self.mark_delay.observe(delay)
+            if delay > self.max_delay:
+                self.max_delay = delay
+            if self._last_delay is not None:
+                self.jitter += (abs(delay - self._last_delay) - self.jitter) / 16
+            self._last_delay = delay
+
+    def _delays(self, delay):
+        if not delay.count:
+            return 'no timestamps, read jitter %.3fms' % (self.gap_jitter * 1000)
+        return 'delay avg %.3fms p50 %.3fms p99 %.3fms, jitter %.3fms' % (
+            delay.sum / delay.count * 1000, delay.quantile(0.5) * 1000, delay.quantile(0.99) * 1000,
+            self.jitter * 1000)
+
+    def interval_report(self, sessions):
+        now = time.monotonic()
+        elapsed = now - self.mark_time or 1e-9
+        updates, announced, withdrawn, size = (
+            new - old for new, old in zip((self.updates, self.announced, self.withdrawn, self.bytes),
+                                          self.mark_counts))
+        line = '%6.1fs %d sessions: %.1f updates/s, %.1f prefixes/s (%.1f withdrawn), %.2f MB/s; %s' % (
+            now - self.start, sessions, updates / elapsed, (announced + withdrawn) / elapsed,
+            withdrawn / elapsed, size / elapsed / 1e6, self._delays(self.mark_delay))
+        self.mark()
+        return line
+
+    def report(self):
+        elapsed = time.monotonic() - self.start
+        return ('received %d updates, %d prefixes announced, %d withdrawn, %d bytes in %.2fs; %s, max %.3fms' % (
+            self.updates, self.announced, self.withdrawn, self.bytes, elapsed, self._delays(self.delay),
+            self.max_delay * 1000))
+
+
+class SinkSession(asyncio.Protocol):
+    """The passive side of one BGP session; routes are counted, never stored."""
+
+    def __init__(self, sink):
+        self.sink = sink
+        self.stats = sink.stats
+        self.transport = None
+        self.peer = None
+        self.opened = False  # OPEN received
+        self.established = False
+        self._rbuf = bytearray()
+        self._keepalive = None
+
+    def connection_made(self, transport):
+        self.transport = transport
+        self.peer = '%s:%s' % transport.get_extra_info('peername')[:2]
+        self.hold_time = self.sink.hold_time
+        transport.write(bgpmsg.encode_open(self.sink.local_as, self.sink.hold_time, self.sink.router_id))
+
+    def connection_lost(self, exc):
+        if self._keepalive:
+            self._keepalive.cancel()
+        self.sink.sessions.discard(self)
+        print('session %s closed' % self.peer)
+
+    def _send_keepalive(self):
+        if self.transport and not self.transport.is_closing():
+            self.transport.write(bgpmsg.KEEPALIVE_MESSAGE)
+            self._keepalive = asyncio.get_event_loop().call_later(self.hold_time / 3.0,
+                                                                  self._send_keepalive)
+
+    def data_received(self, data):
+        now = time.time()
+        stats = self.stats
+        stats.read(time.monotonic(), len(data))
+        buf = self._rbuf
+        buf += data
+        i = 0
+        end = len(buf)
+        while end - i >= bgpmsg.HEADER_LEN:
+            length = _UNPACK_H(buf, i + 16)[0]
+            if length < bgpmsg.HEADER_LEN or length > 65535:
+                self._error('bad message length %d' % length)
+                return
+            if end - i < length:
+                break
+            msg_type = buf[i + 18]
+            if msg_type == bgpmsg.UPDATE:
+                if not self.established:
+                    self._error('UPDATE before session is established', bgpmsg.ERR_FSM, 0)
+                    return
+                announced, withdrawn, timestamp = scan_update(buf, i + bgpmsg.HEADER_LEN, i + length)
+                stats.update(announced, withdrawn, None if timestamp is None else now - timestamp)
+            else:
+                self._handle_message(msg_type, bytes(buf[i + bgpmsg.HEADER_LEN:i + length]))
+                if self.transport.is_closing():
+                    return
+            i += length
+        del buf[:i]
+
+    def _handle_message(self, msg_type, body):
+        if msg_type == bgpmsg.OPEN:
+            _, asn, hold_time, router_id, caps = bgpmsg.decode_open(body)
+            self.hold_time = min(self.sink.hold_time, hold_time) or self.sink.hold_time
+            self.opened = True
+            self.transport.write(bgpmsg.KEEPALIVE_MESSAGE)
+            print('session %s: OPEN from AS%s, router id %s' % (self.peer, asn, router_id))
+        elif msg_type == bgpmsg.KEEPALIVE:
+            if not self.opened:
+                self._error('KEEPALIVE before OPEN', bgpmsg.ERR_FSM, 0)
+            elif not self.established:
+                self.established = True
+                self.sink.sessions.add(self)
+                self._send_keepalive()
+        elif msg_type == bgpmsg.NOTIFICATION:
+            if len(body) >= 2:
+                print('session %s: NOTIFICATION %d/%d' % (self.peer, body[0], body[1]))
+            else:
+                print('session %s: NOTIFICATION without error code' % self.peer)
+            self.transport.close()
+
+    def _error(self, reason, code=bgpmsg.ERR_MSG_HEADER, subcode=2):
+        print('session %s: %s' % (self.peer, reason))
+        self.transport.write(bgpmsg.encode_notification(code, subcode))
+        self.transport.close()
+
+
+class Sink(object):
+    """Listen for BGP sessions and print the receive rates every interval seconds."""
+
+    def __init__(self, host, port, local_as, hold_time=90, interval=1.0):
+        self.host = host
+        self.port = port
+        self.local_as = int(local_as)
+        self.hold_time = hold_time
+        self.router_id = '192.0.2.1'
+        self.interval = interval
+        self.sessions = set()
+        self.stats = SinkStats()
+
+    async def run(self, duration=0):
+        loop = asyncio.get_event_loop()
+        server = await loop.create_server(lambda: SinkSession(self), self.host, self.port)
+        print('listening on %s:%d as AS%d' % (self.host, self.port, self.local_as))
+        deadline = loop.time() + duration if duration else None
+        try:
+            while deadline is None or loop.time() < deadline:
+                await asyncio.sleep(self.interval)
+                if self.stats.updates != self.stats.mark_counts[0] or self.sessions:
+                    print(self.stats.interval_report(len(self.sessions)))
+                else:
+                    self.stats.mark()
+        finally:
+            server.close()
+
+
+DEFAULTS = {
+    'listen': '127.0.0.1:9179',
+    'local_as': 65000,
+    'hold_time': 90,
+    'interval': 1.0,
+    'duration': 0,
+}
+
+
+def main():
+    conf = cfg.ConfigOpts()
+    conf.register_cli_opts([
+        cfg.StrOpt('listen', help='Address:port to accept BGP sessions on, default=127.0.0.1:9179'),
+        cfg.IntOpt('local_as', help='AS number of the sink, default=65000'),
+        cfg.IntOpt('hold_time', help='Hold time offered to the peers, default=90'),
+        cfg.FloatOpt('interval', help='Seconds between rate reports, default=1'),
+        cfg.FloatOpt('duration', help='Stop after this many seconds, default=run until Ctrl-C'),
+    ])
+    conf(args=sys.argv[1:], prog='bgpreplay-sink')
+    config = dict((name, getattr(conf, name) or default) for name, default in DEFAULTS.items())
+    host, _, port = config['listen'].rpartition(':')
+    sink = Sink(host or '0.0.0.0', int(port), config['local_as'], config['hold_time'], config['interval'])
+    try:
+        asyncio.run(sink.run(config['duration']))
+    except KeyboardInterrupt:
+        pass
+    print(sink.stats.report())
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,321 @@
+"""A minimal BGP speaker running on asyncio.
+
+It only establishes sessions and writes UPDATEs; routes received from the
+peers are ignored. Sessions run on an event loop in a background thread so
+the generator can keep calling send_update() from the main thread.
+"""
+import asyncio
+import logging
+import threading
+import time
+
+from . import bgpmsg, metrics
+
+logger = logging.getLogger('bgpreplay')
+
+IDLE, CONNECT, OPENSENT, OPENCONFIRM, ESTABLISHED = range(5)
+STATE_NAMES = ('Idle', 'Connect', 'OpenSent', 'OpenConfirm', 'Established')
+
+
+class BGPSession(asyncio.Protocol):
+    """One BGP session to a peer.
+
+    Encoded UPDATEs are appended to a pending buffer from the sender thread
+    and flushed to the transport in batches by the event loop. The sender
+    blocks once max_pending bytes are waiting, so a slow peer pushes back
+    on the generator instead of growing memory without bound.
+    """
+
+    def __init__(self, speaker, peer_ip, peer_port, peer_as):
+        self.speaker = speaker
+        self.loop = speaker.loop
+        self.peer_ip = peer_ip
+        self.peer_port = peer_port
+        self.peer_as = peer_as
+        self.key = '%s:%s' % (peer_ip, peer_port)
+        self.state = IDLE
+        self.four_octet = False
+        self.hold_time = speaker.hold_time
+        self.transport = None
+        self.established = threading.Event()
+        self._rbuf = bytearray()
+        self._pending = bytearray()
+        self._pending_lock = threading.Condition()
+        self._flush_scheduled = False
+        self._paused = False
+        self._hold_timer = None
+        self._keepalive_timer = None
+        self.sent_updates = 0
+        self.sent_bytes = 0
+        self.blocked = 0.0  # time the sender waited on a full pending buffer
+
+    def __str__(self):
+        return '%s:%s/%s' % (self.peer_ip, self.peer_port, self.peer_as)
+
+    # asyncio.Protocol callbacks, run in the event loop thread
+
+    def connection_made(self, transport):
+        self.transport = transport
+        self.state = OPENSENT
+        # the protocol object is reused when the session reconnects
+        del self._rbuf[:]
+        self.four_octet = False
+        self.hold_time = self.speaker.hold_time
+        transport.write(bgpmsg.encode_open(
+            self.speaker.local_as, self.speaker.hold_time, self.speaker.router_id))
+        self._restart_hold_timer(240)  # large hold timer until OPEN is received (RFC 4271 8.2.2)
+
+    def connection_lost(self, exc):
+        logger.info('session %s closed: %s', self, exc)
+        self._set_state(IDLE)
+        self.transport = None
+        self._cancel_timers()
+        with self._pending_lock:
+            del self._pending[:]
+            self._pending_lock.notify_all()
+        self.speaker.session_closed(self)
+
+    def pause_writing(self):
+        self._paused = True
+
+    def resume_writing(self):
+        self._paused = False
+        self._flush()
+
+    def data_received(self, data):
+        self._rbuf += data
+        try:
+            messages, consumed = bgpmsg.split_messages(self._rbuf)
+        except ValueError as e:
+            self._close(bgpmsg.ERR_MSG_HEADER, 2, str(e))
+            return
+        del self._rbuf[:consumed]
+        for msg_type, body in messages:
+            self._handle_message(msg_type, body)
+            if self.transport is None or self.transport.is_closing():
+                return
+
+    def _handle_message(self, msg_type, body):
+        self._restart_hold_timer(self.hold_time)
+        if msg_type == bgpmsg.OPEN:
+            if self.state != OPENSENT:
+                self._close(bgpmsg.ERR_FSM, 0, 'unexpected OPEN')
+                return
+            version, asn, hold_time, router_id, caps = bgpmsg.decode_open(body)
+            if version != bgpmsg.BGP_VERSION:
+                self._close(bgpmsg.ERR_OPEN_MESSAGE, 1, 'unsupported version %s' % version)
+                return
+            if self.peer_as and int(self.peer_as) != asn:
+                self._close(bgpmsg.ERR_OPEN_MESSAGE, 2, 'bad peer AS %s' % asn)
+                return
+            if hold_time and hold_time < 3:
+                self._close(bgpmsg.ERR_OPEN_MESSAGE, 6, 'unacceptable hold time %s' % hold_time)
+                return
+            self.four_octet = bgpmsg.CAP_FOUR_OCTET_AS in caps
+            self.hold_time = min(self.speaker.hold_time, hold_time)
+            self.transport.write(bgpmsg.KEEPALIVE_MESSAGE)
+            self._set_state(OPENCONFIRM)
+            self._restart_hold_timer(self.hold_time)
+            self._schedule_keepalive()
+        elif msg_type == bgpmsg.KEEPALIVE:
+            if self.state == OPENCONFIRM:
+                self._set_state(ESTABLISHED)
+        elif msg_type == bgpmsg.NOTIFICATION:
+            if len(body) >= 2:
+                logger.info('session %s received NOTIFICATION %d/%d', self, body[0], body[1])
+            else:
+                logger.info('session %s received a NOTIFICATION without error code', self)
+            self.transport.close()
+        elif msg_type == bgpmsg.UPDATE:
+            if self.state != ESTABLISHED:
+                self._close(bgpmsg.ERR_FSM, 0, 'UPDATE before session is established')
+        else:
+            self._close(bgpmsg.ERR_MSG_HEADER, 3, 'bad message type %d' % msg_type)
+
+    def _set_state(self, state):
+        if state != self.state:
+            logger.info('session %s %s -> %s', self, STATE_NAMES[self.state], STATE_NAMES[state])
+        self.state = state
+        if state == ESTABLISHED:
+            self.established.set()
+        else:
+            self.established.clear()
+
+    def _close(self, code, subcode, reason):
+        logger.info('session %s error: %s', self, reason)
+        if self.transport:
+            self.transport.write(bgpmsg.encode_notification(code, subcode))
+            self.transport.close()
+
+    def _cancel_timers(self):
+        for timer in (self._hold_timer, self._keepalive_timer):
+            if timer:
+                timer.cancel()
+        self._hold_timer = self._keepalive_timer = None
+
+    def _restart_hold_timer(self, hold_time):
+        if self._hold_timer:
+            self._hold_timer.cancel()
+            self._hold_timer = None
+        if hold_time:
+            self._hold_timer = self.loop.call_later(hold_time, self._hold_timer_expired)
+
+    def _hold_timer_expired(self):
+        self._hold_timer = None
+        self._close(bgpmsg.ERR_HOLD_TIMER_EXPIRED, 0, 'hold timer expired')
+
+    def _schedule_keepalive(self):
+        if self.hold_time:
+            self._keepalive_timer = self.loop.call_later(self.hold_time / 3.0, self._send_keepalive)
+
+    def _send_keepalive(self):
+        if self.transport:
+            with self._pending_lock:
+                self._pending += bgpmsg.KEEPALIVE_MESSAGE
+            self._flush()
+            self._schedule_keepalive()
+
+    def _flush(self):
+        with self._pending_lock:
+            self._flush_scheduled = False
+            if self._paused or not self._pending or self.transport is None:
+                return
+            data, self._pending = self._pending, bytearray()
+            self._pending_lock.notify_all()
+        self.sent_bytes += len(data)
+        self.transport.write(data)
+
+    # called from the sender thread
+
+    def write_updates(self, encode, *args):
+        """Run encode(buf, *args) to append messages straight into the pending buffer.
+
+        Returns False if the session is not established.
+        """
+        with self._pending_lock:
+            if len(self._pending) >= self.speaker.max_pending:
+                began = time.monotonic()
+                while len(self._pending) >= self.speaker.max_pending and self.transport is not None:
+                    self._pending_lock.wait(1)
+                self.blocked += time.monotonic() - began
+            if self.state != ESTABLISHED:
+                return False
+            encode(self._pending, *args)
+            self.sent_updates += 1
+            if not self._flush_scheduled:
+                self._flush_scheduled = True
+                self.loop.call_soon_threadsafe(self._flush)
+        return True
+
+    def close(self):
+        if self.transport:
+            self._close(bgpmsg.ERR_CEASE, 2, 'administrative shutdown')
+
+
+class BGPSpeaker(object):
+    """Run BGP sessions to a list of peers on an event loop in a background thread."""
+
+    def __init__(self, local_ip, local_as, hold_time=90, connect_retry=5, max_pending=4 * 1024 * 1024):
+        self.local_ip = local_ip
+        self.local_as = int(local_as)
+        self.router_id = local_ip
+        self.hold_time = hold_time
+        self.connect_retry = connect_retry
+        self.max_pending = max_pending
+        self.sessions = []
+        self.loop = None
+        self.thread = None
+        self._stopping = False
+
+    def start(self, peers):
+        self.loop = asyncio.new_event_loop()
+        for peer_ip, peer_port, peer_as in peers:
+            self.sessions.append(BGPSession(self, peer_ip, int(peer_port), peer_as))
+        if metrics.registry.enabled:
+            for session in self.sessions:
+                self._register_metrics(session)
+        self.thread = threading.Thread(target=self._run, name='bgp-speaker', daemon=True)
+        self.thread.start()
+
+    @staticmethod
+    def _register_metrics(session):
+        registry = metrics.registry
+        peer = session.key
+        registry.gauge('bgpreplay_session_updates', 'UPDATE writes queued to the session',
+                       lambda: session.sent_updates, peer=peer)
+        registry.gauge('bgpreplay_session_bytes', 'Bytes written to the session',
+                       lambda: session.sent_bytes, peer=peer)
+        registry.gauge('bgpreplay_session_pending_bytes', 'Bytes waiting to be written',
+                       lambda: len(session._pending), peer=peer)
+        registry.gauge('bgpreplay_session_blocked_seconds', 'Time the sender waited on a full buffer',
+                       lambda: session.blocked, peer=peer)
+        registry.gauge('bgpreplay_session_established', '1 if the session is established',
+                       lambda: int(session.state == ESTABLISHED), peer=peer)
+
+    def _run(self):
+        asyncio.set_event_loop(self.loop)
+        for session in self.sessions:
+            self.loop.create_task(self._connect(session))
+        self.loop.run_forever()
+
+    async def _connect(self, session):
+        retry = 0.1
+        while not self._stopping and session.transport is None:
+            session.state = CONNECT
+            try:
+                await self.loop.create_connection(
+                    lambda: session, session.peer_ip, session.peer_port,
+                    local_addr=(self.local_ip, 0))
+                return
+            except OSError as e:
+                logger.info('connect to %s failed: %s', session, e)
+                session.state = IDLE
+            await asyncio.sleep(retry)
+            retry = min(retry * 2, self.connect_retry)
+
+    def session_closed(self, session):
+        if not self._stopping:
+            self.loop.call_later(self.connect_retry, lambda: self.loop.create_task(self._connect(session)))
+
+    def wait_established(self, timeout=60):
+        """Wait until at least one session is established."""
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if self.established_sessions():
+                return True
+            time.sleep(0.1)
+        return False
+
+    def wait_flushed(self, timeout=60):
+        """Wait until the pending updates of all sessions are written to the sockets."""
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if all(not s._pending and (s.transport is None or not s.transport.get_write_buffer_size())
+                   for s in self.sessions):
+                return True
+            time.sleep(0.01)
+        return False
+
+    def established_sessions(self):
+        return [s for s in self.sessions if s.state == ESTABLISHED]
+
+    def stop(self):
+        if self.loop is None or self._stopping:
+            return
+        self._stopping = True
+        future = asyncio.run_coroutine_threadsafe(self._shutdown(), self.loop)
+        try:
+            future.result(5)
+        except Exception:
+            pass
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join(5)
+
+    async def _shutdown(self):
+        for session in self.sessions:
+            session._flush()
+            session.close()
+        for _ in range(40):
+            if all(s.transport is None for s in self.sessions):
+                break
+            await asyncio.sleep(0.1)
@@ -0,0 +1,180 @@
+"""Read updates from text scenario files.
+
+One update per line, the delay is in ms after the previous line:
+
+    delay,update,prefix,nexthop,local_pref,as_path[,community,med,origin]
+    0,announce,1.0.0.0/24,10.0.0.1,None,1 2 3
+    10,withdraw,2.0.0.0/24
+    5,announce,2001:db8::/32,2001:db8::1,100,1 2,1:1 1:2,10,igp
+
+Empty fields and None mean the attribute is not set. The file is read in
+large chunks, and the attribute columns are parsed once per distinct
+text: lines sharing nexthop, local_pref, AS path and the other columns
+share one read-only AttrSet.
+"""
+import socket
+
+from .attrset import EMPTY, AttrSet, Memo
+
+CHUNK_SIZE = 1 << 20
+MAX_CACHED = 100000
+ORIGINS = {'igp': 0, 'egp': 1, 'incomplete': 2, '0': 0, '1': 1, '2': 2}
+
+
+def check_prefix(prefix):
+    """Return prefix in canonical form or raise ValueError; a bare address is a host route."""
+    addr, _, length = prefix.strip().partition('/')
+    if ':' in addr:
+        try:
+            packed = socket.inet_pton(socket.AF_INET6, addr)
+        except OSError:
+            raise ValueError('invalid address %r' % addr)
+        bits = 128
+    else:
+        try:
+            packed = socket.inet_pton(socket.AF_INET, addr)
+        except OSError:
+            raise ValueError('invalid address %r' % addr)
+        bits = 32
+    length = int(length) if length else bits
+    if not 0 <= length <= bits:
+        raise ValueError('invalid prefix length in %r' % prefix)
+    if int.from_bytes(packed, 'big') & ((1 << (bits - length)) - 1):
+        raise ValueError('%r has host bits set' % prefix)
+    if bits == 128:
+        addr = socket.inet_ntop(socket.AF_INET6, packed)
+    return '%s/%d' % (addr, length)
+
+
+def _check_nexthop(nexthop):
+    family = socket.AF_INET6 if ':' in nexthop else socket.AF_INET
+    try:
+        return socket.inet_ntop(family, socket.inet_pton(family, nexthop))
+    except OSError:
+        raise ValueError('invalid nexthop %r' % nexthop)
+
+
+def _optional(value):
+    value = value.strip()
+    return None if value in ('', 'None') else value
+
+
+def parse_attributes(columns):
+    """Parse the attribute columns (after the prefix) of an announcement."""
+    fields = columns.split(',')
+    if len(fields) < 3:
+        raise ValueError('expected at least nexthop,local_pref,as_path')
+    nexthop = _optional(fields[0])
+    local_pref = _optional(fields[1])
+    as_path = _optional(fields[2])
+    attr = {
+        'nexthop': _check_nexthop(nexthop) if nexthop else None,
+        'as_path': [int(asn) for asn in as_path.split()] if as_path else [],
+        'local_pref': int(local_pref) if local_pref else None,
+    }
+    community = _optional(fields[3]) if len(fields) > 3 else None
+    if community:
+        attr['community'] = community.split()
+        for value in attr['community']:
+            high, _, low = value.partition(':')
+            if not (0 <= int(high) <= 0xffff and 0 <= int(low) <= 0xffff):
+                raise ValueError('invalid community %r' % value)
+    med = _optional(fields[4]) if len(fields) > 4 else None
+    if med:
+        attr['med'] = int(med)
+    origin = _optional(fields[5]) if len(fields) > 5 else None
+    if origin:
+        if origin not in ORIGINS:
+            raise ValueError('invalid origin %r' % origin)
+        attr['origin'] = ORIGINS[origin]
+    return attr
+
+
+class TextSource(object):
+    """Iterate over (timestamp, attr, nlri, withdraw) of a text scenario file.
+
+    The timestamp is the sum of the delays, in seconds. Lines that do not
+    parse are skipped and counted; the first few are kept in errors for the
+    report instead of being printed one by one.
+    """
+
+    def __init__(self, filename, chunk_size=CHUNK_SIZE):
+        self.filename = filename
+        self.chunk_size = chunk_size
+        self.lines = 0
+        self.skipped = 0
+        self.errors = []
+        self._updates = self._read()
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return next(self._updates)
+
+    next = __next__
+
+    def _chunks(self):
+        with open(self.filename, 'r') as f:
+            rest = ''
+            while True:
+                data = f.read(self.chunk_size)
+                if not data:
+                    break
+                lines = (rest + data).split('\n')
+                rest = lines.pop()
+                yield lines
+            if rest:
+                yield [rest]
+
+    def _read(self):
+        cache = Memo(MAX_CACHED)
+        elapsed = 0.0
+        for lines in self._chunks():
+            for line in lines:
+                self.lines += 1
+                try:
+                    fields = line.split(',', 3)
+                    delay = float(fields[0]) / 1000
+                    kind = fields[1].strip()
+                    prefix = check_prefix(fields[2])
+                    if kind == 'announce':
+                        columns = fields[3]
+                        attr = cache.get(columns)
+                        if attr is None:
+                            attr = cache.put(columns, AttrSet(parse_attributes(columns)))
+                        nlri, withdraw = [prefix], []
+                    elif kind == 'withdraw':
+                        attr, nlri, withdraw = EMPTY, [], [prefix]
+                    else:
+                        raise ValueError('unknown update type %r' % kind)
+                except (ValueError, IndexError) as e:
+                    if not line.strip() or line.startswith('#'):
+                        continue
+                    self.skipped += 1
+                    if len(self.errors) < 10:
+                        self.errors.append('line %d: %s' % (self.lines, e))
+                else:  # the delay of a skipped line is not added
+                    elapsed += delay
+                    yield elapsed, attr, nlri, withdraw
+
+    def report(self):
+        if not self.skipped:
+            return '%s: %d lines' % (self.filename, self.lines)
+        return '%s: %d lines, %d skipped:\n  %s' % (self.filename, self.lines, self.skipped,
+                                                    '\n  '.join(self.errors))
+
+
+def compile_text(text_file, output, defaults=None):
+    """Convert the updates of a text scenario file into a replay file; returns the number of records."""
+    from .replayfile import ReplayFileWriter, encode_record
+    buf = bytearray()
+    source = TextSource(text_file)
+    with ReplayFileWriter(output) as writer:
+        for timestamp, attr, nlri, withdraw in source:
+            del buf[:]
+            encode_record(buf, {'attr': attr, 'nlri': nlri, 'withdraw': withdraw}, defaults)
+            if buf:
+                writer.write(timestamp, buf)
+    print(source.report())
+    return writer.count
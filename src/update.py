@@ -0,0 +1,136 @@
+"""The update record handed from the sources to the agents.
+
+An Update holds a reference to its (usually shared) attributes and its
+prefixes as given by the source: MRT and random updates pack IPv4
+prefixes into an array of integer keys (see prefixset.encode), 8 bytes a
+prefix; text and BGPStream updates keep their prefix strings. The nlri and
+withdraw strings are made on first use, so agents that encode from the
+keys (native, null, the recorder) never format a prefix.
+
+Updates also read like the update dicts the packer, the Adj-RIB-Out and
+the fanout pass on: update['nlri'], update.get('peers'), dict(update).
+The helpers below accept both.
+"""
+import struct
+from array import array
+
+from . import bgpmsg
+from .prefixset import decode, encode
+
+_PACK_I = struct.Struct('!I').pack
+FIELDS = ('attr', 'nlri', 'withdraw', 'peers')
+
+
+def key_nlri(key):
+    """Integer prefix key -> NLRI prefix: length byte followed by the significant octets."""
+    length = key & 0x3f
+    return bytes((length,)) + _PACK_I(key >> 6)[:(length + 7) >> 3]
+
+
+def pack_prefixes(prefixes):
+    """IPv4 prefix strings -> array of keys."""
+    return array('Q', [encode(prefix) for prefix in prefixes])
+
+
+class Update(object):
+    """One update: attributes, prefixes to announce and to withdraw, optional target peers."""
+    __slots__ = ('attr', 'peers', 'packed_nlri', 'packed_withdraw', '_nlri', '_withdraw')
+
+    def __init__(self, attr, nlri=(), withdraw=(), peers=None):
+        self.attr = attr
+        self.peers = peers
+        self.packed_nlri = nlri
+        self.packed_withdraw = withdraw
+        self._nlri = self._withdraw = None
+
+    @property
+    def nlri(self):
+        nlri = self._nlri
+        if nlri is None:
+            packed = self.packed_nlri
+            if type(packed) is array:
+                nlri = self._nlri = list(map(decode, packed))
+            else:
+                nlri = self._nlri = packed if type(packed) is list else list(packed)
+        return nlri
+
+    @nlri.setter
+    def nlri(self, prefixes):
+        self.packed_nlri = prefixes
+        self._nlri = None
+
+    @property
+    def withdraw(self):
+        withdraw = self._withdraw
+        if withdraw is None:
+            packed = self.packed_withdraw
+            if type(packed) is array:
+                withdraw = self._withdraw = list(map(decode, packed))
+            else:
+                withdraw = self._withdraw = packed if type(packed) is list else list(packed)
+        return withdraw
+
+    @withdraw.setter
+    def withdraw(self, prefixes):
+        self.packed_withdraw = prefixes
+        self._withdraw = None
+
+    def __getitem__(self, name):
+        if name not in FIELDS:
+            raise KeyError(name)
+        return getattr(self, name)
+
+    def __setitem__(self, name, value):
+        if name not in FIELDS:
+            raise KeyError(name)
+        setattr(self, name, value)
+
+    def get(self, name, default=None):
+        value = self[name] if name in FIELDS else None
+        return default if value is None else value
+
+    def __contains__(self, name):
+        return name in FIELDS and (name != 'peers' or self.peers is not None)
+
+    def keys(self):
+        return FIELDS if self.peers is not None else FIELDS[:3]
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __repr__(self):
+        return repr(dict(self))
+
+    def __reduce__(self):
+        return Update, (self.attr, self.packed_nlri, self.packed_withdraw, self.peers)
+
+
+def prefix_counts(update):
+    """(announced, withdrawn) of an Update or update dict, without formatting prefixes."""
+    if type(update) is Update:
+        return len(update.packed_nlri), len(update.packed_withdraw)
+    return len(update.get('nlri') or ()), len(update.get('withdraw') or ())
+
+
+def _split(prefixes):
+    if type(prefixes) is array:
+        return list(map(key_nlri, prefixes)), []
+    return bgpmsg.split_afi(prefixes)
+
+
+def split_prefixes(update):
+    """(nlri, nlri6, withdraw, withdraw6) of an Update or update dict, encoded as NLRI prefixes."""
+    if type(update) is Update:
+        return _split(update.packed_nlri) + _split(update.packed_withdraw)
+    return bgpmsg.split_afi(update.get('nlri') or ()) + bgpmsg.split_afi(update.get('withdraw') or ())
+
+
+def replace(update, **fields):
+    """A copy of an Update or update dict with fields changed; an Update keeps its packed prefixes."""
+    if type(update) is not Update:
+        return dict(update, **fields)
+    copy = Update(update.attr, update.packed_nlri, update.packed_withdraw, update.peers)
+    copy._nlri, copy._withdraw = update._nlri, update._withdraw
+    for name, value in fields.items():
+        setattr(copy, name, value)
+    return copy
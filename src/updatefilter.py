@@ -0,0 +1,175 @@
+"""Drop and rewrite updates between the source and the agent.
+
+An UpdateFilter keeps the prefixes covered by a set of prefixes (a radix
+trie), the updates of some peer ASes, the announcements of some origin
+ASes or whose AS path matches a regular expression, and rewrites the
+announcements it keeps: next hop mapping, AS path prepend and strip,
+communities added.
+
+MRTParser and BGPStreamReader run the filter inside their parse loop:
+peer AS and prefixes are checked first, and the attributes of an
+announcement are decoded only when some of its prefixes are kept. Other
+sources go through apply(). The decision and the rewrite for a read-only
+AttrSet are made once and remembered, like with_value() does.
+"""
+import re
+from array import array
+
+from .attrset import EMPTY, AttrSet, Memo
+from .radix import RadixTree, parse_prefix
+from .update import Update, replace
+
+
+def parse_asns(values):
+    """AS numbers separated by spaces or commas, in one or more values -> list of ints."""
+    if isinstance(values, str):
+        values = [values]
+    return [int(asn) for value in values or () for asn in value.replace(',', ' ').split()]
+
+
+def parse_nexthop_map(values):
+    """'old=new' values -> {old next hop: new next hop}."""
+    if isinstance(values, str):
+        values = [values]
+    mapping = {}
+    for value in values or ():
+        old, sep, new = value.partition('=')
+        if not sep or not old.strip() or not new.strip():
+            raise ValueError('expected old=new next hop, got %r' % value)
+        mapping[old.strip()] = new.strip()
+    return mapping
+
+
+class UpdateFilter(object):
+    """Keep the updates matching all the filters given and rewrite their attributes.
+
+    prefixes keeps the prefixes equal to or more specific than one of them;
+    the others are taken out of the update, which is dropped once it has
+    none left. peer_as keeps the updates received from these ASes; updates
+    of sources that do not know their peer (text, random) pass. origin_as and as_path
+    (a regular expression searched in the path as text, ex: '^3356 ')
+    drop announcements; withdrawals carry no attributes and are only
+    filtered by prefix and peer.
+
+    nexthops maps next hops of the source to the next hop to send,
+    prepend and strip are AS numbers added in front of or removed from the
+    AS path, communities are added to the announcements.
+    """
+
+    def __init__(self, prefixes=None, peer_as=None, origin_as=None, as_path=None,
+                 nexthops=None, prepend=None, strip=None, communities=None):
+        self.prefixes = None
+        if prefixes:
+            self.prefixes = RadixTree()
+            for prefix in prefixes:
+                self.prefixes.insert(prefix, True)
+        self.peer_as = frozenset(peer_as) if peer_as else None
+        self.origin_as = frozenset(origin_as) if origin_as else None
+        self.as_path = re.compile(as_path) if as_path else None
+        self.nexthops = dict(nexthops or {})
+        self.mapped = frozenset(self.nexthops.values())
+        self.prepend = list(prepend or ())
+        self.strip = frozenset(strip or ())
+        self.communities = list(communities or ())
+        self.checks_attr = self.origin_as is not None or self.as_path is not None
+        self.rewrites = bool(self.nexthops or self.prepend or self.strip or self.communities)
+        self._decided = Memo()  # id of an AttrSet -> (that AttrSet, the AttrSet to send or None)
+        self.updates = 0
+        self.dropped = 0
+        self.prefixes_dropped = 0  # taken out of the updates that are sent
+
+    def wants_peer(self, peer_as):
+        """False, and the update counted as dropped, if peer_as is filtered out.
+
+        Parsers ask before they decode the prefixes of an update.
+        """
+        if self.peer_as is None or peer_as is None or peer_as in self.peer_as:
+            return True
+        self.updates += 1
+        self.dropped += 1
+        return False
+
+    def filter(self, nlri, withdraw, attr, peer_as=None):
+        """Return (attr, nlri, withdraw) to send, or None to drop the update.
+
+        attr is the attributes of the announcement or a function returning
+        them, called only if some of nlri is kept.
+        """
+        if not self.wants_peer(peer_as):
+            return None
+        self.updates += 1
+        count = len(nlri) + len(withdraw)
+        if self.prefixes is not None:
+            nlri = self._covered(nlri)
+            withdraw = self._covered(withdraw)
+        if nlri:
+            if callable(attr):
+                attr = attr()
+            attr = self.attributes(attr)
+            if attr is None:
+                nlri = nlri[:0]
+        if not nlri and not withdraw:
+            self.dropped += 1
+            return None
+        if not nlri and (attr is None or callable(attr)):
+            attr = EMPTY
+        self.prefixes_dropped += count - len(nlri) - len(withdraw)
+        return attr, nlri, withdraw
+
+    def _covered(self, prefixes):
+        if not prefixes:
+            return prefixes
+        covers = self.prefixes.covers_value
+        if type(prefixes) is array:
+            kept = array('Q', [key for key in prefixes if covers(32, key >> 6, key & 0x3f)])
+        else:
+            kept = [prefix for prefix in prefixes if covers(*parse_prefix(prefix))]
+        return prefixes if len(kept) == len(prefixes) else kept
+
+    def attributes(self, attr):
+        """The attributes to send for attr, or None if its announcements are dropped."""
+        if not self.checks_attr and not self.rewrites:
+            return attr
+        if type(attr) is not AttrSet:
+            return self._decide(attr)
+        key = id(attr)
+        found = self._decided.get(key)
+        if found is None:
+            found = self._decided.put(key, (attr, self._decide(attr)))
+        return found[1]
+
+    def _decide(self, attr):
+        path = attr.get('as_path') or []
+        if self.origin_as is not None and (not path or path[-1] not in self.origin_as):
+            return None
+        if self.as_path is not None and not self.as_path.search(' '.join(map(str, path))):
+            return None
+        if not self.rewrites:
+            return attr
+        rewritten = dict(attr)
+        nexthop = self.nexthops.get(attr.get('nexthop'))
+        if nexthop:
+            rewritten['nexthop'] = nexthop
+        if self.strip or self.prepend:
+            rewritten['as_path'] = self.prepend + [asn for asn in path if asn not in self.strip]
+        if self.communities:
+            communities = list(attr.get('community') or ())
+            rewritten['community'] = communities + [c for c in self.communities if c not in communities]
+        return AttrSet(rewritten) if type(attr) is AttrSet else rewritten
+
+    def apply(self, update, peer_as=None):
+        """filter() an Update or update dict; returns the update to send or None."""
+        if type(update) is Update:
+            attr, nlri, withdraw = update.attr, update.packed_nlri, update.packed_withdraw
+        else:
+            attr, nlri, withdraw = update['attr'], update.get('nlri') or [], update.get('withdraw') or []
+        kept = self.filter(nlri, withdraw, attr, peer_as)
+        if kept is None:
+            return None
+        if kept[0] is attr and kept[1] is nlri and kept[2] is withdraw:
+            return update
+        return replace(update, attr=kept[0], nlri=kept[1], withdraw=kept[2])
+
+    def report(self):
+        return 'filter: %d of %d updates dropped, %d prefixes taken out of the others' % (
+            self.dropped, self.updates, self.prefixes_dropped)
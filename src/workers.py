@@ -0,0 +1,126 @@
+"""Spread the load over several worker processes.
+"""
+import multiprocessing
+import queue
+import sys
+import time
+import zlib
+
+from .update import replace
+
+# agents that can run several times side by side; the BGP speakers cannot open a
+# second session to the same peer from the same address (nor bind the same ports)
+PREFIX_SHARD_AGENTS = ('console', 'null')
+
+
+class Shard(object):
+    """The part of the prefix space a worker is responsible for."""
+
+    def __init__(self, index, count):
+        self.index = index
+        self.count = count
+
+    def mine(self, prefix):
+        return zlib.crc32(prefix.encode()) % self.count == self.index
+
+    def filter(self, update):
+        """Return update restricted to the prefixes of this shard, or None if none are left."""
+        nlri = [p for p in update.get('nlri') or [] if self.mine(p)]
+        withdraw = [p for p in update.get('withdraw') or [] if self.mine(p)]
+        if not nlri and not withdraw:
+            return None
+        return replace(update, nlri=nlri, withdraw=withdraw)
+
+
+def shard_configs(config, workers):
+    """Split config into one config per worker.
+
+    With at least as many peers as workers (or with --fanout) every worker
+    gets its own peers and the full update stream at the full rate and
+    count; there are no more workers than peers. Otherwise every worker
+    talks to all peers and sends the prefixes of its own shard, which only
+    the PREFIX_SHARD_AGENTS support, and the rate and count are split evenly.
+    """
+    peers = config['peers']
+    by_peer = config['fanout'] or len(peers) >= workers
+    if by_peer:
+        workers = min(workers, len(peers))
+    configs = []
+    for i in range(workers):
+        shard = dict(config, workers=1)
+        if by_peer:
+            shard['peers'] = peers[i::workers]
+        else:
+            shard['shard'] = (i, workers)
+            if config['rate']:
+                shard['rate'] = float(config['rate']) / workers
+            if config['count']:
+                shard['count'] = config['count'] // workers + (1 if i < config['count'] % workers else 0)
+        if config.get('metrics_port'):
+            shard['metrics_port'] = config['metrics_port'] + i
+        if config.get('seed') is not None:
+            shard['seed'] = config['seed'] + i
+        if config.get('record'):
+            shard['record'] = '%s.%d' % (config['record'], i)
+        if config.get('resume'):
+            shard['resume'] = '%s.%d' % (config['resume'], i)
+        configs.append(shard)
+    return configs
+
+
+def _worker_main(index, config, results):
+    from .bgpreplay import BgpUpdateGenerator
+    bgpgen = BgpUpdateGenerator(config)
+    try:
+        bgpgen.run()
+    finally:
+        pacer = bgpgen.pacer
+        started = pacer.start if pacer and pacer.start else None
+        results.put({
+            'worker': index,
+            'peers': ['%s:%s' % (ip, port) for ip, port, _ in config['peers']],
+            'shard': config.get('shard'),
+            'sent': pacer.sent if pacer else 0,
+            'elapsed': time.monotonic() - started if started else 0.0,
+            'report': pacer.report() if pacer else 'no updates sent',
+        })
+
+
+def run_workers(config, workers):
+    """Run one BgpUpdateGenerator per worker process and print the combined stats."""
+    configs = shard_configs(config, workers)
+    if not configs[0].get('shard'):
+        print('sharding by peer over %d workers' % len(configs))
+    elif config['agent'] not in PREFIX_SHARD_AGENTS:
+        print('%d workers need at least %d peers (or --fanout) with the %s agent: workers sharing '
+              'a peer would each open a session to it' % (workers, workers, config['agent']))
+        sys.exit(-1)
+    else:
+        print('sharding by prefix over %d workers' % len(configs))
+    results = multiprocessing.Queue()
+    procs = [multiprocessing.Process(target=_worker_main, args=(i, c, results),
+                                     name='bgpreplay-worker-%d' % i)
+             for i, c in enumerate(configs)]
+    for proc in procs:
+        proc.start()
+    stats = []
+    try:
+        for proc in procs:
+            proc.join()
+    except KeyboardInterrupt:
+        for proc in procs:
+            proc.join(10)
+    while True:
+        try:
+            stats.append(results.get(timeout=1))
+        except queue.Empty:
+            break
+    sent = 0
+    elapsed = 0.0
+    for s in sorted(stats, key=lambda s: s['worker']):
+        print('worker %(worker)d %(peers)s: %(report)s' % s)
+        sent += s['sent']
+        elapsed = max(elapsed, s['elapsed'])
+    print('all workers: sent %d updates in %.2fs, %.1f/s' % (
+        sent, elapsed, sent / elapsed if elapsed else 0.0))
+    return stats
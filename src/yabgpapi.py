@@ -0,0 +1,175 @@
+"""A pipelined client of the YaBGP REST API.
+
+YaBGP takes one update per POST to /v1/peer/<address>/send/update, so the
+client keeps several requests in flight and, while all of them are busy,
+merges the following updates into the next request.
+"""
+import json
+import logging
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+from requests.auth import HTTPBasicAuth
+
+from .metrics import Histogram
+
+logger = logging.getLogger('bgpreplay')
+
+AUTH = HTTPBasicAuth('admin', 'admin')
+HEADERS = {'content-type': 'application/json'}
+# prefixes per request; YaBGP sends each request as a single UPDATE message
+MAX_PREFIXES = 400
+
+
+class YaBGPClient(object):
+    """Post updates to YaBGP from window threads sharing a keep-alive connection pool.
+
+    send() hands a message ({'attr':..., 'nlri':..., 'withdraw':...}) to the
+    next free thread. While every thread is busy, messages with the same
+    attributes are merged into the one waiting, up to MAX_PREFIXES prefixes.
+    Messages touching a prefix that is still in flight wait for it, so
+    the announcements and withdrawals of a prefix stay in order.
+    """
+
+    def __init__(self, url, window=8):
+        self.url = url
+        self.window = max(1, window)
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.window)
+        self.session.mount('http://', adapter)
+        self.changed = threading.Condition()
+        self.waiting = None  # (peer, message, prefixes) waiting for a thread
+        self.in_flight = {}  # prefix -> number of requests in flight with it
+        self.busy = 0
+        self.stopping = False
+        self.threads = []
+        self.requests = self.updates = self.errors = 0
+        self.latency = Histogram()
+        self.transport = Histogram()
+        self.busy_time = 0.0
+        self.start_time = None
+
+    def get(self, path, timeout=None):
+        return self.session.get('%s/%s' % (self.url, path), auth=AUTH, timeout=timeout).json()
+
+    def wait_ready(self, timeout, alive):
+        """Probe the API until it answers; alive() is False once YaBGP has exited."""
+        deadline = time.monotonic() + timeout
+        while alive() and time.monotonic() < deadline:
+            try:
+                self.get('peers', timeout=1)
+                return True
+            except (requests.ConnectionError, requests.Timeout, ValueError):
+                time.sleep(0.05)
+        return False
+
+    def probe_transport(self, count=20):
+        """Time GET requests, which YaBGP answers without touching BGP: the cost of HTTP alone."""
+        for _ in range(count):
+            began = time.monotonic()
+            self.get('peers')
+            self.transport.observe(time.monotonic() - began)
+
+    def start(self):
+        self.start_time = time.monotonic()
+        for index in range(self.window):
+            thread = threading.Thread(target=self._run, name='yabgp-%d' % index, daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    def send(self, peer, message):
+        prefixes = (message.get('nlri') or []) + (message.get('withdraw') or [])
+        with self.changed:
+            waiting = self.waiting
+            if waiting is not None and self._merge(waiting, peer, message, prefixes):
+                self.updates += 1
+                return
+            while self.waiting is not None and not self.stopping:
+                self.changed.wait()
+            self.waiting = (peer, message, set(prefixes))
+            self.updates += 1
+            self.changed.notify_all()
+
+    @staticmethod
+    def _merge(waiting, peer, message, prefixes):
+        w_peer, w_message, w_prefixes = waiting
+        if peer != w_peer or len(w_prefixes) + len(prefixes) > MAX_PREFIXES:
+            return False
+        if (message.get('nlri') and w_message.get('nlri') and message['attr'] is not w_message['attr']
+                and message['attr'] != w_message['attr']):  # cached attributes are the same object
+            return False
+        if not w_prefixes.isdisjoint(prefixes):
+            return False
+        if message.get('nlri'):
+            w_message['attr'] = message['attr']
+            w_message.setdefault('nlri', []).extend(message['nlri'])
+        if message.get('withdraw'):
+            w_message.setdefault('withdraw', []).extend(message['withdraw'])
+        w_prefixes.update(prefixes)
+        return True
+
+    def _ready(self):
+        return self.waiting is not None and all(p not in self.in_flight for p in self.waiting[2])
+
+    def _run(self):
+        changed = self.changed
+        in_flight = self.in_flight
+        while True:
+            with changed:
+                while not self.stopping and not self._ready():
+                    changed.wait()
+                if self.stopping:
+                    return
+                peer, message, prefixes = self.waiting
+                self.waiting = None
+                for prefix in prefixes:
+                    in_flight[prefix] = in_flight.get(prefix, 0) + 1
+                self.busy += 1
+                changed.notify_all()
+            began = time.monotonic()
+            try:
+                res = self.session.post('%s/peer/%s/send/update' % (self.url, peer),
+                                        data=json.dumps(message), auth=AUTH, headers=HEADERS)
+                failed = res.status_code != 200
+            except requests.RequestException as e:
+                logger.error('YaBGP request failed: %s', e)
+                failed = True
+            elapsed = time.monotonic() - began
+            with changed:
+                self.requests += 1
+                self.errors += failed
+                self.latency.observe(elapsed)
+                self.busy_time += elapsed
+                for prefix in prefixes:
+                    if in_flight[prefix] == 1:
+                        del in_flight[prefix]
+                    else:
+                        in_flight[prefix] -= 1
+                self.busy -= 1
+                changed.notify_all()
+
+    def flush(self, timeout=60):
+        """Wait until all messages are posted."""
+        with self.changed:
+            return self.changed.wait_for(lambda: self.waiting is None and not self.busy, timeout)
+
+    def stop(self):
+        with self.changed:
+            self.stopping = True
+            self.changed.notify_all()
+        self.session.close()
+
+    def report(self):
+        elapsed = (time.monotonic() - self.start_time) if self.start_time else 0.0
+        line = 'yabgp: %d updates in %d requests (%d errors), %d in flight at most' % (
+            self.updates, self.requests, self.errors, self.window)
+        if self.latency.count:
+            line += ', request p50 %.1fms p99 %.1fms' % (self.latency.quantile(0.5) * 1000,
+                                                        self.latency.quantile(0.99) * 1000)
+        if self.transport.count:
+            line += ', HTTP alone p50 %.1fms' % (self.transport.quantile(0.5) * 1000)
+        if elapsed:
+            line += ', threads busy %.0f%%' % (100.0 * self.busy_time / (elapsed * self.window))
+        return line